@@ -0,0 +1,89 @@
+"""Shared helpers to run the benchmarks against a throwaway SQLite database."""
+
+import datetime as dt
+import os
+import random
+from pathlib import Path
+
+from django.core.management import call_command
+
+
+def setup_django(db_path: Path) -> None:
+    """Configure Django to use the SQLite database at `db_path` and migrate it."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "house_accounting.settings")
+
+    import django
+    from django.conf import settings
+
+    settings.DATABASES["default"]["NAME"] = db_path
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+def seed_transactions(
+    n_rows: int,
+    n_accounts: int,
+    date_fr: dt.date,
+    date_to: dt.date,
+    seed: int = 0,
+) -> list[int]:
+    """
+    Insert `n_rows` random transactions spread over `n_accounts` new accounts and refresh their balances.
+
+    Rows are inserted with raw `executemany` so that seeding millions of rows stays in the order of seconds.
+
+    :return: The primary keys of the created accounts.
+    """
+    from django.db import connection, transaction
+    from django.utils import timezone
+
+    from householdentities.models import Account, Institution
+    from transactions.models import Transaction
+    from transactions.services import DailyBalanceWriteService
+
+    rnd = random.Random(seed)
+    Account.objects.bulk_create(
+        Account(
+            natural_id=f"BENCH-{i}",
+            name=f"Benchmark Account {i}",
+            institution=Institution.TDCanada.value,
+            balance_initial=rnd.randint(0, 10_000),
+            date_start=date_fr,
+        )
+        for i in range(n_accounts)
+    )
+    account_ids = list(Account.objects.filter(natural_id__startswith="BENCH-").values_list("id", flat=True))
+
+    n_days = (date_to - date_fr).days + 1
+    now = timezone.now().isoformat()
+    table = Transaction._meta.db_table
+    sql = (
+        f"INSERT INTO {table} "
+        "(transaction_id_raw, transaction_id, account_id, amount, date, content_hash, created_at, updated_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+    )
+    batch_size = 50_000
+    # One transaction for the whole seed, autocommit would pay a journal sync per row
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(0, n_rows, batch_size):
+            cursor.executemany(
+                sql,
+                [
+                    (
+                        "BENCH",
+                        f"BENCH-{i}",
+                        account_ids[i % len(account_ids)],
+                        str(round(rnd.uniform(-500, 500), 2)),
+                        str(date_fr + dt.timedelta(days=rnd.randrange(n_days))),
+                        "",
+                        now,
+                        now,
+                    )
+                    for i in range(offset, min(offset + batch_size, n_rows))
+                ],
+            )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+    DailyBalanceWriteService().refresh_daily_balances({account_id: date_fr for account_id in account_ids})
+    return account_ids
@@ -0,0 +1,307 @@
+"""
+Load test the chart view and the balances API with concurrent clients, before and while `import_data` writes.
+
+Clients are threads calling the Django WSGI application in-process, as the threads of a threaded WSGI server
+would, each with its own SQLite connection. The database is seeded with synthetic transactions, then:
+1. `idle`: the clients run for `--duration` seconds.
+2. `import`: `import_data` imports exports generated by `generate_sample_data`, the clients run until it is done.
+
+For each phase, the latency percentiles, the throughput and the requests that failed, in particular on a locked
+SQLite database, are reported. The charts are cached by data version, so most requests are cache hits: with
+`--no-cache`, every request queries the balances, while the import writes.
+
+Usage:
+```
+python -m benchmarks.load --rows 1000000 --clients 8 --import-transactions 100000 --output bench-load.json
+```
+"""
+
+import argparse
+import datetime as dt
+import io
+import json
+import math
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+PATHS_DEFAULT = ["/", "/api/balances"]
+
+_local = threading.local()
+
+
+@dataclass
+class PhaseResult:
+    name: str
+    seconds: float
+    n_requests: int
+    n_errors: int
+    # Failed on "database is locked", or "database table is locked"
+    n_lock_errors: int
+    requests_per_second: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    import_seconds: float | None = None
+    import_error: str | None = None
+
+
+def percentile(values_sorted: list[float], q: float) -> float:
+    """Return the nearest-rank `q`-th percentile of sorted values."""
+    if not values_sorted:
+        return 0.0
+    return values_sorted[max(math.ceil(q / 100 * len(values_sorted)) - 1, 0)]
+
+
+def _on_request_exception(sender: Any, request: Any = None, **kwargs: Any) -> None:
+    from django.db import OperationalError
+
+    error = sys.exc_info()[1]
+    if isinstance(error, OperationalError) and "locked" in str(error):
+        _local.lock_error = True
+
+
+def call_wsgi(application: Callable, path: str) -> tuple[int, bool]:
+    """Request `path` from the WSGI application, and return the status code and whether the database was locked."""
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "HTTP_HOST": "localhost",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    status_line = ""
+
+    def start_response(status: str, headers: list, exc_info: Any = None) -> None:
+        nonlocal status_line
+        status_line = status
+
+    _local.lock_error = False
+    response = application(environ, start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        if hasattr(response, "close"):
+            response.close()
+    return int(status_line.split(" ", 1)[0]), _local.lock_error
+
+
+def run_clients(
+    application: Callable, paths: list[str], n_clients: int, stop: threading.Event
+) -> PhaseResult:
+    """Run `n_clients` clients requesting `paths` in turn until `stop` is set."""
+    from django.db import connections
+
+    latencies: list[float] = []
+    statuses: list[tuple[int, bool]] = []
+    results_lock = threading.Lock()
+
+    def run_client(i_client: int) -> None:
+        latencies_client: list[float] = []
+        statuses_client: list[tuple[int, bool]] = []
+        i = i_client
+        try:
+            while not stop.is_set():
+                time_start = time.perf_counter()
+                statuses_client.append(call_wsgi(application, paths[i % len(paths)]))
+                latencies_client.append(time.perf_counter() - time_start)
+                i += 1
+        finally:
+            connections.close_all()
+            with results_lock:
+                latencies.extend(latencies_client)
+                statuses.extend(statuses_client)
+
+    time_start = time.perf_counter()
+    threads = [threading.Thread(target=run_client, args=(i,)) for i in range(n_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - time_start
+
+    latencies.sort()
+    return PhaseResult(
+        name="",
+        seconds=seconds,
+        n_requests=len(statuses),
+        n_errors=sum(status != 200 for status, _ in statuses),
+        n_lock_errors=sum(lock_error for _, lock_error in statuses),
+        requests_per_second=len(statuses) / seconds if seconds else 0.0,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p95_ms=percentile(latencies, 95) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+    )
+
+
+def run_load_test(
+    import_dir: Path,
+    n_clients: int = 8,
+    duration: float = 5.0,
+    paths: list[str] | None = None,
+    cache: bool = True,
+) -> list[PhaseResult]:
+    """
+    Run the `idle` phase for `duration` seconds, then the `import` phase while `import_dir` is imported.
+
+    Expects Django to be set up with a database to read the balances from, see `benchmarks.common.setup_django`.
+
+    :param cache: Whether the chart results are cached, else the `charts` cache is a dummy one.
+    """
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.core.signals import got_request_exception
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connections
+    from django.test import override_settings
+
+    application = get_wsgi_application()
+    paths = paths or PATHS_DEFAULT
+    caches_settings = settings.CACHES
+    if not cache:
+        caches_settings = {
+            **caches_settings,
+            "charts": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+        }
+    got_request_exception.connect(_on_request_exception)
+    try:
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "localhost"], CACHES=caches_settings):
+            stop_idle = threading.Event()
+            threading.Timer(duration, stop_idle.set).start()
+            result_idle = run_clients(application, paths, n_clients, stop_idle)
+            result_idle.name = "idle"
+
+            stop_import = threading.Event()
+            import_result: dict[str, Any] = {}
+
+            def run_import() -> None:
+                time_start = time.perf_counter()
+                try:
+                    call_command("import_data", "--source-dir", str(import_dir))
+                except Exception as e:
+                    import_result["error"] = f"{e.__class__.__name__}: {e}"
+                finally:
+                    import_result["seconds"] = time.perf_counter() - time_start
+                    connections.close_all()
+                    stop_import.set()
+
+            import_thread = threading.Thread(target=run_import)
+            import_thread.start()
+            result_import = run_clients(application, paths, n_clients, stop_import)
+            import_thread.join()
+            result_import.name = "import"
+            result_import.import_seconds = import_result["seconds"]
+            result_import.import_error = import_result.get("error")
+    finally:
+        got_request_exception.disconnect(_on_request_exception)
+    return [result_idle, result_import]
+
+
+def seed_balances(n_rows: int, n_accounts: int, years: int) -> None:
+    """Seed transactions, and the config of the date range that the chart view shows by default."""
+    from benchmarks.common import seed_transactions
+    from config.services import ConfigWriteService, DataVersionService
+    from householdentities.services import EntityService
+    from transactions.services import TransactionReadService
+
+    date_to = dt.date(2025, 12, 31)
+    date_fr = date_to - dt.timedelta(days=365 * years)
+    seed_transactions(n_rows, n_accounts, date_fr, date_to)
+    data_version_service = DataVersionService()
+    data_version_service.bump_data_version()
+    config_service = ConfigWriteService(
+        entity_service=EntityService(),
+        transaction_service=TransactionReadService(),
+        data_version_service=data_version_service,
+    )
+    config_service.update_or_create_latest_config(date_fr=date_fr, date_to=date_to)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rows", type=int, default=100_000, help="Number of transactions to seed.")
+    parser.add_argument("--accounts", type=int, default=20, help="Number of accounts to seed.")
+    parser.add_argument("--years", type=int, default=5, help="Number of years of history to seed.")
+    parser.add_argument("--clients", type=int, default=8, help="Number of concurrent clients.")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of the phase without import.")
+    parser.add_argument(
+        "--import-transactions",
+        type=int,
+        default=100_000,
+        help="Number of transactions imported while the clients run, in new accounts.",
+    )
+    parser.add_argument("--paths", nargs="+", default=PATHS_DEFAULT, help="Paths requested in turn.")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not cache the chart results, so that every request queries the balances.",
+    )
+    parser.add_argument("--output", type=str, default=None, help="Path of the JSON results file.")
+    args = parser.parse_args(argv)
+
+    from django.core.management import call_command
+
+    from benchmarks.common import setup_django
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # A database file, an in-memory database would not be shared by the connections of the clients
+        setup_django(Path(tmp_dir) / "bench.sqlite3")
+
+        time_start = time.perf_counter()
+        seed_balances(args.rows, args.accounts, args.years)
+        n_accounts_import = 4
+        call_command(
+            "generate_sample_data",
+            *("--dest-dir", str(Path(tmp_dir) / "raw"), "--accounts", str(n_accounts_import), "--years", "1"),
+            *("--transactions-per-day", str(args.import_transactions / (n_accounts_import * 365))),
+        )
+        call_command(
+            "parse_data",
+            "--source-dir",
+            str(Path(tmp_dir) / "raw"),
+            "--dest-dir",
+            str(Path(tmp_dir) / "parsed"),
+        )
+        print(f"Prepared the data in {time.perf_counter() - time_start:.1f}s", file=sys.stderr)
+
+        results = run_load_test(
+            Path(tmp_dir) / "parsed",
+            n_clients=args.clients,
+            duration=args.duration,
+            paths=args.paths,
+            cache=not args.no_cache,
+        )
+
+    for result in results:
+        print(
+            f"{result.name:<8} {result.n_requests:>7} requests {result.requests_per_second:>8.1f} req/s "
+            f"p50 {result.p50_ms:>8.1f} ms  p95 {result.p95_ms:>8.1f} ms  p99 {result.p99_ms:>8.1f} ms  "
+            f"errors {result.n_errors} (locked: {result.n_lock_errors})"
+        )
+        if result.import_seconds is not None:
+            print(f"{'':<8} import_data took {result.import_seconds:.1f}s, error: {result.import_error}")
+
+    if args.output:
+        payload = {"options": vars(args), "results": [asdict(result) for result in results]}
+        Path(args.output).write_text(json.dumps(payload, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Time the import pipeline and the chart paths on synthetic data, from the raw bank exports to the chart view.
+
+For each size, raw exports of about that many transactions are generated by `generate_sample_data`, then
+`parse_data`, `import_data`, `ChartService.get_value_over_dates` and the chart view are timed against a
+throwaway database.
+
+Usage:
+```
+python -m benchmarks.pipeline --sizes 10000 100000 1000000 --output bench-pipeline.json
+```
+The data only depends on the options, so runs before and after a change are comparable.
+"""
+
+import argparse
+import datetime as dt
+import json
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from importing.stats import get_peak_rss_kb
+
+DATE_TO = dt.date(2025, 12, 31)
+
+
+@dataclass
+class PipelineResult:
+    name: str
+    n_transactions: int
+    # Best of the runs, and the first run, e.g. before the chart cache is warm
+    seconds: float
+    seconds_first: float
+    peak_rss_kb: int
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.n_transactions / self.seconds if self.seconds else 0.0
+
+
+def measure(name: str, n_transactions: int, func: Callable[[], Any], repeat: int = 1) -> PipelineResult:
+    """Run `func` `repeat` times, keep the best and the first time."""
+    times = []
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - time_start)
+    return PipelineResult(
+        name=name,
+        n_transactions=n_transactions,
+        seconds=min(times),
+        seconds_first=times[0],
+        peak_rss_kb=get_peak_rss_kb(),
+    )
+
+
+def run_pipeline(
+    work_dir: Path,
+    n_transactions: int,
+    n_accounts: int = 20,
+    years: int = 5,
+    workers: int = 1,
+    repeat: int = 3,
+    seed: int = 0,
+) -> list[PipelineResult]:
+    """
+    Generate about `n_transactions` transactions in `work_dir`, then time each stage of the pipeline.
+
+    Expects Django to be set up with an empty database, see `benchmarks.common.setup_django`.
+    """
+    from django.core.management import call_command
+    from django.conf import settings
+    from django.test import Client, override_settings
+
+    from charts.services import ChartService
+    from householdentities.services import EntityService
+    from transactions.models import Transaction
+    from transactions.services import TransactionReadService
+
+    raw_dir = work_dir / "raw"
+    parsed_dir = work_dir / "parsed"
+    n_days = 365 * years
+    call_command(
+        "generate_sample_data",
+        *("--dest-dir", str(raw_dir), "--accounts", str(n_accounts), "--years", str(years)),
+        *("--transactions-per-day", str(n_transactions / (n_accounts * n_days))),
+        *("--date-to", DATE_TO.isoformat(), "--seed", str(seed)),
+    )
+
+    results = [
+        measure(
+            "parse_data",
+            n_transactions,
+            lambda: call_command(
+                "parse_data",
+                *("--source-dir", str(raw_dir), "--dest-dir", str(parsed_dir), "--workers", str(workers)),
+            ),
+        ),
+        measure(
+            "import_data",
+            n_transactions,
+            lambda: call_command("import_data", "--source-dir", str(parsed_dir), "--workers", str(workers)),
+        ),
+    ]
+    # The actual count, the generated transactions per day are random
+    n_transactions = Transaction.objects.count()
+    for result in results:
+        result.n_transactions = n_transactions
+
+    # The whole history, as on the dashboard by default
+    accounts = EntityService().get_all_account_ids()
+    date_fr = DATE_TO - dt.timedelta(days=n_days - 1)
+    chart_service = ChartService(transaction_service=TransactionReadService(), entity_service=EntityService())
+    results.append(
+        measure(
+            "ChartService.get_value_over_dates",
+            n_transactions,
+            lambda: chart_service.get_value_over_dates(accounts=accounts, date_fr=date_fr, date_to=DATE_TO),
+            repeat,
+        )
+    )
+
+    # The view through the whole request cycle, the ETag of the previous response is not sent
+    client = Client()
+
+    def get_chart_view() -> None:
+        response = client.get("/")
+        assert response.status_code == 200, response.status_code
+
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+        results.append(measure("CurrentBalancesChartView", n_transactions, get_chart_view, repeat))
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 1_000_000],
+        help="Numbers of transactions to benchmark, each against a new database.",
+    )
+    parser.add_argument("--accounts", type=int, default=20, help="Number of accounts.")
+    parser.add_argument("--years", type=int, default=5, help="Number of years of history.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes parsing the files.")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of runs of the chart paths, the best is kept."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated data.")
+    parser.add_argument("--output", type=str, default=None, help="Path of the JSON results file.")
+    args = parser.parse_args(argv)
+
+    from benchmarks.common import setup_django
+
+    results: list[PipelineResult] = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # A new database per size, Django is only set up once so the next ones are migrated by hand
+            db_path = Path(tmp_dir) / "bench.sqlite3"
+            if size == args.sizes[0]:
+                setup_django(db_path)
+            else:
+                _switch_database(db_path)
+            time_start = time.perf_counter()
+            results_size = run_pipeline(
+                Path(tmp_dir),
+                size,
+                n_accounts=args.accounts,
+                years=args.years,
+                workers=args.workers,
+                repeat=args.repeat,
+                seed=args.seed,
+            )
+            print(f"Ran {size} transactions in {time.perf_counter() - time_start:.1f}s", file=sys.stderr)
+            results += results_size
+
+    for result in results:
+        print(
+            f"{result.name:<40} {result.n_transactions:>10} rows {result.seconds * 1000:>12.2f} ms "
+            f"{result.rows_per_second:>12.0f} rows/s"
+        )
+
+    if args.output:
+        payload = {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "options": vars(args),
+            "results": [{**asdict(result), "rows_per_second": result.rows_per_second} for result in results],
+        }
+        Path(args.output).write_text(json.dumps(payload, indent=2))
+    return 0
+
+
+def _switch_database(db_path: Path) -> None:
+    from django.core.cache import caches
+    from django.core.management import call_command
+    from django.db import connection
+
+    connection.close()
+    connection.settings_dict["NAME"] = db_path
+    # The chart cache is keyed by the data version, which starts over with the new database
+    for cache in caches.all():
+        cache.clear()
+    call_command("migrate", verbosity=0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+Record `EXPLAIN QUERY PLAN` output and timings of the transaction and chart queries.
+
+Usage:
+```
+python -m benchmarks.query_plans --rows 1000000 --output bench-query-plans.json [--check]
+```
+With `--check`, exit with a non-zero status if any query does a full scan of a watched table,
+so that index regressions get caught.
+"""
+
+import argparse
+import datetime as dt
+import json
+import re
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+TABLES_WATCHED = ("transactions_transaction", "transactions_dailybalance")
+
+_FULL_SCAN_PATTERN = re.compile(r"^SCAN (\w+)$")
+
+
+@dataclass
+class QueryPlan:
+    name: str
+    seconds: float
+    queries: list[str] = field(default_factory=list)
+    plans: list[list[str]] = field(default_factory=list)
+    full_scans: list[str] = field(default_factory=list)
+
+
+def explain(sql: str) -> list[str]:
+    """Return the `EXPLAIN QUERY PLAN` details of an (already interpolated) SQLite query."""
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def measure(
+    name: str, func: Callable[[], Any], repeat: int = 3, full_scan_expected: bool = False
+) -> QueryPlan:
+    """
+    Run `func` `repeat` times, keep the best time and the query plans of the queries it ran.
+
+    Queries that read every row anyway (`full_scan_expected`) are not reported as full scans.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    seconds = float("inf")
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            time_start = time.perf_counter()
+            func()
+            seconds = min(seconds, time.perf_counter() - time_start)
+
+    result = QueryPlan(name=name, seconds=seconds)
+    for query in ctx.captured_queries:
+        sql = query["sql"]
+        if not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        plan = explain(sql)
+        result.queries.append(sql)
+        result.plans.append(plan)
+        for detail in plan:
+            match = _FULL_SCAN_PATTERN.match(detail)
+            if match and match.group(1) in TABLES_WATCHED and not full_scan_expected:
+                result.full_scans.append(detail)
+    return result
+
+
+def collect_query_plans(
+    accounts: list[int], date_fr: dt.date, date_to: dt.date, repeat: int = 3
+) -> list[QueryPlan]:
+    """Measure every read query of `transactions/services.py` and `charts/services.py`."""
+    from charts.services import ChartService, ChartServiceNumPy, Resolution, np
+    from householdentities.services import EntityService
+    from transactions.services import TransactionReadService
+
+    trx_service = TransactionReadService()
+    chart_service = ChartService(transaction_service=trx_service, entity_service=EntityService())
+    window = dict(accounts=accounts, date_fr=date_fr, date_to=date_to)
+
+    results = [
+        measure(
+            "TransactionReadService.get_transactions_for_accounts",
+            lambda: list(trx_service.get_transactions_for_accounts(accounts=accounts)),
+            repeat,
+            full_scan_expected=True,
+        ),
+        measure(
+            "TransactionReadService.get_amount_total_before",
+            lambda: trx_service.get_amount_total_before(accounts=accounts, date=date_fr),
+            repeat,
+        ),
+        measure(
+            "TransactionReadService.get_amount_by_date",
+            lambda: trx_service.get_amount_by_date(**window),
+            repeat,
+        ),
+        measure(
+            "TransactionReadService.get_amount_by_account_date",
+            lambda: list(trx_service.get_amount_by_account_date(**window)),
+            repeat,
+        ),
+        measure(
+            "TransactionReadService.get_balance_as_of",
+            lambda: trx_service.get_balance_as_of(accounts=accounts, date=date_fr),
+            repeat,
+        ),
+        measure(
+            "TransactionReadService.get_closing_balance_before",
+            lambda: trx_service.get_closing_balance_before(accounts=accounts, date=date_fr),
+            repeat,
+        ),
+        measure(
+            "TransactionReadService.get_closing_balances",
+            lambda: list(trx_service.get_closing_balances(**window)),
+            repeat,
+        ),
+        *(
+            measure(
+                f"TransactionReadService.get_net_flow_by_account_period[{kind}]",
+                lambda kind=kind: list(trx_service.get_net_flow_by_account_period(**window, kind=kind)),
+                repeat,
+            )
+            for kind in ("day", "week", "month")
+        ),
+        measure(
+            "TransactionReadService.get_earliest_latest_date",
+            trx_service.get_earliest_latest_date,
+            repeat,
+        ),
+        measure(
+            "ChartService.get_value_over_dates",
+            lambda: chart_service.get_value_over_dates(**window),
+            repeat,
+        ),
+        measure(
+            "ChartService.get_balance_over_dates",
+            lambda: chart_service.get_balance_over_dates(**window),
+            repeat,
+        ),
+        measure(
+            "ChartService.get_value_over_dates_by_account",
+            lambda: chart_service.get_value_over_dates_by_account(**window),
+            repeat,
+        ),
+        measure(
+            "ChartService.get_balance_over_dates_by_account",
+            lambda: chart_service.get_balance_over_dates_by_account(**window),
+            repeat,
+        ),
+        *(
+            measure(
+                f"ChartService.get_balance_over_periods_by_account[{resolution}]",
+                lambda resolution=resolution: chart_service.get_balance_over_periods_by_account(
+                    **window, resolution=resolution
+                ),
+                repeat,
+            )
+            for resolution in (Resolution.day, Resolution.week, Resolution.month)
+        ),
+    ]
+
+    if np is not None:
+        chart_service_numpy = ChartServiceNumPy(
+            transaction_service=trx_service, entity_service=EntityService()
+        )
+        results += [
+            measure(
+                "ChartServiceNumPy.get_value_over_dates",
+                lambda: chart_service_numpy.get_value_over_dates(**window),
+                repeat,
+            ),
+            measure(
+                "ChartServiceNumPy.get_balance_over_dates",
+                lambda: chart_service_numpy.get_balance_over_dates(**window),
+                repeat,
+            ),
+        ]
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Number of transactions to seed.")
+    parser.add_argument("--accounts", type=int, default=20, help="Number of accounts to seed.")
+    parser.add_argument("--years", type=int, default=10, help="Number of years of history to seed.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per query, the best is kept.")
+    parser.add_argument("--output", type=str, default=None, help="Path of the JSON results file.")
+    parser.add_argument("--check", action="store_true", help="Fail on full scans of watched tables.")
+    args = parser.parse_args(argv)
+
+    from benchmarks.common import seed_transactions, setup_django
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        setup_django(Path(tmp_dir) / "bench.sqlite3")
+
+        date_to = dt.date(2025, 12, 31)
+        date_fr = date_to - dt.timedelta(days=365 * args.years)
+        time_start = time.perf_counter()
+        accounts = seed_transactions(args.rows, args.accounts, date_fr, date_to)
+        print(f"Seeded {args.rows} transactions in {time.perf_counter() - time_start:.1f}s", file=sys.stderr)
+
+        # A one-month window at the end of the history, the typical dashboard query
+        results = collect_query_plans(accounts, date_to.replace(day=1), date_to, repeat=args.repeat)
+
+    for result in results:
+        print(f"{result.name:<60} {result.seconds * 1000:>10.2f} ms")
+        for plan in result.plans:
+            for detail in plan:
+                print(f"    {detail}")
+
+    if args.output:
+        payload = {"rows": args.rows, "accounts": args.accounts, "results": [asdict(r) for r in results]}
+        Path(args.output).write_text(json.dumps(payload, indent=2))
+
+    full_scans = [(result.name, scan) for result in results for scan in result.full_scans]
+    if args.check and full_scans:
+        for name, scan in full_scans:
+            print(f"Full scan in {name}: {scan}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
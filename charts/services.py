@@ -1,12 +1,30 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
 import datetime as dt
 import decimal
 from email.policy import default
-from typing import Iterator, Protocol
+import enum
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Iterator, Protocol
 
+from django.core.cache import caches
+
+from config.services import DataVersionService
 from householdentities.services import EntityService
 from transactions.services import TransactionReadService
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Amounts are stored with 4 decimal places, the vectorized engine works in these minor units to stay exact
+AMOUNT_SCALE = 4
+
 
 class ITransactionInput(Protocol):
     transaction_id: str
@@ -14,6 +32,25 @@ class ITransactionInput(Protocol):
     date: dt.date
 
 
+# Upper bound of points per series sent to the charts
+MAX_POINTS_DEFAULT = 500
+
+
+class Resolution(enum.StrEnum):
+    day = "day"
+    week = "week"
+    month = "month"
+    auto = "auto"
+
+
+@dataclass
+class BalancesByAccount:
+    series_by_account: dict[int, list[tuple[int, decimal.Decimal]]]
+    total: list[tuple[int, decimal.Decimal]] | None
+    # Date of each point, filled in by the methods that don't return one point per day
+    dates: list[dt.date] = field(default_factory=list)
+
+
 class ChartService:
     def __init__(self, transaction_service: TransactionReadService, entity_service: EntityService):
         self._trx_service = transaction_service
@@ -29,21 +66,26 @@ class ChartService:
         mv_init_by_account = self._entity_service.get_amount_initial_map(
             accounts,
         )
+        # Opening balance: everything that happened before `date_fr` is carried in as a single value. Summed from
+        # the transactions rather than read from the balance checkpoints, this is the reference they are checked
+        # against
+        mv: decimal.Decimal = self._trx_service.get_amount_total_before(accounts=accounts, date=date_fr)
         mv_init_by_date: dict[dt.date, decimal.Decimal] = defaultdict(decimal.Decimal)
         for date_start, amount_initial in mv_init_by_account.values():
-            mv_init_by_date[date_start] += amount_initial
+            if date_start < date_fr:
+                mv += amount_initial
+            else:
+                mv_init_by_date[date_start] += amount_initial
 
-        mv_by_date: dict[dt.date, decimal.Decimal] = defaultdict(decimal.Decimal)
-        trx_iter = self._trx_service.get_transactions_for_accounts(
+        mv_by_date: dict[dt.date, decimal.Decimal] = self._trx_service.get_amount_by_date(
             accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
         )
-        for trx in trx_iter:
-            mv_by_date[trx.date] += trx.amount
 
         dates: list[dt.date] = [date_fr + dt.timedelta(days=i) for i in range((date_to - date_fr).days + 1)]
 
         result = []
-        mv: decimal.Decimal = decimal.Decimal()
         for i, date_value in enumerate(dates):
             if date_value in mv_init_by_date:
                 mv += mv_init_by_date[date_value]
@@ -52,3 +94,520 @@ class ChartService:
             result.append((i, mv))
 
         return result
+
+    def get_value_over_dates_by_account(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+        with_total: bool = True,
+    ) -> BalancesByAccount:
+        """Same as `get_value_over_dates`, but one series per account, from a single grouped query."""
+        mv_init_by_account: dict[int, tuple[dt.date, decimal.Decimal]]
+        mv_init_by_account = self._entity_service.get_amount_initial_map(
+            accounts,
+        )
+        mv_opening_by_account: dict[int, decimal.Decimal] = self._trx_service.get_balance_as_of(
+            accounts=accounts,
+            date=date_fr - dt.timedelta(days=1),
+        )
+        mv_by_account_date: dict[int, dict[dt.date, decimal.Decimal]] = defaultdict(
+            lambda: defaultdict(decimal.Decimal)
+        )
+        for account_id, (date_start, amount_initial) in mv_init_by_account.items():
+            if date_start >= date_fr:
+                mv_by_account_date[account_id][date_start] += amount_initial
+
+        for account_id, date_value, amount in self._trx_service.get_amount_by_account_date(
+            accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
+        ):
+            mv_by_account_date[account_id][date_value] += amount
+
+        dates: list[dt.date] = [date_fr + dt.timedelta(days=i) for i in range((date_to - date_fr).days + 1)]
+
+        series_by_account: dict[int, list[tuple[int, decimal.Decimal]]] = {}
+        for account_id in accounts:
+            if account_id not in mv_init_by_account:
+                continue
+            mv: decimal.Decimal = mv_opening_by_account.get(account_id, decimal.Decimal())
+            mv_by_date = mv_by_account_date.get(account_id, {})
+            series = []
+            for i, date_value in enumerate(dates):
+                if date_value in mv_by_date:
+                    mv += mv_by_date[date_value]
+                series.append((i, mv))
+            series_by_account[account_id] = series
+
+        return BalancesByAccount(
+            series_by_account=series_by_account,
+            total=_sum_series(series_by_account, len(dates)) if with_total else None,
+        )
+
+    def get_balance_over_dates(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+    ) -> list[tuple[int, decimal.Decimal]]:
+        """Same as `get_value_over_dates`, but read from the pre-computed daily balances."""
+        closing_by_account: dict[int, decimal.Decimal] = self._trx_service.get_closing_balance_before(
+            accounts=accounts,
+            date=date_fr,
+        )
+        mv: decimal.Decimal = sum(closing_by_account.values(), decimal.Decimal())
+
+        mv_delta_by_date: dict[dt.date, decimal.Decimal] = defaultdict(decimal.Decimal)
+        for account_id, date_value, closing_balance in self._trx_service.get_closing_balances(
+            accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
+        ):
+            mv_delta_by_date[date_value] += closing_balance - closing_by_account.get(
+                account_id, decimal.Decimal()
+            )
+            closing_by_account[account_id] = closing_balance
+
+        dates: list[dt.date] = [date_fr + dt.timedelta(days=i) for i in range((date_to - date_fr).days + 1)]
+
+        result = []
+        for i, date_value in enumerate(dates):
+            if date_value in mv_delta_by_date:
+                mv += mv_delta_by_date[date_value]
+            result.append((i, mv))
+
+        return result
+
+    def get_balance_over_dates_by_account(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+        with_total: bool = True,
+    ) -> BalancesByAccount:
+        """Same as `get_value_over_dates_by_account`, but read from the pre-computed daily balances."""
+        accounts_existing = self._entity_service.get_account_name_map(accounts)
+        closing_by_account: dict[int, decimal.Decimal] = self._trx_service.get_closing_balance_before(
+            accounts=accounts,
+            date=date_fr,
+        )
+        closing_by_account_date: dict[int, dict[dt.date, decimal.Decimal]] = defaultdict(dict)
+        for account_id, date_value, closing_balance in self._trx_service.get_closing_balances(
+            accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
+        ):
+            closing_by_account_date[account_id][date_value] = closing_balance
+
+        dates: list[dt.date] = [date_fr + dt.timedelta(days=i) for i in range((date_to - date_fr).days + 1)]
+
+        series_by_account: dict[int, list[tuple[int, decimal.Decimal]]] = {}
+        for account_id in accounts:
+            if account_id not in accounts_existing:
+                continue
+            mv: decimal.Decimal = closing_by_account.get(account_id, decimal.Decimal())
+            closing_by_date = closing_by_account_date.get(account_id, {})
+            series = []
+            for i, date_value in enumerate(dates):
+                mv = closing_by_date.get(date_value, mv)
+                series.append((i, mv))
+            series_by_account[account_id] = series
+
+        return BalancesByAccount(
+            series_by_account=series_by_account,
+            total=_sum_series(series_by_account, len(dates)) if with_total else None,
+        )
+
+    def get_balance_over_periods_by_account(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+        resolution: Resolution = Resolution.auto,
+        max_points: int = MAX_POINTS_DEFAULT,
+        with_total: bool = True,
+    ) -> BalancesByAccount:
+        """
+        Same as `get_balance_over_dates_by_account`, but one point per day, week or month.
+
+        Each point is the balance at the end of its period (or at `date_to` for the last one) and is dated
+        accordingly. The net flows are grouped per period in SQL, so the work depends on the number of periods
+        rather than days. `Resolution.auto` picks the finest resolution that fits in `max_points`, and the
+        result is then capped at `max_points` with `downsample_min_max`.
+        """
+        if resolution == Resolution.auto:
+            resolution = _resolution_auto(date_fr, date_to, max_points)
+        period_starts: list[dt.date] = _period_starts(date_fr, date_to, resolution)
+        dates: list[dt.date] = [period_start - dt.timedelta(days=1) for period_start in period_starts[1:]]
+        dates.append(date_to)
+
+        series_by_account, total = self._get_series_over_periods(
+            accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
+            resolution=resolution,
+            period_starts=period_starts,
+        )
+        balances = BalancesByAccount(series_by_account=series_by_account, total=total, dates=dates)
+        assert balances.total is not None
+        if len(dates) > max_points:
+            indices = downsample_min_max([mv for _, mv in balances.total], max_points)
+            balances = BalancesByAccount(
+                series_by_account={
+                    account_id: [(i, series[j][1]) for i, j in enumerate(indices)]
+                    for account_id, series in series_by_account.items()
+                },
+                total=[(i, balances.total[j][1]) for i, j in enumerate(indices)],
+                dates=[dates[j] for j in indices],
+            )
+        if not with_total:
+            balances.total = None
+        return balances
+
+    def _get_series_over_periods(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+        resolution: Resolution,
+        period_starts: list[dt.date],
+    ) -> tuple[dict[int, list[tuple[int, decimal.Decimal]]], list[tuple[int, decimal.Decimal]]]:
+        """Return the balance at the end of each period per account, and their total."""
+        mv_init_by_account: dict[int, tuple[dt.date, decimal.Decimal]]
+        mv_init_by_account = self._entity_service.get_amount_initial_map(accounts)
+        closing_by_account: dict[int, decimal.Decimal] = self._trx_service.get_closing_balance_before(
+            accounts=accounts,
+            date=date_fr,
+        )
+        period_index: dict[dt.date, int] = {period_start: i for i, period_start in enumerate(period_starts)}
+        mv_by_account_period: dict[int, dict[int, decimal.Decimal]] = defaultdict(
+            lambda: defaultdict(decimal.Decimal)
+        )
+        for account_id, (date_start, amount_initial) in mv_init_by_account.items():
+            if date_fr <= date_start <= date_to:
+                period_start = max(_period_start(date_start, resolution), date_fr)
+                mv_by_account_period[account_id][period_index[period_start]] += amount_initial
+        for account_id, period_start, net_flow in self._trx_service.get_net_flow_by_account_period(
+            accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
+            kind=resolution.value,
+        ):
+            mv_by_account_period[account_id][period_index[max(period_start, date_fr)]] += net_flow
+
+        series_by_account: dict[int, list[tuple[int, decimal.Decimal]]] = {}
+        for account_id in accounts:
+            if account_id not in mv_init_by_account:
+                continue
+            mv: decimal.Decimal = closing_by_account.get(account_id, decimal.Decimal())
+            mv_by_period = mv_by_account_period.get(account_id, {})
+            series = []
+            for i in range(len(period_starts)):
+                if i in mv_by_period:
+                    mv += mv_by_period[i]
+                series.append((i, mv))
+            series_by_account[account_id] = series
+
+        return series_by_account, _sum_series(series_by_account, len(period_starts))
+
+
+def downsample_min_max(values: list[decimal.Decimal], max_points: int) -> list[int]:
+    """
+    Return the sorted indices of at most `max_points` values to keep, preserving the shape of the series.
+
+    The values are split into buckets and the minimum and maximum of each bucket are kept, as well as the
+    first and last value, so that peaks and troughs survive the downsampling.
+    """
+    if len(values) <= max_points:
+        return list(range(len(values)))
+    assert max_points >= 4, "At least 4 points are needed to keep both ends and a min/max bucket"
+
+    n_buckets = (max_points - 2) // 2
+    indices: set[int] = {0, len(values) - 1}
+    bucket_size = (len(values) - 2) / n_buckets
+    for bucket in range(n_buckets):
+        start = 1 + int(bucket * bucket_size)
+        end = 1 + int((bucket + 1) * bucket_size)
+        if start >= end:
+            continue
+        bucket_indices = range(start, end)
+        indices.add(min(bucket_indices, key=values.__getitem__))
+        indices.add(max(bucket_indices, key=values.__getitem__))
+    return sorted(indices)
+
+
+def _period_start(date_value: dt.date, resolution: Resolution) -> dt.date:
+    match resolution:
+        case Resolution.day:
+            return date_value
+        case Resolution.week:
+            return date_value - dt.timedelta(days=date_value.weekday())
+        case Resolution.month:
+            return date_value.replace(day=1)
+        case _:
+            raise ValueError(f"Unsupported resolution: {resolution}")
+
+
+def _period_starts(date_fr: dt.date, date_to: dt.date, resolution: Resolution) -> list[dt.date]:
+    """Return the first day of each period overlapping [date_fr, date_to], the first one clamped to date_fr."""
+    period_starts: list[dt.date] = [date_fr]
+    period_start = _period_start(date_fr, resolution)
+    while True:
+        match resolution:
+            case Resolution.month:
+                period_start = (period_start + dt.timedelta(days=31)).replace(day=1)
+            case Resolution.week:
+                period_start += dt.timedelta(days=7)
+            case _:
+                period_start += dt.timedelta(days=1)
+        if period_start > date_to:
+            return period_starts
+        period_starts.append(period_start)
+
+
+def _resolution_auto(date_fr: dt.date, date_to: dt.date, max_points: int) -> Resolution:
+    n_days = (date_to - date_fr).days + 1
+    if n_days <= max_points:
+        return Resolution.day
+    if n_days // 7 + 1 <= max_points:
+        return Resolution.week
+    return Resolution.month
+
+
+def _sum_series(
+    series_by_account: dict[int, list[tuple[int, decimal.Decimal]]], n_dates: int
+) -> list[tuple[int, decimal.Decimal]]:
+    return [
+        (i, sum((series[i][1] for series in series_by_account.values()), decimal.Decimal()))
+        for i in range(n_dates)
+    ]
+
+
+class ChartServiceNumPy(ChartService):
+    """
+    Vectorized variant of `ChartService`, requires NumPy.
+
+    Per-date amounts are loaded as `(day offset, amount in minor units)` int64 pairs, scattered into the daily
+    grid with `np.add.at` and turned into running balances with `np.cumsum`. The results are exactly equal to
+    the ones of the Decimal engine.
+    """
+
+    def __init__(self, transaction_service: TransactionReadService, entity_service: EntityService):
+        assert np is not None, (
+            "NumPy is required for ChartServiceNumPy, install it with `uv sync --extra numpy`"
+        )
+        super().__init__(transaction_service=transaction_service, entity_service=entity_service)
+
+    def get_value_over_dates(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+    ) -> list[tuple[int, decimal.Decimal]]:
+        mv_opening = self._trx_service.get_amount_total_before(accounts=accounts, date=date_fr)
+        offsets: list[int] = []
+        amounts: list[decimal.Decimal] = []
+        for date_start, amount_initial in self._entity_service.get_amount_initial_map(accounts).values():
+            if date_start < date_fr:
+                mv_opening += amount_initial
+            elif date_start <= date_to:
+                offsets.append((date_start - date_fr).days)
+                amounts.append(amount_initial)
+        for date_value, amount in self._trx_service.get_amount_by_date(
+            accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
+        ).items():
+            offsets.append((date_value - date_fr).days)
+            amounts.append(amount)
+
+        grid = np.zeros((date_to - date_fr).days + 1, dtype=np.int64)
+        np.add.at(grid, np.array(offsets, dtype=np.int64), _to_units(amounts))
+        return _from_units(_to_units([mv_opening])[0] + np.cumsum(grid))
+
+    def get_balance_over_dates(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+    ) -> list[tuple[int, decimal.Decimal]]:
+        closing_by_account = self._trx_service.get_closing_balance_before(accounts=accounts, date=date_fr)
+        rows = list(
+            self._trx_service.get_closing_balances(accounts=accounts, date_fr=date_fr, date_to=date_to)
+        )
+
+        grid = np.zeros((date_to - date_fr).days + 1, dtype=np.int64)
+        if rows:
+            account_ids = np.array([account_id for account_id, _, _ in rows], dtype=np.int64)
+            offsets = np.array([(date_value - date_fr).days for _, date_value, _ in rows], dtype=np.int64)
+            closing = _to_units([closing_balance for _, _, closing_balance in rows])
+
+            # Order by account then date, so that each row's delta is its closing minus the previous one
+            order = np.lexsort((offsets, account_ids))
+            account_ids, offsets, closing = account_ids[order], offsets[order], closing[order]
+            closing_prev = np.empty_like(closing)
+            closing_prev[1:] = closing[:-1]
+            is_first = np.ones(len(closing), dtype=bool)
+            is_first[1:] = account_ids[1:] != account_ids[:-1]
+            closing_prev[is_first] = _to_units(
+                [
+                    closing_by_account.get(int(account_id), decimal.Decimal())
+                    for account_id in account_ids[is_first]
+                ]
+            )
+            np.add.at(grid, offsets, closing - closing_prev)
+
+        mv_opening = sum(closing_by_account.values(), decimal.Decimal())
+        return _from_units(_to_units([mv_opening])[0] + np.cumsum(grid))
+
+    def _get_series_over_periods(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+        resolution: Resolution,
+        period_starts: list[dt.date],
+    ) -> tuple[dict[int, list[tuple[int, decimal.Decimal]]], list[tuple[int, decimal.Decimal]]]:
+        # One row per account and one column per period, the balances are the running sums along the rows
+        mv_init_by_account = self._entity_service.get_amount_initial_map(accounts)
+        account_ids: list[int] = [
+            account_id for account_id in dict.fromkeys(accounts) if account_id in mv_init_by_account
+        ]
+        row_by_account: dict[int, int] = {account_id: i for i, account_id in enumerate(account_ids)}
+        period_index: dict[dt.date, int] = {period_start: i for i, period_start in enumerate(period_starts)}
+        closing_by_account = self._trx_service.get_closing_balance_before(accounts=accounts, date=date_fr)
+
+        rows: list[int] = []
+        columns: list[int] = []
+        amounts: list[decimal.Decimal] = []
+        for account_id, (date_start, amount_initial) in mv_init_by_account.items():
+            if date_fr <= date_start <= date_to:
+                rows.append(row_by_account[account_id])
+                columns.append(period_index[max(_period_start(date_start, resolution), date_fr)])
+                amounts.append(amount_initial)
+        for account_id, period_start, net_flow in self._trx_service.get_net_flow_by_account_period(
+            accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
+            kind=resolution.value,
+        ):
+            if account_id in row_by_account:
+                rows.append(row_by_account[account_id])
+                columns.append(period_index[max(period_start, date_fr)])
+                amounts.append(net_flow)
+
+        grid = np.zeros((len(account_ids), len(period_starts)), dtype=np.int64)
+        np.add.at(
+            grid, (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)), _to_units(amounts)
+        )
+        mv_opening = _to_units(
+            [closing_by_account.get(account_id, decimal.Decimal()) for account_id in account_ids]
+        )
+        balances = mv_opening[:, np.newaxis] + np.cumsum(grid, axis=1)
+        series_by_account = {account_id: _from_units(balances[i]) for i, account_id in enumerate(account_ids)}
+        return series_by_account, _from_units(balances.sum(axis=0))
+
+
+def _to_units(amounts: list[decimal.Decimal]) -> "np.ndarray":
+    return np.array([int(amount.scaleb(AMOUNT_SCALE)) for amount in amounts], dtype=np.int64)
+
+
+def _from_units(units: "np.ndarray") -> list[tuple[int, decimal.Decimal]]:
+    return [(i, decimal.Decimal(value).scaleb(-AMOUNT_SCALE)) for i, value in enumerate(units.tolist())]
+
+
+def create_chart_service(
+    transaction_service: TransactionReadService, entity_service: EntityService
+) -> ChartService:
+    """Return the vectorized chart service if NumPy is installed, else the Decimal one."""
+    chart_service_class = ChartServiceNumPy if np is not None else ChartService
+    return chart_service_class(transaction_service=transaction_service, entity_service=entity_service)
+
+
+class CachedChartService:
+    """
+    Cache layer in front of a `ChartService`, on the Django cache configured as `cache_alias`.
+
+    Keys cover the method, the account set, the date range, the resolution parameters and the global data
+    version. The data version is bumped by `import_data` and by config updates, so stale results are never
+    read again and simply age out of the (LRU bounded) cache.
+    """
+
+    _stats: Counter[str] = Counter()
+    _stats_lock = threading.Lock()
+
+    def __init__(
+        self,
+        chart_service: ChartService,
+        data_version_service: DataVersionService | None = None,
+        cache_alias: str = "charts",
+    ) -> None:
+        self._chart_service = chart_service
+        self._data_version_service = data_version_service or DataVersionService()
+        self._cache = caches[cache_alias]
+
+    @classmethod
+    def get_stats(cls) -> dict[str, int]:
+        """Return the process-wide hit and miss counters."""
+        with cls._stats_lock:
+            return {"hits": cls._stats["hits"], "misses": cls._stats["misses"]}
+
+    @classmethod
+    def reset_stats(cls) -> None:
+        with cls._stats_lock:
+            cls._stats.clear()
+
+    def get_value_over_dates(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+    ) -> list[tuple[int, decimal.Decimal]]:
+        return self._get_or_compute(
+            self._chart_service.get_value_over_dates,
+            accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
+        )
+
+    def get_balance_over_periods_by_account(
+        self,
+        accounts: list[int],
+        date_fr: dt.date,
+        date_to: dt.date,
+        resolution: Resolution = Resolution.auto,
+        max_points: int = MAX_POINTS_DEFAULT,
+        with_total: bool = True,
+    ) -> BalancesByAccount:
+        return self._get_or_compute(
+            self._chart_service.get_balance_over_periods_by_account,
+            accounts=accounts,
+            date_fr=date_fr,
+            date_to=date_to,
+            resolution=resolution,
+            max_points=max_points,
+            with_total=with_total,
+        )
+
+    def _get_or_compute(self, method: Callable[..., Any], accounts: list[int], **params: Any) -> Any:
+        data_version = self._data_version_service.get_data_version()
+        params_str = ",".join(f"{key}={value}" for key, value in sorted(params.items()))
+        accounts_str = ",".join(str(account_id) for account_id in sorted(set(accounts)))
+        digest = hashlib.sha256(f"{accounts_str}|{params_str}".encode()).hexdigest()[:32]
+        key = f"{method.__name__}:{data_version}:{digest}"
+
+        result = self._cache.get(key)
+        if result is not None:
+            self._count("hits")
+            return result
+
+        self._count("misses")
+        result = method(accounts=accounts, **params)
+        self._cache.set(key, result)
+        return result
+
+    @classmethod
+    def _count(cls, name: str) -> None:
+        with cls._stats_lock:
+            cls._stats[name] += 1
@@ -1,11 +1,21 @@
 import calendar
-from datetime import datetime, timedelta
+import hashlib
+from datetime import date, datetime, timedelta
 from typing import TYPE_CHECKING, Any
 
-from django.views.generic import TemplateView
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.generic import TemplateView, View
 
-from charts.services import ChartService
-from config.services import ConfigReadService
+from charts.services import (
+    MAX_POINTS_DEFAULT,
+    BalancesByAccount,
+    CachedChartService,
+    Resolution,
+    create_chart_service,
+)
+from config.services import ConfigReadService, DataVersionService
 from householdentities.services import EntityService
 from transactions.services import TransactionReadService
 
@@ -13,42 +23,136 @@ if TYPE_CHECKING:  # pragma: no cover
     from django.http import HttpRequest, HttpResponse
 
 
-class CurrentBalancesChartView(TemplateView):
-    template_name = "current-balance.html"
+def balances_etag(request: "HttpRequest", *args: Any, **kwargs: Any) -> str:
+    """
+    Return the ETag of a balances response, derived from the data version and the query parameters.
 
-    def get(self, request: "HttpRequest", *args: Any, **kwargs: Any) -> "HttpResponse":
+    The data version only changes when `import_data` writes rows or the admin changes the data, so repeated
+    refreshes of the dashboard get a `304 Not Modified` without recomputing anything.
+    """
+    data_version = DataVersionService().get_data_version()
+    query = "&".join(f"{key}={value}" for key, value in sorted(request.GET.items()))
+    return hashlib.sha256(f"{data_version}?{query}".encode()).hexdigest()[:32]
+
+
+def serialize_balances(
+    balances_by_account: BalancesByAccount, account_name_map: dict[int, str]
+) -> dict[str, Any]:
+    """
+    Return the balances as a compact JSON-serializable dict, the client derives the date labels.
+
+    Dates are sent as a start date plus day offsets, and the offsets are left out (`null`) when there is one
+    point per consecutive day.
+    """
+    dates = balances_by_account.dates
+    date_start = dates[0] if dates else None
+    days: list[int] | None = [(date_value - date_start).days for date_value in dates] if date_start else []
+    if days == list(range(len(dates))):
+        days = None
+    return {
+        "start": str(date_start) if date_start else None,
+        "days": days,
+        "total": [float(balance) for _, balance in balances_by_account.total or []],
+        "accounts": [
+            {
+                "id": account_id,
+                "name": account_name_map[account_id],
+                "balances": [float(balance) for _, balance in series],
+            }
+            for account_id, series in balances_by_account.series_by_account.items()
+        ],
+    }
+
+
+class BalancesChartMixin:
+    """Parse the chart query parameters and compute the balances they ask for."""
+
+    def parse_chart_params(self, request: "HttpRequest") -> "dict[str, Any] | HttpResponse":
+        """Return the chart parameters, or a bad request response if they are invalid."""
         year_month = request.GET.get("year-month")
-        kwargs = dict(**kwargs, year_month=year_month)
-        return super().get(request, *args, **kwargs)
+        try:
+            resolution = Resolution(request.GET.get("resolution", Resolution.auto))
+            max_points = int(request.GET.get("max-points", MAX_POINTS_DEFAULT))
+            if year_month:
+                datetime.strptime(year_month, "%Y-%m")
+        except ValueError as e:
+            return HttpResponseBadRequest(f"Invalid query parameter: {e}")
+        if max_points < 4:
+            return HttpResponseBadRequest("Invalid query parameter: max-points must be at least 4")
+        return dict(year_month=year_month, resolution=resolution, max_points=max_points)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        if kwargs.get("year_month"):
-            date_start = datetime.strptime(kwargs["year_month"], "%Y-%m").date()
+    def get_date_range(self, year_month: str | None) -> tuple[date, date]:
+        if year_month:
+            date_start = datetime.strptime(year_month, "%Y-%m").date()
             _, month_days = calendar.monthrange(date_start.year, date_start.month)
             date_end = date_start + timedelta(days=month_days)
         else:
-            entity_service = EntityService()
             config_service = ConfigReadService()
             config_latest = config_service.get_latest_config()
             assert config_latest is not None, "No config found, please create one first."
             date_start = config_latest.date_fr
             date_end = config_latest.date_to
             assert date_start is not None and date_end is not None, "Config dates cannot be None."
+        return date_start, date_end
+
+    def get_balances(
+        self, year_month: str | None, resolution: Resolution, max_points: int
+    ) -> tuple[BalancesByAccount, dict[int, str]]:
+        """Return the balances of all accounts and the account names by account ID."""
+        date_start, date_end = self.get_date_range(year_month)
 
         trx_service = TransactionReadService()
         entity_service = EntityService()
-        chart_service = ChartService(
-            transaction_service=trx_service,
-            entity_service=entity_service,
+        chart_service = CachedChartService(
+            create_chart_service(
+                transaction_service=trx_service,
+                entity_service=entity_service,
+            )
         )
-        current_balances = chart_service.get_value_over_dates(
-            accounts=entity_service.get_all_account_ids(),
+        account_ids = entity_service.get_all_account_ids()
+        balances_by_account = chart_service.get_balance_over_periods_by_account(
+            accounts=account_ids,
             date_fr=date_start,
             date_to=date_end,
+            resolution=resolution,
+            max_points=max_points,
         )
+        return balances_by_account, entity_service.get_account_name_map(account_ids)
+
 
-        days_sorted = [date_start + timedelta(days=i) for i in range((date_end - date_start).days + 1)]
-        context["current_balances"] = [(str(days_sorted[i]), balance) for i, balance in current_balances]
+@method_decorator(condition(etag_func=balances_etag), name="get")
+class CurrentBalancesChartView(BalancesChartMixin, TemplateView):
+    template_name = "current-balance.html"
+
+    def get(self, request: "HttpRequest", *args: Any, **kwargs: Any) -> "HttpResponse":
+        params = self.parse_chart_params(request)
+        if not isinstance(params, dict):
+            return params
+        kwargs = dict(**kwargs, **params)
+        return super().get(request, *args, **kwargs)
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        balances_by_account, account_name_map = self.get_balances(
+            year_month=kwargs["year_month"],
+            resolution=kwargs["resolution"],
+            max_points=kwargs["max_points"],
+        )
+        context["chart_data"] = serialize_balances(balances_by_account, account_name_map)
         return context
+
+
+@method_decorator(condition(etag_func=balances_etag), name="get")
+class CurrentBalancesAPIView(BalancesChartMixin, View):
+    """Return the same balances as `CurrentBalancesChartView` as compact JSON."""
+
+    def get(self, request: "HttpRequest", *args: Any, **kwargs: Any) -> "HttpResponse":
+        params = self.parse_chart_params(request)
+        if not isinstance(params, dict):
+            return params
+        balances_by_account, account_name_map = self.get_balances(**params)
+
+        return JsonResponse(
+            serialize_balances(balances_by_account, account_name_map),
+            json_dumps_params={"separators": (",", ":")},
+        )
@@ -1,9 +1,26 @@
 from django.contrib import admin
 
 from .models import Config
+from .services import DataVersionService
+
+
+class DataVersionAdminMixin:
+    """Bump the data version with each change made in the admin, the charts are cached by data version."""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        DataVersionService().bump_data_version()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        DataVersionService().bump_data_version()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        DataVersionService().bump_data_version()
 
 
 @admin.register(Config)
-class ConfigAdmin(admin.ModelAdmin):
+class ConfigAdmin(DataVersionAdminMixin, admin.ModelAdmin):
     list_display = ("id", "date_fr", "date_to", "created_at")
     search_fields = ("date_fr", "date_to")
@@ -10,3 +10,10 @@ class Config(models.Model):
     date_to = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+
+class DataVersion(models.Model):
+    """Single-row counter bumped whenever imported data or the config change, used to validate caches."""
+
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -4,7 +4,9 @@ import datetime as dt
 from dataclasses import dataclass
 from typing import Protocol
 
-from config.models import Config
+from django.db.models import F
+
+from config.models import Config, DataVersion
 from householdentities.services import EntityService
 from transactions.services import TransactionReadService
 
@@ -20,10 +22,29 @@ class IConfigIn(Protocol):
     date_to: dt.date
 
 
+class DataVersionService:
+    """Global data version, bumped whenever imported data or the config change."""
+
+    def get_data_version(self) -> int:
+        return DataVersion.objects.values_list("version", flat=True).first() or 0
+
+    def bump_data_version(self) -> int:
+        """Increment the data version and return the new one."""
+        data_version, _ = DataVersion.objects.get_or_create(id=1)
+        DataVersion.objects.filter(id=data_version.id).update(version=F("version") + 1)
+        return self.get_data_version()
+
+
 class ConfigWriteService:
-    def __init__(self, entity_service: EntityService, transaction_service: TransactionReadService):
+    def __init__(
+        self,
+        entity_service: EntityService,
+        transaction_service: TransactionReadService,
+        data_version_service: DataVersionService | None = None,
+    ):
         self._entity_service = entity_service
         self._trx_service = transaction_service
+        self._data_version_service = data_version_service or DataVersionService()
 
     def get_earliest_latest_date(self) -> tuple[dt.date | None, dt.date | None]:
         earliest_trx, latest_trx = self._trx_service.get_earliest_latest_date()
@@ -43,15 +64,18 @@ class ConfigWriteService:
         """
         config = Config.objects.order_by("-created_at").first()
         if config:
-            config.date_fr = date_fr
-            config.date_to = date_to
-            config.save(update_fields=["date_fr", "date_to"])
+            if (config.date_fr, config.date_to) != (date_fr, date_to):
+                config.date_fr = date_fr
+                config.date_to = date_to
+                config.save(update_fields=["date_fr", "date_to"])
+                self._data_version_service.bump_data_version()
             return False
         else:
             Config.objects.create(
                 date_fr=date_fr,
                 date_to=date_to,
             )
+            self._data_version_service.bump_data_version()
             return True
 
 
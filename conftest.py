@@ -0,0 +1,24 @@
+from django.core.cache import caches
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Cached results are keyed by data version, which restarts from zero with each test database."""
+    for cache in caches.all():
+        cache.clear()
+    yield
+
+
+@pytest.fixture(scope="session")
+def django_db_modify_db_settings(django_db_modify_db_settings, tmp_path_factory):
+    """
+    Create the test database as a file, not in memory.
+
+    The threads of the import jobs and of the load test write while others read. An in-memory database is shared
+    between connections with table-level locks, which fail the readers at once, where a file database is switched
+    to WAL by the imports.
+    """
+    from django.db import connections
+
+    connections["default"].settings_dict["TEST"]["NAME"] = str(tmp_path_factory.mktemp("db") / "test.sqlite3")
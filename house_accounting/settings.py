@@ -87,6 +87,27 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Chart results, keyed by data version so they never expire, only get evicted.
+    # CULL_FREQUENCY == MAX_ENTRIES evicts the least recently used entry only.
+    "charts": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "charts",
+        "TIMEOUT": None,
+        "OPTIONS": {
+            "MAX_ENTRIES": 256,
+            "CULL_FREQUENCY": 256,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -128,6 +149,15 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Background imports
+
+# Directory the archives uploaded to /api/imports are saved to, one subdirectory per upload
+IMPORT_UPLOAD_DIR = BASE_DIR / ".imports"
+# Threads running the queued imports, SQLite has a single writer so the imports run one after the other
+IMPORT_JOB_WORKERS = 1
+# Transactions committed at a time by the queued imports, their progress is saved with each commit
+IMPORT_JOB_COMMIT_EVERY = 10_000
+
 # Logging
 
 LOGGING = {
@@ -1,12 +1,27 @@
 import datetime as dt
+import io
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
 from decimal import Decimal
 from pathlib import Path
+from types import SimpleNamespace
 
 from django.core.management import call_command
 import pytest
 
-from charts.services import ChartService
+from config.models import Config
+from config.services import ConfigWriteService, DataVersionService
+from charts.services import CachedChartService, ChartService, Resolution, downsample_min_max
 from householdentities.services import EntityService
+from importing import jobs
+from importing.jobs import ImportJobService
+from importing.models import ImportAudit, ImportJob, ImportJobStatus, ImportLock
+from transactions.models import MonthlyBalance, Transaction
 from transactions.services import TransactionReadService
 
 
@@ -67,3 +82,533 @@ def test_current_balances():
     ]
     print(value_over_dates_after_proper_accounts_actual)
     assert value_over_dates_after_proper_accounts_actual == value_over_dates_after_proper_accounts_expected
+
+
+@pytest.mark.django_db
+def test_current_balances_carries_in_opening_balance():
+    entity_service = EntityService()
+    chart_service = ChartService(
+        transaction_service=TransactionReadService(),
+        entity_service=entity_service,
+    )
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+
+    value_over_dates_actual = chart_service.get_value_over_dates(
+        accounts=entity_service.get_all_account_ids(),
+        date_fr=dt.date(2020, 1, 19),
+        date_to=dt.date(2020, 1, 21),
+    )
+
+    value_over_dates_expected = [
+        (0, Decimal("1036.6300")),  # 2020-01-19: -63.37 + 100.0 (trx) + 1000.0 (initial) before date_fr
+        (1, Decimal("6036.6300")),  # 2020-01-20: +5000.0 (trx)
+        (2, Decimal("6036.6300")),  # 2020-01-21: +0.0 (no trx)
+    ]
+    assert value_over_dates_actual == value_over_dates_expected
+
+
+@pytest.mark.django_db
+def test_current_balances_precomputed_matches_ledger_replay():
+    entity_service = EntityService()
+    chart_service = ChartService(
+        transaction_service=TransactionReadService(),
+        entity_service=entity_service,
+    )
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+    # Re-importing the same data only rebuilds the touched suffix, and must leave the balances unchanged
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+
+    for date_fr, date_to in [
+        (dt.date(2019, 12, 25), dt.date(2020, 4, 30)),
+        (dt.date(2020, 1, 19), dt.date(2020, 1, 21)),
+        (dt.date(2020, 3, 1), dt.date(2020, 3, 31)),
+    ]:
+        kwargs = dict(accounts=entity_service.get_all_account_ids(), date_fr=date_fr, date_to=date_to)
+        assert chart_service.get_balance_over_dates(**kwargs) == chart_service.get_value_over_dates(**kwargs)
+
+
+@pytest.mark.django_db
+def test_current_balances_numpy_matches_decimal():
+    pytest.importorskip("numpy")
+    from charts.services import ChartServiceNumPy
+
+    entity_service = EntityService()
+    trx_service = TransactionReadService()
+    chart_service = ChartService(transaction_service=trx_service, entity_service=entity_service)
+    chart_service_numpy = ChartServiceNumPy(transaction_service=trx_service, entity_service=entity_service)
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+
+    for date_fr, date_to in [
+        (dt.date(2019, 12, 25), dt.date(2020, 4, 30)),
+        (dt.date(2020, 1, 19), dt.date(2020, 1, 21)),
+        (dt.date(2020, 3, 1), dt.date(2020, 3, 31)),
+    ]:
+        kwargs = dict(accounts=entity_service.get_all_account_ids(), date_fr=date_fr, date_to=date_to)
+        assert chart_service_numpy.get_value_over_dates(**kwargs) == chart_service.get_value_over_dates(
+            **kwargs
+        )
+        assert chart_service_numpy.get_balance_over_dates(**kwargs) == chart_service.get_value_over_dates(
+            **kwargs
+        )
+        # The engine of the dashboard
+        for resolution in (Resolution.day, Resolution.week, Resolution.month):
+            assert chart_service_numpy.get_balance_over_periods_by_account(
+                **kwargs, resolution=resolution, max_points=10
+            ) == chart_service.get_balance_over_periods_by_account(
+                **kwargs, resolution=resolution, max_points=10
+            )
+
+
+@pytest.mark.django_db
+def test_current_balances_by_account():
+    entity_service = EntityService()
+    chart_service = ChartService(
+        transaction_service=TransactionReadService(),
+        entity_service=entity_service,
+    )
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+    account_id_map = entity_service.get_account_id_map(["KOHO_ABC", "TD-12345", "TD-789"])
+
+    kwargs = dict(
+        accounts=[*account_id_map.values(), 123], date_fr=dt.date(2020, 1, 19), date_to=dt.date(2020, 3, 20)
+    )
+    balances_actual = chart_service.get_value_over_dates_by_account(**kwargs)
+
+    assert set(balances_actual.series_by_account) == set(account_id_map.values())
+    assert balances_actual.series_by_account[account_id_map["TD-12345"]][:2] == [
+        (0, Decimal("1036.6300")),  # 2020-01-19: -63.37 + 100.0 (trx) + 1000.0 (initial) before date_fr
+        (1, Decimal("6036.6300")),  # 2020-01-20: +5000.0 (trx)
+    ]
+    assert balances_actual.series_by_account[account_id_map["TD-789"]][-2:] == [
+        (60, Decimal("0")),  # 2020-03-19
+        (61, Decimal("5000.00")),  # 2020-03-20: +5000.0 (Account initial amount)
+    ]
+    assert balances_actual.total == chart_service.get_value_over_dates(**kwargs)
+    assert chart_service.get_balance_over_dates_by_account(**kwargs) == balances_actual
+
+
+@pytest.mark.django_db
+def test_current_balances_over_periods():
+    entity_service = EntityService()
+    chart_service = ChartService(
+        transaction_service=TransactionReadService(),
+        entity_service=entity_service,
+    )
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+    kwargs = dict(
+        accounts=entity_service.get_all_account_ids(),
+        date_fr=dt.date(2019, 12, 25),
+        date_to=dt.date(2020, 4, 30),
+    )
+    balances_daily = chart_service.get_balance_over_dates_by_account(**kwargs)
+
+    balances_day = chart_service.get_balance_over_periods_by_account(**kwargs, resolution=Resolution.day)
+    assert balances_day.total == balances_daily.total
+    assert balances_day.series_by_account == balances_daily.series_by_account
+
+    balances_month = chart_service.get_balance_over_periods_by_account(**kwargs, resolution=Resolution.month)
+    assert balances_month.dates == [
+        dt.date(2019, 12, 31),
+        dt.date(2020, 1, 31),
+        dt.date(2020, 2, 29),
+        dt.date(2020, 3, 31),
+        dt.date(2020, 4, 30),
+    ]
+    assert [mv for _, mv in balances_month.total] == [
+        balances_daily.total[(date_value - kwargs["date_fr"]).days][1] for date_value in balances_month.dates
+    ]
+
+    balances_week = chart_service.get_balance_over_periods_by_account(**kwargs, resolution=Resolution.week)
+    assert balances_week.dates[:2] == [dt.date(2019, 12, 29), dt.date(2020, 1, 5)]
+    assert [mv for _, mv in balances_week.total] == [
+        balances_daily.total[(date_value - kwargs["date_fr"]).days][1] for date_value in balances_week.dates
+    ]
+
+    balances_capped = chart_service.get_balance_over_periods_by_account(
+        **kwargs, resolution=Resolution.day, max_points=10
+    )
+    assert len(balances_capped.dates) <= 10
+    assert balances_capped.dates[0] == kwargs["date_fr"] and balances_capped.dates[-1] == kwargs["date_to"]
+    assert {mv for _, mv in balances_capped.total} >= {min(mv for _, mv in balances_daily.total)}
+
+
+def test_downsample_min_max_keeps_extremes():
+    values = [Decimal(v) for v in [0, 5, -3, 2, 9, 1, 1, 1, 4, -7, 0, 2]]
+
+    indices = downsample_min_max(values, max_points=6)
+
+    assert len(indices) <= 6
+    assert indices[0] == 0 and indices[-1] == len(values) - 1
+    assert {values[i] for i in indices} >= {Decimal(9), Decimal(-7)}
+    assert downsample_min_max(values, max_points=20) == list(range(len(values)))
+
+
+@pytest.mark.django_db
+def test_current_balances_view_resolution(client):
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+
+    response = client.get("/", {"resolution": "week"})
+    assert response.status_code == 200
+    # 2020-01-05, 2020-01-12, 2020-01-19, 2020-01-20
+    assert response.context["chart_data"]["start"] == "2020-01-05"
+    assert response.context["chart_data"]["days"] == [0, 7, 14, 15]
+
+    response = client.get("/", {"resolution": "day"})
+    assert response.status_code == 200
+    assert response.context["chart_data"]["start"] == "2020-01-01"
+    assert response.context["chart_data"]["days"] is None
+    assert len(response.context["chart_data"]["total"]) == 20
+    assert b'<script id="chart-data" type="application/json">' in response.content
+
+    response = client.get("/", {"resolution": "year"})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_balances_api_conditional_get(admin_client):
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+
+    response = admin_client.get("/api/balances", {"resolution": "week"})
+    assert response.status_code == 200
+    assert response.json()["start"] == "2020-01-05"
+    assert response.json()["days"] == [0, 7, 14, 15]
+    assert response.json()["total"] == [1036.63, 1036.63, 1036.63, 6036.63]
+    assert {account["name"] for account in response.json()["accounts"]} == {
+        "Koho Prepaid Credit Card",
+        "TD Chequing Account",
+        "TD Savings Account",
+    }
+    etag = response["ETag"]
+
+    response = admin_client.get("/api/balances", {"resolution": "week"}, headers={"if-none-match": etag})
+    assert response.status_code == 304
+
+    response = admin_client.get("/api/balances", {"resolution": "day"}, headers={"if-none-match": etag})
+    assert response.status_code == 200
+
+    # Re-importing unchanged files writes nothing, the ETag is still valid
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+    response = admin_client.get("/api/balances", {"resolution": "week"}, headers={"if-none-match": etag})
+    assert response.status_code == 304
+
+    # Forcing the re-import writes rows, which bumps the data version and so invalidates the ETag
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+        "--force",
+    )
+    response = admin_client.get("/api/balances", {"resolution": "week"}, headers={"if-none-match": etag})
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+
+    # Changing the config in the admin bumps the data version too
+    etag = response["ETag"]
+    config = Config.objects.get()
+    response = admin_client.post(
+        f"/admin/config/config/{config.pk}/change/",
+        {"date_fr": "2020-01-01", "date_to": "2020-02-01"},
+    )
+    assert response.status_code == 302
+    response = admin_client.get("/api/balances", {"resolution": "week"}, headers={"if-none-match": etag})
+    assert response.status_code == 200
+
+    response = admin_client.get("/api/balances", {"year-month": "2020-13"})
+    assert response.status_code == 400
+    response = admin_client.get("/api/balances", {"year-month": "2020-02"})
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_current_balances_cached():
+    entity_service = EntityService()
+    chart_service = ChartService(
+        transaction_service=TransactionReadService(),
+        entity_service=entity_service,
+    )
+    chart_service_cached = CachedChartService(chart_service)
+    CachedChartService.reset_stats()
+    kwargs = dict(accounts=[1, 2, 3], date_fr=dt.date(2020, 1, 1), date_to=dt.date(2020, 1, 5))
+
+    assert chart_service_cached.get_value_over_dates(**kwargs) == chart_service.get_value_over_dates(**kwargs)
+    assert chart_service_cached.get_value_over_dates(**kwargs) == chart_service.get_value_over_dates(**kwargs)
+    assert CachedChartService.get_stats() == {"hits": 1, "misses": 1}
+
+    # Importing bumps the data version, the cached result of the previous version is not read anymore
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+    kwargs["accounts"] = entity_service.get_all_account_ids()
+    value_over_dates_actual = chart_service_cached.get_value_over_dates(**kwargs)
+    assert value_over_dates_actual == chart_service.get_value_over_dates(**kwargs)
+    assert value_over_dates_actual[-1] == (4, Decimal("1036.6300"))
+    assert CachedChartService.get_stats() == {"hits": 1, "misses": 2}
+
+
+@pytest.mark.django_db
+def test_admin_edits_refresh_balances_and_bump_data_version(admin_client):
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+    entity_service = EntityService()
+    chart_service = ChartService(transaction_service=TransactionReadService(), entity_service=entity_service)
+    chart_service_cached = CachedChartService(chart_service)
+    kwargs = dict(
+        accounts=entity_service.get_all_account_ids(),
+        date_fr=dt.date(2020, 3, 1),
+        date_to=dt.date(2020, 3, 1),
+    )
+    assert chart_service_cached.get_value_over_dates(**kwargs) == [(0, Decimal("6036.6300"))]
+    data_version = DataVersionService().get_data_version()
+
+    trx = Transaction.objects.get(transaction_id="PAYROLL-abc")
+    response = admin_client.post(
+        f"/admin/transactions/transaction/{trx.pk}/change/",
+        {
+            "transaction_id_raw": trx.transaction_id_raw or trx.transaction_id,
+            "transaction_id": trx.transaction_id,
+            "account": trx.account_id,
+            "amount": "4000.00",
+            "date": "2020-01-20",
+            "content_hash": trx.content_hash,
+        },
+    )
+    assert response.status_code == 302
+    assert DataVersionService().get_data_version() > data_version
+    assert chart_service_cached.get_value_over_dates(**kwargs) == [(0, Decimal("5036.6300"))]
+    # The precomputed balances are rebuilt from the edit
+    assert chart_service.get_balance_over_dates(**kwargs) == [(0, Decimal("5036.6300"))]
+
+    data_version = DataVersionService().get_data_version()
+    response = admin_client.post(f"/admin/config/config/{Config.objects.get().pk}/delete/", {"post": "yes"})
+    assert response.status_code == 302
+    assert DataVersionService().get_data_version() > data_version
+
+
+@pytest.mark.django_db
+def test_balance_as_of_from_monthly_checkpoints():
+    entity_service = EntityService()
+    trx_service = TransactionReadService()
+    chart_service = ChartService(transaction_service=trx_service, entity_service=entity_service)
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+    account_id_map = entity_service.get_account_id_map(["KOHO_ABC", "TD-12345", "TD-789"])
+
+    assert MonthlyBalance.objects.filter(account_id=account_id_map["TD-12345"]).count() == 1
+    assert trx_service.get_balance_as_of(
+        accounts=list(account_id_map.values()), date=dt.date(2020, 3, 25)
+    ) == {
+        account_id_map["KOHO_ABC"]: Decimal("0"),
+        account_id_map["TD-12345"]: Decimal("6036.6300"),  # Checkpoint of 2020-01
+        account_id_map["TD-789"]: Decimal("5000.00"),  # Initial amount within the month
+    }
+
+    date_fr = dt.date(2019, 12, 25)
+    value_over_dates = chart_service.get_value_over_dates(
+        accounts=list(account_id_map.values()), date_fr=date_fr, date_to=dt.date(2020, 4, 30)
+    )
+    for i, mv in value_over_dates:
+        balance_as_of = trx_service.get_balance_as_of(
+            accounts=list(account_id_map.values()), date=date_fr + dt.timedelta(days=i)
+        )
+        assert sum(balance_as_of.values()) == mv
+
+
+def _wait_for_import_job(client, status_url: str) -> dict:
+    for _ in range(200):
+        status = client.get(status_url).json()
+        if status["status"] in ("succeeded", "failed"):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"Import job still {status['status']}")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_jobs_run_in_background(admin_client, settings, tmp_path: Path):
+    settings.IMPORT_UPLOAD_DIR = tmp_path / "uploads"
+    archive = shutil.make_archive(
+        str(tmp_path / "export"), "zip", Path(__file__).parent / "test-input-data-0"
+    )
+
+    status_urls = []
+    # Both uploads are queued at once, and imported one after the other
+    for _ in range(2):
+        with open(archive, "rb") as file:
+            response = admin_client.post("/api/imports", {"file": file})
+        assert response.status_code == 202
+        assert response.json()["status"] == "queued"
+        assert response["Location"] == response.json()["status_url"]
+        status_urls.append(response.json()["status_url"])
+
+    status = _wait_for_import_job(admin_client, status_urls[0])
+    assert status["status"] == "succeeded", status["error"]
+    assert (status["n_files_total"], status["n_files_done"], status["n_rows"]) == (11, 11, 7)
+    assert status["audit_id"] == ImportAudit.objects.order_by("id").first().id
+    status = _wait_for_import_job(admin_client, status_urls[1])
+    assert (status["status"], status["n_rows"]) == ("succeeded", 7)
+    assert Transaction.objects.count() == 4
+    # The uploads are deleted once imported
+    assert not any((tmp_path / "uploads").iterdir())
+
+    response = admin_client.get("/api/balances", {"resolution": "week"})
+    assert response.json()["total"] == [1036.63, 1036.63, 1036.63, 6036.63]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_jobs_report_failures(admin_client, settings, tmp_path: Path):
+    settings.IMPORT_UPLOAD_DIR = tmp_path / "uploads"
+    source_dir = tmp_path / "source"
+    shutil.copytree(Path(__file__).parent / "test-input-data-0", source_dir)
+    (source_dir / "Accounts.csv").write_text("AccountID,Name\n")
+    archive = shutil.make_archive(str(tmp_path / "export"), "gztar", source_dir)
+
+    with open(archive, "rb") as file:
+        response = admin_client.post("/api/imports", {"file": file})
+    status = _wait_for_import_job(admin_client, response.json()["status_url"])
+
+    assert status["status"] == "failed"
+    assert status["error"].startswith("InvalidImportData: Found 1 invalid rows")
+    assert not Transaction.objects.exists()
+
+    response = admin_client.post("/api/imports", {"file": io.BytesIO(b"Date,Amount\n")})
+    assert response.status_code == 400
+    assert admin_client.get("/api/imports/0").status_code == 404
+
+
+@pytest.mark.django_db
+def test_import_jobs_require_staff(client, django_user_model):
+    archive = io.BytesIO(b"")
+    archive.name = "export.zip"
+    assert client.post("/api/imports", {"file": archive}).status_code == 403
+
+    client.force_login(django_user_model.objects.create_user("user"))
+    assert client.post("/api/imports", {"file": archive}).status_code == 403
+    assert client.get("/api/imports/1").status_code == 403
+    assert not ImportJob.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_jobs_take_turns_on_lock(monkeypatch, tmp_path: Path):
+    lock_waited = threading.Event()
+    import_release = threading.Event()
+    job_ids_imported = []
+
+    def import_data(*args, progress, **kwargs):
+        job_ids_imported.append(progress.job_id)
+        assert import_release.wait(timeout=10)
+
+    def sleep(seconds: float) -> None:
+        # The lock is held by the other job
+        lock_waited.set()
+        time.sleep(0.001)
+
+    monkeypatch.setattr(jobs, "call_command", import_data)
+    monkeypatch.setattr(jobs, "time", SimpleNamespace(sleep=sleep))
+    # Two workers, as two processes would run two jobs at once
+    runner = jobs.ImportJobRunner(max_workers=2)
+    job_ids = [
+        ImportJob.objects.create(source_path=str(tmp_path / name / "export.zip")).id for name in ["a", "b"]
+    ]
+    futures = [runner.submit(job_id) for job_id in job_ids]
+
+    assert lock_waited.wait(timeout=10)
+    job_id_first = ImportLock.objects.get().job_id
+    (job_id_second,) = set(job_ids) - {job_id_first}
+    assert ImportJob.objects.get(id=job_id_second).status == "queued"
+    import_release.set()
+    for future in futures:
+        future.result(timeout=10)
+
+    assert job_ids_imported == [job_id_first, job_id_second]
+    assert set(ImportJob.objects.values_list("status", flat=True)) == {"succeeded"}
+    assert not ImportLock.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_job_progress_saved_with_each_commit(monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("Disk full")
+
+    # Fails once all the transactions are written, after the last checkpoint
+    monkeypatch.setattr(ConfigWriteService, "update_or_create_latest_config", fail)
+    source_dir = Path(__file__).parent / "test-input-data-0"
+    job = ImportJob.objects.create(source_path=str(source_dir / "export.zip"))
+    with pytest.raises(RuntimeError, match="Disk full"):
+        call_command(
+            "import_data",
+            *("--source-dir", str(source_dir), "--commit-every", "1"),
+            progress=jobs.ImportJobProgress(job.id),
+        )
+
+    # As polled from a process that does not run the job
+    status = ImportJobService(runner=jobs.ImportJobRunner()).get_status(ImportJob.objects.get(id=job.id))
+    assert status["n_files_total"] == 11
+    assert 0 < status["n_rows"] <= 7
+
+
+@pytest.mark.django_db
+def test_import_jobs_of_stopped_processes_fail(tmp_path: Path):
+    process_stopped = subprocess.Popen([sys.executable, "-c", ""])
+    process_stopped.wait()
+    hostname = socket.gethostname()
+    upload_dirs = {}
+    for name, hostname_job, pid, status in [
+        ("running-stopped", hostname, process_stopped.pid, ImportJobStatus.running),
+        ("queued-stopped", hostname, process_stopped.pid, ImportJobStatus.queued),
+        ("running-alive", hostname, os.getpid(), ImportJobStatus.running),
+        ("running-other-host", f"{hostname}-other", process_stopped.pid, ImportJobStatus.running),
+    ]:
+        upload_dirs[name] = tmp_path / "uploads" / name
+        upload_dirs[name].mkdir(parents=True)
+        (upload_dirs[name] / "export.zip").write_bytes(b"")
+        job = ImportJob.objects.create(
+            source_path=str(upload_dirs[name] / "export.zip"), hostname=hostname_job, pid=pid, status=status
+        )
+        if name == "running-stopped":
+            ImportLock.objects.create(name=jobs.IMPORT_LOCK_NAME, job=job)
+
+    call_command("fail_interrupted_import_jobs")
+
+    # Only the jobs of a process that is known to have stopped
+    assert list(ImportJob.objects.order_by("id").values_list("status", flat=True)) == [
+        "failed",
+        "failed",
+        "running",
+        "running",
+    ]
+    assert ImportJob.objects.filter(status="failed").first().error.startswith("Interrupted")
+    assert not ImportLock.objects.exists()
+    assert {name for name, upload_dir in upload_dirs.items() if upload_dir.exists()} == {
+        "running-alive",
+        "running-other-host",
+    }
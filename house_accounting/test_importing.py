@@ -0,0 +1,644 @@
+import datetime as dt
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import zipfile
+from decimal import Decimal
+from importlib import import_module
+from pathlib import Path
+
+import pydantic
+import pytest
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from charts.services import ChartService
+from config.services import ConfigWriteService, DataVersionService
+from householdentities.models import Account
+from householdentities.services import EntityService
+from importing.management.commands.import_data import InvalidImportData, InvalidImportDirStructure
+from importing.models import ImportAudit
+from importing.services import ImportManifestService, ImportSession
+from importing.sources import iter_csv_files, open_source_dir
+from importing.parsers import (
+    AccountFileParserStandard,
+    TransactionCSVFileParserKOHO,
+    TransactionCSVFileParserTDCanada,
+    TransactionCSVRowStandard,
+    TransactionFilesParserStandard,
+    TransactionRow,
+)
+from transactions.models import DailyBalance, MonthlyBalance, Transaction
+from transactions.services import (
+    DailyBalanceWriteService,
+    TransactionImportContext,
+    TransactionReadService,
+    TransactionWriteService,
+)
+
+SOURCE_DIR = Path(__file__).parent / "test-input-data-0"
+RAW_SOURCE_DIR = Path(__file__).parent / "test-input-raw-0"
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("upsert", [False, True])
+def test_bulk_create_or_update_counts(upsert: bool):
+    entity_service = EntityService()
+    trx_service = TransactionWriteService(entity_service=entity_service)
+
+    def import_all() -> tuple[tuple[int, int], tuple[int, int, int]]:
+        accounts = AccountFileParserStandard(SOURCE_DIR / "Accounts.csv").iter_parsed()
+        transactions = TransactionFilesParserStandard(SOURCE_DIR / "Transactions").iter_parsed()
+        return (
+            entity_service.bulk_create_or_update_accounts(accounts, batch_size=2, upsert=upsert),
+            trx_service.bulk_create_or_update_transactions(transactions, batch_size=3, upsert=upsert),
+        )
+
+    assert import_all() == ((3, 0), (4, 0, 0))
+    # Unchanged transactions are not written again
+    assert import_all() == ((0, 3), (0, 0, 4))
+    assert Account.objects.count() == 3
+    assert Transaction.objects.count() == 4
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("upsert", [False, True])
+def test_account_import_refreshes_balances_of_changed_accounts_only(monkeypatch, upsert: bool):
+    entity_service = EntityService()
+    accounts = list(AccountFileParserStandard(SOURCE_DIR / "Accounts.csv").iter_parsed())
+    entity_service.bulk_create_or_update_accounts(iter(accounts), upsert=upsert)
+    account_id_map = entity_service.get_all_account_id_map()
+    refreshed: list[dict[int, dt.date]] = []
+    monkeypatch.setattr(
+        DailyBalanceWriteService,
+        "refresh_daily_balances",
+        lambda self, date_touched_by_account: refreshed.append(date_touched_by_account),
+    )
+
+    # Renamed, opening balance changed, start date moved back
+    accounts_by_id = {account.account_id: account for account in accounts}
+    accounts_by_id["KOHO_ABC"] = accounts_by_id["KOHO_ABC"]._replace(name="KOHO")
+    accounts_by_id["TD-789"] = accounts_by_id["TD-789"]._replace(amount_initial=Decimal("1.00"))
+    date_start = accounts_by_id["TD-12345"].date_start
+    accounts_by_id["TD-12345"] = accounts_by_id["TD-12345"]._replace(
+        date_start=date_start - dt.timedelta(days=1)
+    )
+    counts = entity_service.bulk_create_or_update_accounts(iter(accounts_by_id.values()), upsert=upsert)
+
+    assert counts == (0, 3)
+    assert refreshed == [
+        {
+            account_id_map["TD-789"]: accounts_by_id["TD-789"].date_start,
+            account_id_map["TD-12345"]: date_start - dt.timedelta(days=1),
+        }
+    ]
+
+
+@pytest.mark.django_db
+def test_upsert_moves_transaction_and_refreshes_balances():
+    entity_service = EntityService()
+    trx_service = TransactionWriteService(entity_service=entity_service)
+    entity_service.bulk_create_or_update_accounts(
+        AccountFileParserStandard(SOURCE_DIR / "Accounts.csv").iter_parsed(), upsert=True
+    )
+    trx_service.bulk_create_or_update_transactions(
+        TransactionFilesParserStandard(SOURCE_DIR / "Transactions").iter_parsed(), upsert=True
+    )
+    account_id = entity_service.get_account_id_map(["TD-12345"])["TD-12345"]
+    trx_moved = Transaction.objects.get(transaction_id="PAYROLL-abc")
+
+    # The payroll moves from 2020-01-20 to 2020-02-03, the balance of late January must drop accordingly
+    trx_in = TransactionCSVRowStandard(
+        date=dt.date(2020, 2, 3),
+        account_id="TD-12345",
+        transaction_id="PAYROLL-abc",
+        transaction_id_raw="PAYROLL",
+        amount=trx_moved.amount,
+    )
+    counts = trx_service.bulk_create_or_update_transactions(iter([trx_in]), upsert=True)
+
+    assert counts == (0, 1, 0)
+    balance_as_of = TransactionReadService().get_balance_as_of
+    assert balance_as_of(accounts=[account_id], date=dt.date(2020, 1, 31)) == {
+        account_id: Decimal("1036.6300")
+    }
+    assert balance_as_of(accounts=[account_id], date=dt.date(2020, 2, 3)) == {
+        account_id: Decimal("6036.6300")
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("upsert", [False, True])
+def test_scoped_import_context_moves_transaction_from_other_account(upsert: bool):
+    entity_service = EntityService()
+    trx_service = TransactionWriteService(entity_service=entity_service)
+    entity_service.bulk_create_or_update_accounts(
+        AccountFileParserStandard(SOURCE_DIR / "Accounts.csv").iter_parsed()
+    )
+    trx_service.bulk_create_or_update_transactions(
+        TransactionFilesParserStandard(SOURCE_DIR / "Transactions").iter_parsed()
+    )
+    account_id_map = entity_service.get_account_id_map(["TD-12345", "TD-789"])
+    context = TransactionImportContext.load(entity_service, accounts=["TD-789"])
+    assert context.transaction_ids_existing == set()
+
+    # The payroll moves from TD-12345, whose transaction IDs are not loaded, to TD-789
+    transactions = [
+        TransactionCSVRowStandard(
+            date=dt.date(2020, 3, 25),
+            account_id="TD-789",
+            transaction_id=transaction_id,
+            transaction_id_raw=transaction_id,
+            amount=amount,
+        )
+        for transaction_id, amount in [("INTEREST-1", Decimal("10.00")), ("PAYROLL-abc", Decimal("5000.00"))]
+    ]
+    counts = trx_service.bulk_create_or_update_transactions(
+        iter(transactions), upsert=upsert, context=context
+    )
+
+    assert counts == (1, 1, 0)
+    assert Transaction.objects.count() == 5
+    assert Transaction.objects.get(transaction_id="PAYROLL-abc").account_id == account_id_map["TD-789"]
+    assert TransactionReadService().get_balance_as_of(
+        accounts=list(account_id_map.values()), date=dt.date(2020, 3, 31)
+    ) == {account_id_map["TD-12345"]: Decimal("1036.6300"), account_id_map["TD-789"]: Decimal("10010.0000")}
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("commit_every, n_kept", [(None, 0), (2, 2)])
+def test_import_session_rolls_back_after_last_checkpoint(commit_every: int | None, n_kept: int):
+    entity_service = EntityService()
+    trx_service = TransactionWriteService(entity_service=entity_service)
+    entity_service.bulk_create_or_update_accounts(
+        AccountFileParserStandard(SOURCE_DIR / "Accounts.csv").iter_parsed()
+    )
+
+    def iter_failing():
+        yield from TransactionFilesParserStandard(SOURCE_DIR / "Transactions").iter_parsed()
+        raise ValueError("Corrupted file")
+
+    with pytest.raises(ValueError, match="Corrupted file"):
+        with ImportSession(commit_every=commit_every) as session:
+            trx_service.bulk_create_or_update_transactions(
+                session.iter_checkpointed(iter_failing()), batch_size=2
+            )
+
+    assert Transaction.objects.count() == n_kept
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA synchronous")
+        assert cursor.fetchone()[0] == 2  # FULL, the default, is restored
+
+
+@pytest.mark.django_db
+def test_import_context_skips_existence_queries():
+    entity_service = EntityService()
+    trx_service = TransactionWriteService(entity_service=entity_service)
+    entity_service.bulk_create_or_update_accounts(
+        AccountFileParserStandard(SOURCE_DIR / "Accounts.csv").iter_parsed()
+    )
+    context = TransactionImportContext.load(entity_service)
+    assert set(context.account_id_map) == {"TD-12345", "TD-789", "KOHO_ABC"}
+
+    with CaptureQueriesContext(connection) as queries:
+        trx_service.bulk_create_or_update_transactions(
+            TransactionFilesParserStandard(SOURCE_DIR / "Transactions").iter_parsed(),
+            batch_size=1,
+            context=context,
+        )
+
+    # Neither the accounts nor the (not yet) existing transactions are looked up per batch
+    sql_select = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+    assert not any('"householdentities_account"."natural_id" IN' in sql for sql in sql_select)
+    assert not any('"transactions_transaction"."transaction_id" IN' in sql for sql in sql_select)
+    assert context.transaction_ids_existing == set(
+        Transaction.objects.values_list("transaction_id", flat=True)
+    )
+
+
+@pytest.mark.django_db
+def test_import_skips_files_unchanged_since_last_import(monkeypatch, tmp_path: Path):
+    source_dir = tmp_path / "source"
+    shutil.copytree(SOURCE_DIR, source_dir)
+    call_command("import_data", "--source-dir", str(source_dir))
+    audit = ImportAudit.objects.get()
+    assert audit.files.count() == 11
+    assert audit.files.get(path=str(source_dir / "Accounts.csv")).n_rows == 3
+
+    # Touched but unchanged files are not imported again, their new modification time is recorded
+    touched_path = source_dir / "Transactions" / "TDCanada__TD-789__2020-01.csv"
+    os.utime(touched_path, ns=(0, touched_path.stat().st_mtime_ns + 1))
+    call_command("import_data", "--source-dir", str(source_dir))
+    touched = ImportAudit.objects.latest("id").files.get()
+    assert (touched.path, touched.mtime_ns) == (str(touched_path), touched_path.stat().st_mtime_ns)
+    assert touched.n_rows == audit.files.get(path=str(touched_path)).n_rows
+    # So the next imports skip it without hashing it
+    monkeypatch.setattr(ImportManifestService, "_get_sha256", None)
+    assert ImportManifestService().get_files_changed([touched_path]) == []
+    monkeypatch.undo()
+
+    trx_path = source_dir / "Transactions" / "TDCanada__TD-12345__2020-02.csv"
+    trx_path.write_text(
+        "Date,AccountID,TransactionID,TransactionIDRaw,Amount\n2020-02-03,TD-12345,RENT-xyz,RENT,-1000.00\n"
+    )
+    call_command("import_data", "--source-dir", str(source_dir))
+    assert list(ImportAudit.objects.latest("id").files.values_list("path", "n_rows")) == [(str(trx_path), 1)]
+    assert Transaction.objects.count() == 5
+
+
+def test_parse_data_output_independent_of_workers_and_open_files(tmp_path: Path):
+    options_by_name = {
+        "default": [],
+        "workers": ["--workers", "3"],
+        "max-open-files": ["--max-open-files", "1"],
+    }
+    for name, options in options_by_name.items():
+        call_command(
+            "parse_data",
+            *("--source-dir", str(RAW_SOURCE_DIR)),
+            *("--dest-dir", str(tmp_path / name)),
+            *options,
+        )
+
+    paths = sorted(path.relative_to(tmp_path / "default") for path in (tmp_path / "default").rglob("*.csv"))
+    assert len(paths) == 7
+    for name in options_by_name:
+        for path in paths:
+            assert (tmp_path / "default" / path).read_bytes() == (tmp_path / name / path).read_bytes()
+    assert (tmp_path / "default" / "Accounts.csv").read_text().splitlines()[1:] == [
+        'KOHO_ABC,"",KOHO,0.0,2020-03-01',
+        'TD-12345,"",TDCanada,0.0,2020-01-01',
+        'TD-789,"",TDCanada,0.0,2020-01-05',
+    ]
+
+
+@pytest.mark.parametrize(
+    "parser_class, path",
+    [
+        (AccountFileParserStandard, SOURCE_DIR / "Accounts.csv"),
+        (TransactionFilesParserStandard, SOURCE_DIR / "Transactions"),
+        (TransactionCSVFileParserTDCanada, RAW_SOURCE_DIR / "TDCanada__TD-12345"),
+        (TransactionCSVFileParserKOHO, RAW_SOURCE_DIR / "KOHO__KOHO_ABC"),
+    ],
+)
+def test_parser_fast_path_matches_validated_path(parser_class, path: Path):
+    class ParserValidated(parser_class):
+        def parse_values(self, values, file_path, row_num):
+            raise NotImplementedError
+
+    rows = list(parser_class(path).iter_parsed())
+
+    assert rows
+    assert rows == list(ParserValidated(path).iter_parsed())
+
+
+def test_parser_fast_path_falls_back_to_validation(tmp_path: Path):
+    trx_path = tmp_path / "Transactions.csv"
+    trx_path.write_text(
+        "Amount,Date,AccountID,TransactionID,TransactionIDRaw\n"
+        "-1.5,2020-02-03,TD-12345,RENT-xyz,RENT\n"
+        "NaN,2020-02-04,TD-12345,RENT-abc,RENT\n"
+    )
+
+    rows = TransactionFilesParserStandard(trx_path).iter_parsed()
+
+    # The columns are read in the order of the header
+    assert next(rows) == TransactionRow(dt.date(2020, 2, 3), "TD-12345", "RENT-xyz", "RENT", Decimal("-1.5"))
+    with pytest.raises(pydantic.ValidationError):
+        next(rows)
+
+
+def _archive(source_dir: Path, archive: Path) -> Path:
+    """Archive `source_dir` under a top-level directory, as `zip -r` or `tar -czf` of the directory would."""
+    paths = sorted(path for path in source_dir.rglob("*") if path.is_file())
+    if archive.name.endswith(".zip"):
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            for path in paths:
+                zip_file.write(path, Path("export") / path.relative_to(source_dir))
+    else:
+        with tarfile.open(archive, "w:gz") as tar_file:
+            tar_file.add(source_dir, arcname="export")
+    return archive
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("archive_name", ["export.zip", "export.tar.gz", None])
+def test_import_from_archive(tmp_path: Path, archive_name: str | None):
+    source_dir = tmp_path / "source"
+    shutil.copytree(SOURCE_DIR, source_dir)
+    # Gzipped monthly files are decompressed on the fly
+    trx_path = source_dir / "Transactions" / "TDCanada__TD-12345__2020-01.csv"
+    (source_dir / "Transactions" / f"{trx_path.name}.gz").write_bytes(gzip.compress(trx_path.read_bytes()))
+    trx_path.unlink()
+    source = _archive(source_dir, tmp_path / archive_name) if archive_name else source_dir
+
+    call_command("import_data", "--source-dir", str(source), "--workers", "2")
+
+    assert Transaction.objects.count() == 4
+    assert ImportAudit.objects.get().files.count() == 11
+    call_command("import_data", "--source-dir", str(source))
+    assert ImportAudit.objects.latest("id").files.count() == 0
+
+
+def _open_paths() -> set[Path]:
+    return {Path(os.readlink(fd)) for fd in Path("/proc/self/fd").iterdir() if fd.is_symlink()}
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(not Path("/proc/self/fd").is_dir(), reason="Lists the open files from /proc")
+def test_import_reads_tar_in_archive_order_and_closes_it(tmp_path: Path):
+    # Stored in reverse order of their names, as `tar` may list a directory
+    archive = tmp_path / "export.tar.gz"
+    paths = sorted((path for path in SOURCE_DIR.rglob("*") if path.is_file()), reverse=True)
+    with tarfile.open(archive, "w:gz") as tar_file:
+        for path in paths:
+            tar_file.add(path, arcname=str(Path("export") / path.relative_to(SOURCE_DIR)))
+
+    with open_source_dir(str(archive)) as source_dir:
+        trx_paths = list(iter_csv_files(source_dir / "Transactions"))
+        assert [path.name for path in trx_paths] == [
+            path.name for path in paths if path.name != "Accounts.csv"
+        ]
+    assert archive not in _open_paths()
+
+    call_command("import_data", "--source-dir", str(archive))
+    assert Transaction.objects.count() == 4
+    assert archive not in _open_paths()
+
+
+def test_parse_data_from_archive(tmp_path: Path):
+    archive = _archive(RAW_SOURCE_DIR, tmp_path / "raw.zip")
+    call_command("parse_data", "--source-dir", str(RAW_SOURCE_DIR), "--dest-dir", str(tmp_path / "from-dir"))
+    call_command("parse_data", "--source-dir", str(archive), "--dest-dir", str(tmp_path / "from-zip"))
+
+    paths = sorted(path.relative_to(tmp_path / "from-dir") for path in (tmp_path / "from-dir").rglob("*.csv"))
+    assert len(paths) == 7
+    for path in paths:
+        assert (tmp_path / "from-dir" / path).read_bytes() == (tmp_path / "from-zip" / path).read_bytes()
+
+
+def test_import_validates_archive_listing(tmp_path: Path):
+    source_dir = tmp_path / "source"
+    shutil.copytree(SOURCE_DIR, source_dir)
+    (source_dir / "Transactions" / "TDCanada__TD-12345__2020-13.csv").write_text("")
+
+    with pytest.raises(InvalidImportDirStructure, match="Invalid transaction file name"):
+        call_command("import_data", "--source-dir", str(_archive(source_dir, tmp_path / "export.zip")))
+
+
+def test_import_requires_account_in_file_name(tmp_path: Path):
+    source_dir = tmp_path / "source"
+    shutil.copytree(SOURCE_DIR, source_dir)
+    (source_dir / "Transactions" / "TDCanada__TD-789__2020-01.csv").rename(
+        source_dir / "Transactions" / "TD-789_2020-01.csv"
+    )
+
+    with pytest.raises(InvalidImportDirStructure, match="TD-789_2020-01.csv, expected <InstitutionName>__"):
+        call_command("import_data", "--source-dir", str(source_dir))
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("workers", [1, 2])
+def test_import_reports_every_invalid_row_and_writes_nothing(tmp_path: Path, workers: int):
+    source_dir = tmp_path / "source"
+    shutil.copytree(SOURCE_DIR, source_dir)
+    with (source_dir / "Accounts.csv").open("a") as file:
+        file.write("TD-000,TD Closed Account,TDCanada,1O.00,2020-01-05\n")
+    trx_path = source_dir / "Transactions" / "TDCanada__TD-12345__2020-01.csv"
+    with trx_path.open("a") as file:
+        file.write("2020-01-32,TD-12345,ABC-1,ABC,1.00\n2020-01-10,TD-12345,ABC-2,ABC\n")
+
+    with pytest.raises(InvalidImportData, match="Found 3 invalid rows") as exc_info:
+        call_command("import_data", "--source-dir", str(source_dir), "--workers", str(workers))
+
+    assert f"{source_dir / 'Accounts.csv'} [row 4]: amount_initial: " in str(exc_info.value)
+    assert f"{trx_path} [row 5]: Date: " in str(exc_info.value)
+    assert f"{trx_path} [row 6]: Amount: " in str(exc_info.value)
+    assert not Account.objects.exists()
+    assert not Transaction.objects.exists()
+    assert not ImportAudit.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_validates_every_row_before_committing(tmp_path: Path):
+    source_dir = tmp_path / "source"
+    shutil.copytree(SOURCE_DIR, source_dir)
+    trx_path = source_dir / "Transactions" / "TDCanada__TD-789__2020-01.csv"
+    trx_path.write_text(
+        "Date,AccountID,TransactionID,TransactionIDRaw,Amount\n2020-01-32,TD-789,ABC-1,ABC,1.00\n"
+    )
+
+    # The valid rows of the files before it would be committed as they are written
+    with pytest.raises(InvalidImportData, match="Found 1 invalid rows"):
+        call_command(
+            "import_data", "--source-dir", str(source_dir), "--commit-every", "1", "--batch-size", "1"
+        )
+    assert not Account.objects.exists()
+    assert not Transaction.objects.exists()
+
+    trx_path.write_text("Date,AccountID,TransactionID,TransactionIDRaw,Amount\n")
+    call_command("import_data", "--source-dir", str(source_dir), "--commit-every", "1", "--batch-size", "1")
+    # Every row is validated before the first write, the files are read a second time to be written
+    stages = {stage.name: stage for stage in ImportAudit.objects.get().stages.order_by("id")}
+    assert list(stages)[2:5] == ["parse_accounts", "validate_transactions", "write"]
+    assert (stages["validate_transactions"].n_rows, stages["parse_transactions"].n_rows) == (4, 4)
+    balances = TransactionReadService().get_balance_as_of(
+        accounts=EntityService().get_all_account_ids(), date=dt.date(2020, 3, 1)
+    )
+    assert sum(balances.values()) == Decimal("6036.6300")
+
+
+@pytest.mark.django_db
+def test_import_requires_accounts_header(tmp_path: Path):
+    source_dir = tmp_path / "source"
+    shutil.copytree(SOURCE_DIR, source_dir)
+    lines = (source_dir / "Accounts.csv").read_text().splitlines(keepends=True)
+    (source_dir / "Accounts.csv").write_text("".join(lines[1:]))
+
+    with pytest.raises(InvalidImportData, match=r"\[row 0\]: ParsingErrorRow: Missing required columns"):
+        call_command("import_data", "--source-dir", str(source_dir))
+
+    assert not Account.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_reports_transactions_inconsistent_with_accounts(tmp_path: Path):
+    source_dir = tmp_path / "source"
+    shutil.copytree(SOURCE_DIR, source_dir)
+    trx_path = source_dir / "Transactions" / "TDCanada__TD-12345__2020-01.csv"
+
+    # TD-12345 starts on 2020-01-05, after 3 of its transactions
+    with pytest.raises(InvalidImportData, match="Found 1 transaction files inconsistent") as exc_info:
+        call_command("import_data", "--source-dir", str(source_dir), "--strict-date-start")
+    assert (
+        f"{trx_path}: 3 transactions of account 'TD-12345' are dated before its start date 2020-01-05"
+        in str(exc_info.value)
+    )
+    assert not Account.objects.exists()
+
+    # Only reported by default, Accounts.csv is then unchanged and its accounts are read from the database
+    call_command("import_data", "--source-dir", str(source_dir))
+    unknown_path = source_dir / "Transactions" / "TDCanada__TD-000__2020-01.csv"
+    unknown_path.write_text(
+        "Date,AccountID,TransactionID,TransactionIDRaw,Amount\n2020-01-10,TD-000,ABC-1,ABC,1.00\n"
+    )
+    with trx_path.open("a") as file:
+        file.write("2020-01-21,TD-999,ABC-2,ABC,1.00\n")
+
+    with pytest.raises(InvalidImportData, match="Found 3 transaction files inconsistent") as exc_info:
+        call_command("import_data", "--source-dir", str(source_dir))
+    assert f"{unknown_path}: Account 'TD-000' of the file name is not in Accounts.csv" in str(exc_info.value)
+    assert f"{unknown_path}: Account 'TD-000' of transactions is not in Accounts.csv" in str(exc_info.value)
+    assert f"{trx_path}: Account 'TD-999' of transactions is not in Accounts.csv" in str(exc_info.value)
+    assert Transaction.objects.count() == 4
+
+
+def test_generate_sample_data_is_reproducible(tmp_path: Path):
+    for name in ["a", "b"]:
+        call_command(
+            "generate_sample_data",
+            *("--dest-dir", str(tmp_path / name), "--accounts", "2", "--transactions-per-day", "3"),
+        )
+    paths = sorted(path.relative_to(tmp_path / "a") for path in (tmp_path / "a").rglob("*.csv"))
+    assert len(paths) == 1 + 2 * 12
+    for path in paths:
+        assert (tmp_path / "a" / path).read_bytes() == (tmp_path / "b" / path).read_bytes()
+    # The balances are running totals, the KOHO rows are in the order of their times
+    for path in (tmp_path / "a" / "KOHO__KOHO-0001").glob("*.csv"):
+        timestamps = [line.split(",")[0] for line in path.read_text().splitlines()[1:]]
+        assert timestamps == sorted(timestamps)
+
+    # The raw exports parse as those of the banks do
+    call_command("parse_data", "--source-dir", str(tmp_path / "a"), "--dest-dir", str(tmp_path / "parsed"))
+    rows = list(TransactionFilesParserStandard(tmp_path / "parsed" / "Transactions").iter_parsed())
+    assert 2 * 365 * 2 < len(rows) < 2 * 365 * 4
+    assert {row.account_id for row in rows} == {"TD-0000", "KOHO-0001"}
+    assert len({row.transaction_id for row in rows}) == len(rows)
+
+
+@pytest.mark.django_db
+def test_import_records_stage_stats():
+    stdout = io.StringIO()
+    call_command("import_data", "--source-dir", str(SOURCE_DIR), "--stats", stdout=stdout)
+
+    stages = {stage.name: stage for stage in ImportAudit.objects.get().stages.order_by("id")}
+    assert list(stages) == [
+        "validate",
+        "manifest",
+        "parse_accounts",
+        "write",
+        "parse_transactions",
+        "update_config",
+    ]
+    assert (stages["parse_accounts"].n_rows, stages["parse_transactions"].n_rows, stages["write"].n_rows) == (
+        3,
+        4,
+        7,
+    )
+    # The queries of the writes are not counted to the parsing they consume
+    assert stages["write"].n_queries > 0
+    assert stages["parse_transactions"].n_queries == 0
+    assert all(stage.seconds >= 0 and stage.peak_rss_kb > 0 for stage in stages.values())
+    assert stdout.getvalue().splitlines()[0].split() == [
+        *("Stage", "Seconds", "Rows", "Rows/s", "Queries", "Peak", "RSS", "(MiB)")
+    ]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("upsert", [False, True])
+def test_reimport_unchanged_transactions_only_reads(upsert: bool):
+    entity_service = EntityService()
+    trx_service = TransactionWriteService(entity_service=entity_service)
+    entity_service.bulk_create_or_update_accounts(
+        AccountFileParserStandard(SOURCE_DIR / "Accounts.csv").iter_parsed()
+    )
+    trx_service.bulk_create_or_update_transactions(
+        TransactionFilesParserStandard(SOURCE_DIR / "Transactions").iter_parsed(), upsert=upsert
+    )
+    updated_at = dict(Transaction.objects.values_list("transaction_id", "updated_at"))
+
+    with CaptureQueriesContext(connection) as queries:
+        counts = trx_service.bulk_create_or_update_transactions(
+            TransactionFilesParserStandard(SOURCE_DIR / "Transactions").iter_parsed(), upsert=upsert
+        )
+
+    assert counts == (0, 0, 4)
+    assert all(query["sql"].startswith("SELECT") for query in queries)
+    assert dict(Transaction.objects.values_list("transaction_id", "updated_at")) == updated_at
+
+    # The same amount with another scale is the same content
+    trx = Transaction.objects.get(transaction_id="PAYROLL-abc")
+    rows = [
+        TransactionRow(trx.date, "TD-12345", "PAYROLL-abc", "PAYROLL", Decimal("5000")),
+        TransactionRow(trx.date, "TD-12345", "ABCXYZ-123", "ABC XYZ", Decimal("-50.05")),
+    ]
+    assert trx_service.bulk_create_or_update_transactions(iter(rows), upsert=upsert) == (0, 1, 1)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("rebuild", [False, True])
+def test_balances_filled_on_database_imported_before_read_model(rebuild: bool):
+    call_command("import_data", "--source-dir", str(SOURCE_DIR))
+    # As imported before the read model existed, then migrated
+    DailyBalance.objects.all().delete()
+    MonthlyBalance.objects.all().delete()
+    import_module("transactions.migrations.0002_dailybalance").backfill_daily_balances(apps, None)
+    import_module("transactions.migrations.0006_backfill_monthlybalance").backfill_monthly_balances(
+        apps, None
+    )
+    entity_service = EntityService()
+    if rebuild:
+        # Rebuilt from the earliest transaction, though the refresh starts at the later start of the accounts
+        DailyBalance.objects.all().delete()
+        MonthlyBalance.objects.all().delete()
+        amount_initial_map = entity_service.get_amount_initial_map(entity_service.get_all_account_ids())
+        DailyBalanceWriteService().refresh_daily_balances(
+            {account_id: date_start for account_id, (date_start, _) in amount_initial_map.items()}
+        )
+    else:
+        call_command("import_data", "--source-dir", str(SOURCE_DIR))
+
+    chart_service = ChartService(transaction_service=TransactionReadService(), entity_service=entity_service)
+    kwargs = dict(
+        accounts=entity_service.get_all_account_ids(),
+        date_fr=dt.date(2020, 3, 1),
+        date_to=dt.date(2020, 3, 1),
+    )
+    assert chart_service.get_balance_over_dates(**kwargs) == [(0, Decimal("6036.6300"))]
+    assert chart_service.get_value_over_dates(**kwargs) == [(0, Decimal("6036.6300"))]
+    # From the monthly checkpoints
+    assert chart_service.get_value_over_dates_by_account(**kwargs).total == [(0, Decimal("6036.6300"))]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_checkpoints_refresh_balances_of_committed_rows(monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("Disk full")
+
+    # Fails once all the transactions are written, after the last checkpoint
+    monkeypatch.setattr(ConfigWriteService, "update_or_create_latest_config", fail)
+    with pytest.raises(RuntimeError, match="Disk full"):
+        call_command(
+            "import_data", "--source-dir", str(SOURCE_DIR), "--commit-every", "1", "--batch-size", "1"
+        )
+    monkeypatch.undo()
+
+    # The committed transactions have their balances, and the charts computed before them are not read again
+    entity_service = EntityService()
+    chart_service = ChartService(transaction_service=TransactionReadService(), entity_service=entity_service)
+    kwargs = dict(
+        accounts=entity_service.get_all_account_ids(),
+        date_fr=dt.date(2019, 12, 25),
+        date_to=dt.date(2020, 4, 30),
+    )
+    assert 0 < Transaction.objects.count() < 4
+    assert chart_service.get_balance_over_dates(**kwargs) == chart_service.get_value_over_dates(**kwargs)
+    assert DataVersionService().get_data_version() > 0
+
+    call_command("import_data", "--source-dir", str(SOURCE_DIR))
+    kwargs.update(date_fr=dt.date(2020, 3, 1), date_to=dt.date(2020, 3, 1))
+    assert chart_service.get_balance_over_dates(**kwargs) == [(0, Decimal("6036.6300"))]
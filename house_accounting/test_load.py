@@ -0,0 +1,34 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks.load import percentile
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert [percentile(values, q) for q in (50, 95, 99, 100)] == [50.0, 95.0, 99.0, 100.0]
+    assert percentile([], 50) == 0.0
+
+
+def test_load_test_reads_during_import(tmp_path: Path):
+    # Run as a benchmark is, against a database file switched to WAL by the import: the in-memory test database
+    # is shared between the threads with table-level locks instead
+    # Without the cache of the charts, so that the balances are queried while the import writes
+    subprocess.run(
+        [sys.executable, "-m", "benchmarks.load", "--rows", "2000", "--accounts", "2", "--years", "1"]
+        + ["--clients", "2", "--duration", "0.2", "--import-transactions", "1000", "--no-cache"]
+        + ["--output", str(tmp_path / "bench-load.json")],
+        cwd=Path(__file__).parent.parent,
+        check=True,
+        capture_output=True,
+    )
+    result_idle, result_import = json.loads((tmp_path / "bench-load.json").read_text())["results"]
+
+    assert (result_idle["name"], result_import["name"]) == ("idle", "import")
+    assert result_import["import_error"] is None
+    for result in (result_idle, result_import):
+        assert result["n_requests"] > 0
+        assert result["n_lock_errors"] == 0
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
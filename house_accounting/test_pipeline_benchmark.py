@@ -0,0 +1,20 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks.pipeline import run_pipeline
+
+
+@pytest.mark.django_db
+def test_pipeline_benchmark(tmp_path: Path):
+    results = run_pipeline(tmp_path, n_transactions=500, n_accounts=2, years=1, repeat=1)
+
+    assert [result.name for result in results] == [
+        "parse_data",
+        "import_data",
+        "ChartService.get_value_over_dates",
+        "CurrentBalancesChartView",
+    ]
+    n_transactions = results[0].n_transactions
+    assert 400 < n_transactions < 600
+    assert all(result.n_transactions == n_transactions and result.seconds > 0 for result in results)
@@ -0,0 +1,31 @@
+import datetime as dt
+from pathlib import Path
+
+from django.core.management import call_command
+import pytest
+
+from benchmarks.query_plans import collect_query_plans
+from householdentities.services import EntityService
+
+
+@pytest.mark.django_db
+def test_query_plans_use_indexes():
+    call_command(
+        "import_data",
+        *("--source-dir", str(Path(__file__).parent / "test-input-data-0")),
+    )
+
+    results = collect_query_plans(
+        accounts=EntityService().get_all_account_ids(),
+        date_fr=dt.date(2020, 3, 1),
+        date_to=dt.date(2020, 3, 31),
+        repeat=1,
+    )
+
+    assert {result.name: result.full_scans for result in results if result.full_scans} == {}
+    # The queries of the dashboard are covered
+    assert {
+        "TransactionReadService.get_net_flow_by_account_period[week]",
+        "TransactionReadService.get_amount_by_account_date",
+        "ChartService.get_balance_over_periods_by_account[month]",
+    } <= {result.name for result in results}
@@ -3,9 +3,13 @@
 from django.contrib import admin
 from django.urls import path
 
-from charts.views import CurrentBalancesChartView
+from charts.views import CurrentBalancesAPIView, CurrentBalancesChartView
+from importing.views import ImportJobCreateView, ImportJobStatusView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", CurrentBalancesChartView.as_view(), name="index"),
+    path("api/balances", CurrentBalancesAPIView.as_view(), name="api-balances"),
+    path("api/imports", ImportJobCreateView.as_view(), name="api-imports"),
+    path("api/imports/<int:job_id>", ImportJobStatusView.as_view(), name="api-import-status"),
 ]
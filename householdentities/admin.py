@@ -1,11 +1,22 @@
 from django.contrib import admin
 
+from config.admin import DataVersionAdminMixin
+from transactions.services import DailyBalanceWriteService
+
 from .models import Account
 
 
 @admin.register(Account)
-class AccountAdmin(admin.ModelAdmin):
+class AccountAdmin(DataVersionAdminMixin, admin.ModelAdmin):
     list_display = ("natural_id", "name", "institution", "balance_initial", "date_start", "created_at")
     list_display_links = ("natural_id", "name")
     search_fields = ("natural_id", "name")
     list_filter = ("institution",)
+
+    def save_model(self, request, obj, form, change):
+        date_start_previous = Account.objects.filter(pk=obj.pk).values_list("date_start", flat=True).first()
+        super().save_model(request, obj, form, change)
+        # The balances of a new account, or of one whose opening balance moved, are rebuilt from its start
+        if not change or {"balance_initial", "date_start"} & set(form.changed_data):
+            date_fr = min(obj.date_start, date_start_previous or obj.date_start)
+            DailyBalanceWriteService().refresh_daily_balances({obj.pk: date_fr})
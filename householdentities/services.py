@@ -23,6 +23,18 @@ class EntityService:
         qs = Account.objects.filter(natural_id__in=account_ids).values_list("natural_id", "id")
         return {natural_id: account_id for natural_id, account_id in qs}
 
+    def get_all_account_id_map(self) -> dict[str, int]:
+        qs = Account.objects.values_list("natural_id", "id")
+        return {natural_id: account_id for natural_id, account_id in qs}
+
+    def get_account_date_start_map(self) -> dict[str, dt.date]:
+        qs = Account.objects.values_list("natural_id", "date_start")
+        return {natural_id: date_start for natural_id, date_start in qs}
+
+    def get_account_name_map(self, account_ids: list[int]) -> dict[int, str]:
+        qs = Account.objects.filter(id__in=account_ids).values_list("id", "name")
+        return {account_id: name for account_id, name in qs}
+
     def get_amount_initial_map(self, account_ids: list[int]) -> dict[int, tuple[dt.date, decimal.Decimal]]:
         qs = Account.objects.filter(id__in=account_ids).values_list("id", "date_start", "balance_initial")
         return {account_id: (date_start, amount_initial) for account_id, date_start, amount_initial in qs}
@@ -30,11 +42,35 @@ class EntityService:
     def get_earliest_account_start_date(self) -> dt.date | None:
         return Account.objects.order_by("date_start").values_list("date_start", flat=True).first()
 
-    def bulk_create_or_update_accounts(self, account_ids: Iterator[IAccountInput]) -> tuple[int, int]:
+    def bulk_create_or_update_accounts(
+        self,
+        account_ids: Iterator[IAccountInput],
+        batch_size: int = 100,
+        upsert: bool = False,
+    ) -> tuple[int, int]:
+        """
+        Create or update accounts by natural ID, `batch_size` accounts at a time.
+
+        :param upsert: Write each batch with a single `INSERT ... ON CONFLICT DO UPDATE` instead of a bulk
+            create plus a bulk update of the fetched existing rows.
+        :return: The number of accounts created and updated.
+        """
+        # Imported here to avoid a circular import, transactions depend on household entities
+        from transactions.services import DailyBalanceWriteService
+
         n_created = 0
         n_updated = 0
+        # Earliest start date touched per account, of the new accounts and of those whose opening balance
+        # moved, the daily balances are only rebuilt from there on
+        date_touched_by_natural_id: dict[str, dt.date] = {}
+
+        for accounts_chunked in it.iter_chunked(account_ids, size=batch_size):
+            if upsert:
+                created, updated = self._upsert_accounts(accounts_chunked, date_touched_by_natural_id)
+                n_created += created
+                n_updated += updated
+                continue
 
-        for accounts_chunked in it.iter_chunked(account_ids, size=100):
             natural_ids = {account_in.account_id for account_in in accounts_chunked}
             accounts_existing = {
                 account.natural_id: account for account in Account.objects.filter(natural_id__in=natural_ids)
@@ -46,12 +82,20 @@ class EntityService:
             for account_in in accounts_chunked:
                 if account_in.account_id in accounts_existing:
                     account_existing = accounts_existing[account_in.account_id]
+                    if (account_existing.date_start, account_existing.balance_initial) != (
+                        account_in.date_start,
+                        account_in.amount_initial,
+                    ):
+                        date_touched_by_natural_id[account_in.account_id] = min(
+                            account_existing.date_start, account_in.date_start
+                        )
                     account_existing.name = account_in.name
                     account_existing.institution = Institution[account_in.institution]
                     account_existing.balance_initial = account_in.amount_initial
                     account_existing.date_start = account_in.date_start
                     accounts_update.append(account_existing)
                 else:
+                    date_touched_by_natural_id[account_in.account_id] = account_in.date_start
                     accounts_create.append(
                         Account(
                             natural_id=account_in.account_id,
@@ -68,4 +112,52 @@ class EntityService:
                 fields=["name", "institution", "balance_initial", "date_start"],
             )
 
+        account_id_map = self.get_account_id_map(date_touched_by_natural_id.keys())
+        DailyBalanceWriteService().refresh_daily_balances(
+            {account_id_map[natural_id]: date for natural_id, date in date_touched_by_natural_id.items()}
+        )
+
         return n_created, n_updated
+
+    def _upsert_accounts(
+        self,
+        accounts: tuple[IAccountInput, ...],
+        date_touched_by_natural_id: dict[str, dt.date],
+    ) -> tuple[int, int]:
+        # The last occurrence wins if a natural ID is repeated within the batch
+        accounts_by_natural_id: dict[str, IAccountInput] = {
+            account_in.account_id: account_in for account_in in accounts
+        }
+
+        # Only the keys and old opening balances of the existing rows are read, for the counts and the balance
+        # refresh
+        opening_existing: dict[str, tuple[dt.date, decimal.Decimal]] = {
+            natural_id: (date_start, balance_initial)
+            for natural_id, date_start, balance_initial in Account.objects.filter(
+                natural_id__in=accounts_by_natural_id
+            ).values_list("natural_id", "date_start", "balance_initial")
+        }
+        for natural_id, account_in in accounts_by_natural_id.items():
+            opening = opening_existing.get(natural_id)
+            if opening is None:
+                date_touched_by_natural_id[natural_id] = account_in.date_start
+            elif opening != (account_in.date_start, account_in.amount_initial):
+                date_touched_by_natural_id[natural_id] = min(opening[0], account_in.date_start)
+
+        Account.objects.bulk_create(
+            [
+                Account(
+                    natural_id=account_in.account_id,
+                    name=account_in.name,
+                    institution=Institution[account_in.institution],
+                    balance_initial=account_in.amount_initial,
+                    date_start=account_in.date_start,
+                )
+                for account_in in accounts_by_natural_id.values()
+            ],
+            update_conflicts=True,
+            unique_fields=["natural_id"],
+            update_fields=["name", "institution", "balance_initial", "date_start", "updated_at"],
+        )
+        n_updated = len(opening_existing)
+        return len(accounts_by_natural_id) - n_updated, n_updated
@@ -1,3 +1,42 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ImportAudit, ImportAuditFile, ImportAuditStage, ImportJob, ImportLock
+
+
+class ImportAuditFileInline(admin.TabularInline):
+    model = ImportAuditFile
+    extra = 0
+
+
+class ImportAuditStageInline(admin.TabularInline):
+    model = ImportAuditStage
+    extra = 0
+
+
+@admin.register(ImportAudit)
+class ImportAuditAdmin(admin.ModelAdmin):
+    list_display = ("id", "source_dir", "user", "timestamp")
+    date_hierarchy = "timestamp"
+    inlines = (ImportAuditStageInline, ImportAuditFileInline)
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "status",
+        "source_path",
+        "user",
+        "n_files_done",
+        "n_rows",
+        "created_at",
+        "finished_at",
+    )
+    list_filter = ("status",)
+    date_hierarchy = "created_at"
+
+
+@admin.register(ImportLock)
+class ImportLockAdmin(admin.ModelAdmin):
+    # Deleting the lock of a job that no process runs anymore lets the queued jobs run
+    list_display = ("name", "job", "acquired_at")
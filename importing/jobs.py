@@ -0,0 +1,255 @@
+import contextlib
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Any, Iterator
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, close_old_connections, connections, transaction
+from django.utils import timezone
+
+from importing.models import ImportJob, ImportJobStatus, ImportLock
+from importing.services import ImportProgress
+from importing.sources import ARCHIVE_SUFFIXES
+
+logger = logging.getLogger(__name__)
+
+# SQLite has a single writer, imports run one after the other by default
+IMPORT_JOB_WORKERS_DEFAULT = 1
+IMPORT_JOB_COMMIT_EVERY_DEFAULT = 10_000
+
+# The import lock is a single row, its name is its key
+IMPORT_LOCK_NAME = "import"
+# Seconds between the attempts of a queued job to take the import lock
+IMPORT_LOCK_POLL_SECONDS = 1.0
+
+
+class InvalidImportUpload(Exception):
+    """Custom exception for uploads that cannot be imported."""
+
+
+class ImportJobProgress(ImportProgress):
+    """Progress of an import job, saved to the job with each commit of the import."""
+
+    def __init__(self, job_id: int) -> None:
+        super().__init__()
+        self.job_id = job_id
+
+    def checkpoint(self) -> None:
+        ImportJob.objects.filter(id=self.job_id).update(
+            n_files_total=self.n_files_total, n_files_done=self.n_files_done, n_rows=self.n_rows
+        )
+
+
+class ImportJobRunner:
+    """
+    Run the queued import jobs on a pool of threads of this process, so that no request waits for an import.
+
+    The database holds the status of the jobs. The imports commit every `IMPORT_JOB_COMMIT_EVERY`
+    transactions, and save the progress of their job with each commit, which the other processes see. The
+    runner holds the live progress of the jobs of this process in memory.
+    The jobs take the import lock row before they run, so that only one of them writes at a time, whatever the
+    number of workers and processes.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = IMPORT_JOB_WORKERS_DEFAULT,
+        commit_every: int = IMPORT_JOB_COMMIT_EVERY_DEFAULT,
+    ) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="import-job")
+        self._commit_every = commit_every
+        self._progress_by_job_id: dict[int, ImportJobProgress] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id: int) -> Future:
+        with self._lock:
+            self._progress_by_job_id[job_id] = ImportJobProgress(job_id)
+        return self._executor.submit(self._run, job_id)
+
+    def get_progress(self, job_id: int) -> ImportJobProgress | None:
+        """Return the progress of a job queued or running in this process."""
+        with self._lock:
+            return self._progress_by_job_id.get(job_id)
+
+    def _run(self, job_id: int) -> None:
+        progress = self.get_progress(job_id)
+        assert progress is not None
+        close_old_connections()
+        try:
+            job = ImportJob.objects.get(id=job_id)
+            with _import_lock(job):
+                job.status = ImportJobStatus.running.value
+                job.started_at = timezone.now()
+                job.save(update_fields=["status", "started_at"])
+                try:
+                    call_command(
+                        "import_data",
+                        *("--source-dir", job.source_path, "--commit-every", str(self._commit_every)),
+                        progress=progress,
+                    )
+                except Exception as e:
+                    logger.exception("Import job failed [job: %s]", job_id)
+                    job.status = ImportJobStatus.failed.value
+                    job.error = f"{e.__class__.__name__}: {e}"
+                else:
+                    job.status = ImportJobStatus.succeeded.value
+                    job.audit_id = progress.audit_id
+                finally:
+                    # Before the job is seen as finished, the upload is not needed anymore either way
+                    _delete_upload(job.source_path)
+                job.n_files_total = progress.n_files_total
+                job.n_files_done = progress.n_files_done
+                job.n_rows = progress.n_rows
+                job.finished_at = timezone.now()
+                job.save()
+        finally:
+            with self._lock:
+                del self._progress_by_job_id[job_id]
+            # Each thread of the pool has its own connections
+            connections.close_all()
+
+
+@contextlib.contextmanager
+def _import_lock(job: ImportJob) -> Iterator[None]:
+    """Hold the import lock for `job`, waiting for the job holding it to finish."""
+    while True:
+        # Read first, the insert would wait for the write transaction of the import running
+        if not ImportLock.objects.filter(name=IMPORT_LOCK_NAME).exists():
+            try:
+                ImportLock.objects.create(name=IMPORT_LOCK_NAME, job=job)
+                break
+            except IntegrityError:
+                pass
+        time.sleep(IMPORT_LOCK_POLL_SECONDS)
+    try:
+        yield
+    finally:
+        ImportLock.objects.filter(name=IMPORT_LOCK_NAME, job=job).delete()
+
+
+def _delete_upload(source_path: str) -> None:
+    # The directory of the upload, see ImportJobService.queue_import
+    shutil.rmtree(Path(source_path).parent, ignore_errors=True)
+
+
+def _is_process_alive(hostname: str, pid: int | None) -> bool:
+    """Return whether the process running a job may still run, only the processes of this host are checked."""
+    if pid is None:
+        # Queued before the process was recorded
+        return False
+    if hostname != socket.gethostname():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def fail_interrupted_jobs() -> int:
+    """
+    Mark the jobs left queued or running by a process that stopped as failed, and release their lock.
+
+    The jobs run on threads of the web server process, they stop with it and are not resumed. The jobs of the
+    processes still running, or of other hosts, are left as they are.
+
+    :return: The number of jobs marked as failed.
+    """
+    jobs_interrupted = [
+        job
+        for job in ImportJob.objects.filter(status__in=[ImportJobStatus.queued, ImportJobStatus.running])
+        if not _is_process_alive(job.hostname, job.pid)
+    ]
+    n_failed = ImportJob.objects.filter(
+        id__in=[job.id for job in jobs_interrupted],
+        status__in=[ImportJobStatus.queued, ImportJobStatus.running],
+    ).update(
+        status=ImportJobStatus.failed.value,
+        error="Interrupted: the server stopped before the import finished",
+        finished_at=timezone.now(),
+    )
+    ImportLock.objects.filter(job__in=[job.id for job in jobs_interrupted]).delete()
+    for job in jobs_interrupted:
+        _delete_upload(job.source_path)
+    if n_failed:
+        logger.warning("Marked the import jobs of stopped processes as failed [jobs: %s]", n_failed)
+    return n_failed
+
+
+_runner: ImportJobRunner | None = None
+_runner_lock = threading.Lock()
+
+
+def get_import_job_runner() -> ImportJobRunner:
+    """Return the runner of this process, started on first use."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = ImportJobRunner(
+                max_workers=getattr(settings, "IMPORT_JOB_WORKERS", IMPORT_JOB_WORKERS_DEFAULT),
+                commit_every=getattr(settings, "IMPORT_JOB_COMMIT_EVERY", IMPORT_JOB_COMMIT_EVERY_DEFAULT),
+            )
+        return _runner
+
+
+class ImportJobService:
+    def __init__(self, runner: ImportJobRunner | None = None) -> None:
+        self.runner = runner or get_import_job_runner()
+
+    def queue_import(self, file: IO[bytes], file_name: str, user: Any = None) -> ImportJob:
+        """
+        Save an uploaded archive of an import directory, and queue its import.
+
+        :param file_name: The name of the uploaded file, which must be a `.zip`, `.tar.gz` or `.tgz` archive.
+        """
+        if not file_name.endswith(ARCHIVE_SUFFIXES):
+            raise InvalidImportUpload(f"Unsupported file type, expected one of {', '.join(ARCHIVE_SUFFIXES)}")
+
+        # One directory per upload, uploads of the same file name do not overwrite each other
+        upload_dir = Path(settings.IMPORT_UPLOAD_DIR) / uuid.uuid4().hex
+        upload_dir.mkdir(parents=True)
+        source_path = upload_dir / Path(file_name).name
+        with source_path.open("wb") as fo:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                fo.write(chunk)
+
+        # Run by the runner of this process
+        job = ImportJob.objects.create(
+            user=user if user is not None and user.is_authenticated else None,
+            source_path=str(source_path),
+            hostname=socket.gethostname(),
+            pid=os.getpid(),
+        )
+        # Once the job is visible to the thread of the pool
+        transaction.on_commit(lambda: self.runner.submit(job.id))
+        return job
+
+    def get_status(self, job: ImportJob) -> dict[str, Any]:
+        """Return the status of a job, with its live progress if run here, else as of its last commit."""
+        progress = self.runner.get_progress(job.id)
+        if progress is None or job.status in (ImportJobStatus.succeeded, ImportJobStatus.failed):
+            progress = ImportProgress(
+                n_files_total=job.n_files_total, n_files_done=job.n_files_done, n_rows=job.n_rows
+            )
+        return {
+            "id": job.id,
+            "status": job.status,
+            "n_files_total": progress.n_files_total,
+            "n_files_done": progress.n_files_done,
+            "n_rows": progress.n_rows,
+            "error": job.error,
+            "audit_id": job.audit_id,
+            "created_at": job.created_at.isoformat(),
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
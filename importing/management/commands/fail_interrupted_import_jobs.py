@@ -0,0 +1,18 @@
+import logging
+
+from django.core.management import BaseCommand
+
+from importing.jobs import fail_interrupted_jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark the import jobs left queued or running by a web server process that stopped as failed, release "
+        "their lock and delete their uploads. Run it when the web server starts."
+    )
+
+    def handle(self, **options) -> None:
+        n_failed = fail_interrupted_jobs()
+        logger.info("Marked the interrupted import jobs as failed [jobs: %s]", n_failed)
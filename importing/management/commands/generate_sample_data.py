@@ -0,0 +1,175 @@
+import datetime as dt
+import decimal
+import logging
+import math
+import random
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from importing.services import InstitutionName
+
+logger = logging.getLogger(__name__)
+
+CENTS = decimal.Decimal("0.01")
+ZERO = decimal.Decimal("0.00")
+PAYROLL_EVERY_DAYS = 14
+
+# Spending descriptions, with the typical amount in dollars
+MERCHANTS = [
+    ("T&T Supermarket", 60),
+    ("Amazon web", 35),
+    ("PAYPAL *DOORDAS", 30),
+    ("Shell Gas Station", 55),
+    ("Starbucks", 7),
+    ("Netflix.com", 17),
+    ("Costco Wholesale", 150),
+    ("Uber Trip", 20),
+    ("Shoppers Drug Mart", 25),
+    ("Canadian Tire", 80),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate raw TD and KOHO exports of synthetic transactions, in the format of docs/sample_data_unparsed, "
+        "to be parsed by parse_data. The output only depends on the options."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--dest-dir",
+            required=True,
+            type=str,
+            help="Path to the directory to write the raw exports to, one directory per account.",
+        )
+        parser.add_argument(
+            "--accounts", type=int, default=3, help="Number of accounts, alternately TD and KOHO."
+        )
+        parser.add_argument(
+            "--years", type=int, default=1, help="Number of years of transactions per account."
+        )
+        parser.add_argument(
+            "--transactions-per-day",
+            type=float,
+            default=2.0,
+            help="Average number of transactions per account and day, including a biweekly payroll deposit.",
+        )
+        parser.add_argument(
+            "--date-to",
+            type=dt.date.fromisoformat,
+            default=dt.date(2025, 12, 31),
+            help="Date of the last day of transactions, YYYY-MM-DD.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator.")
+
+    def handle(self, **options) -> None:
+        dest_dir = Path(options["dest_dir"])
+        date_to: dt.date = options["date_to"]
+        date_fr = date_to - dt.timedelta(days=365 * options["years"] - 1)
+        rnd = random.Random(options["seed"])
+
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        account_lines = ["AccountID,Name,Institution,AmountInitial,DateStart"]
+        n_rows = 0
+        for i in range(options["accounts"]):
+            institution = InstitutionName.td_canada if i % 2 == 0 else InstitutionName.koho
+            account_id = f"{'TD' if institution == InstitutionName.td_canada else 'KOHO'}-{i:04}"
+            amount_initial = decimal.Decimal(rnd.randrange(0, 500_000)) * CENTS
+            account_lines.append(
+                f"{account_id},Sample Account {i},{institution.value},{amount_initial},{date_fr.isoformat()}"
+            )
+            n_rows += self._write_account(
+                dest_dir / f"{institution.value}__{account_id}",
+                institution,
+                amount_initial,
+                date_fr,
+                date_to,
+                options["transactions_per_day"],
+                rnd,
+            )
+        (dest_dir / "Accounts.csv").write_text("\n".join(account_lines) + "\n")
+        logger.info("Generated %s transactions of %s accounts in %s", n_rows, options["accounts"], dest_dir)
+
+    def _write_account(
+        self,
+        account_dir: Path,
+        institution: InstitutionName,
+        balance: decimal.Decimal,
+        date_fr: dt.date,
+        date_to: dt.date,
+        transactions_per_day: float,
+        rnd: random.Random,
+    ) -> int:
+        """Write the monthly exports of an account, and return the number of transactions written."""
+        account_dir.mkdir(exist_ok=True)
+        spending_per_day = max(transactions_per_day - 1 / PAYROLL_EVERY_DAYS, 0)
+        lines_by_month: dict[str, list[str]] = {}
+        n_rows = 0
+        date = date_fr
+        while date <= date_to:
+            month = date.strftime("%Y-%m")
+            lines = lines_by_month.setdefault(month, [])
+            # Biweekly payroll, then the day's spending. The descriptions end with a reference number, as in the
+            # bank exports, the transaction IDs parsed from them would otherwise collide across accounts
+            if (date - date_fr).days % PAYROLL_EVERY_DAYS == PAYROLL_EVERY_DAYS - 1:
+                amount = decimal.Decimal(rnd.randrange(150_000, 350_000)) * CENTS
+                amounts = [(f"PAYROLL DEPOSIT #{rnd.randrange(1_000_000):06}", amount)]
+            else:
+                amounts = []
+            for _ in range(_poisson(spending_per_day, rnd)):
+                merchant, amount_typical = rnd.choice(MERCHANTS)
+                amount = decimal.Decimal(str(rnd.lognormvariate(0, 0.5) * amount_typical)).quantize(CENTS)
+                amounts.append((f"{merchant} #{rnd.randrange(1_000_000):06}", -amount))
+            # The balances are running totals, the times of the day's transactions are drawn in their order
+            seconds = (
+                sorted(rnd.randrange(24 * 60 * 60) for _ in amounts)
+                if institution == InstitutionName.koho
+                else [0] * len(amounts)
+            )
+            for (description, amount), second in zip(amounts, seconds):
+                balance += amount
+                timestamp = dt.datetime.combine(date, dt.time()) + dt.timedelta(seconds=second)
+                lines.append(_format_line(institution, timestamp, description, amount, balance))
+            n_rows += len(amounts)
+            date += dt.timedelta(days=1)
+
+        for month, lines in lines_by_month.items():
+            if institution == InstitutionName.td_canada:
+                # TD exports have no header
+                (account_dir / f"accountactivity-{month}.csv").write_text("".join(lines))
+            else:
+                (account_dir / f"{month}.csv").write_text(
+                    "Date,Transaction,Loads,Withdrawal,Balance,Notes\n" + "".join(lines)
+                )
+        return n_rows
+
+
+def _poisson(mean: float, rnd: random.Random) -> int:
+    # Knuth's algorithm, the daily means are small
+    limit = math.exp(-mean)
+    n = 0
+    p = rnd.random()
+    while p > limit:
+        n += 1
+        p *= rnd.random()
+    return n
+
+
+def _format_line(
+    institution: InstitutionName,
+    timestamp: dt.datetime,
+    description: str,
+    amount: decimal.Decimal,
+    balance: decimal.Decimal,
+) -> str:
+    amount_in = amount if amount > 0 else None
+    amount_out = -amount if amount < 0 else None
+    if institution == InstitutionName.td_canada:
+        # MM/DD/YYYY,Description,AmountOut,AmountIn,Balance
+        return f"{timestamp:%m/%d/%Y},{description},{amount_out or ''},{amount_in or ''},{balance}\n"
+    # Date,Transaction,Loads,Withdrawal,Balance,Notes
+    return (
+        f"{timestamp:%Y-%m-%d %H:%M:%S} -0700 -0700,{description},"
+        f"{amount_in or ZERO},{amount_out or ZERO},{balance},\n"
+    )
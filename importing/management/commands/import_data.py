@@ -1,33 +1,52 @@
+import argparse
 import datetime as dt
 import decimal
 from gettext import install
+import itertools
 import logging
-from pathlib import Path
-from typing import Iterator, Protocol
+from collections import Counter, deque
+from typing import Iterable, Iterator, NoReturn, Protocol, Sequence, TypeVar
 
 from django.core.management import BaseCommand
 from django.core.management.base import CommandParser
 
-from config.services import ConfigWriteService
+from config.services import ConfigWriteService, DataVersionService
 from householdentities.services import EntityService
-from transactions.services import TransactionReadService, TransactionWriteService
+from transactions.services import TransactionImportContext, TransactionReadService, TransactionWriteService
+from importing.services import FileFingerprint, ImportManifestService, ImportProgress, ImportSession
+from importing.sources import SourcePath, open_source_dir
+from importing.stats import RunStats
 from importing.parsers import (
     AccountFileParserStandard,
+    RowError,
     TransactionFilesParserStandard,
+    iter_parsed_files,
 )
 from importing.validators.importing import (
+    AccountReferenceError,
+    AccountTransactionValidator,
     ImportDirValidator,
-    AccountFileValidator,
     ImportTransactionDirValidator,
+    get_account_id_from_file_name,
 )
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+# Number of invalid rows listed in the message of InvalidImportData, all of them are logged
+N_ERRORS_REPORTED = 20
+
 
 class InvalidImportDirStructure(Exception):
     """Custom exception for invalid directory structure errors."""
 
 
+class InvalidImportData(Exception):
+    """Custom exception for invalid rows, or rows inconsistent with the accounts, found in the import data."""
+
+
 class IAccountParsed(Protocol):
     account_id: str
     name: str
@@ -45,6 +64,9 @@ class ITransactionParsed(Protocol):
 
 
 class Command(BaseCommand):
+    # Passed by the background import jobs, see importing.jobs
+    stealth_options = ("progress",)
+
     def add_arguments(self, parser: CommandParser) -> None:
         parser.add_argument(
             "--source-dir",
@@ -55,62 +77,324 @@ class Command(BaseCommand):
                 "<--source-dir>/\n"
                 "├── Accounts.csv\n"
                 "└── Transactions/\n"
-                "    ├── <Account-AccountID>_<YYYY>-<mm>-<dd>.csv\n"
+                "    ├── <InstitutionName>__<AccountID>__<YYYY>-<mm>.csv\n"
                 "    ├── ...\n"
-                "    └── <Account-AccountID>_<YYYY>-<mm>-<dd>.csv\n"
+                "    └── <InstitutionName>__<AccountID>__<YYYY>-<mm>.csv\n"
+            ),
+        )
+
+        parser.add_argument(
+            "--upsert",
+            action=argparse.BooleanOptionalAction,
+            default=True,
+            help="Write rows with INSERT ... ON CONFLICT DO UPDATE instead of separate bulk creates and updates.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows written per statement.",
+        )
+        parser.add_argument(
+            "--commit-every",
+            type=int,
+            default=None,
+            help=(
+                "Commit every N transaction rows instead of once at the end of the import. "
+                "By default the whole import is a single database transaction."
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes parsing the transaction files.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Import all files, including the files unchanged since they were last imported.",
+        )
+        parser.add_argument(
+            "--strict-date-start",
+            action="store_true",
+            help=(
+                "Fail the import on transactions dated before the start date of their account, "
+                "instead of only reporting them."
+            ),
+        )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help=(
+                "Print the wall time, rows, rows/s, database queries and peak RSS of each stage of the import. "
+                "They are recorded on the ImportAudit of the import either way."
             ),
         )
 
     def handle(self, **options) -> str | None:
-        source_dir = Path(options["source_dir"])
-        # Validate the input
-        self._validate(source_dir)
-        # Continue with the import process
-        logger.info("Directory structure and file formats are valid, proceed with import")
-        self._import(source_dir)
-
-    def _validate(self, source_dir: Path) -> None:
+        with open_source_dir(options["source_dir"]) as source_dir, RunStats() as stats:
+            # Validate the directory structure, the rows are validated as they are parsed
+            with stats.stage("validate") as stage:
+                trx_paths = self._validate(source_dir)
+                stage.n_rows = len(trx_paths) + 1
+            logger.info("Directory structure is valid, proceed with import")
+            with ImportSession(commit_every=options["commit_every"]) as session:
+                self._import(
+                    source_dir,
+                    trx_paths,
+                    batch_size=options["batch_size"],
+                    upsert=options["upsert"],
+                    force=options["force"],
+                    workers=options["workers"],
+                    strict_date_start=options["strict_date_start"],
+                    session=session,
+                    stats=stats,
+                    progress=options.get("progress") or ImportProgress(),
+                )
+        logger.info("Import committed [checkpoints: %s]", session.n_checkpoints)
+        if options["stats"]:
+            self.stdout.write(stats.format_table())
+
+    def _validate(self, source_dir: SourcePath) -> list[SourcePath]:
+        """Validate the directory structure, and return the transaction files listed while doing so."""
         dir_validator = ImportDirValidator(source_dir)
         err_msg = dir_validator.is_valid()
         if err_msg:
             raise InvalidImportDirStructure(err_msg)
 
-        acc_file_validator = AccountFileValidator(source_dir)
-        err_msg = acc_file_validator.is_valid()
-        if err_msg:
-            raise InvalidImportDirStructure(err_msg)
-
-        # TODO @imranariffin: Add AccountTransactionValidator that validates:
-        # 1. Each transaction file name matches the expected pattern
-        # 2. Each transaction file's account natural ID exists in Accounts.csv
-        # 3. Each transaction date is not before the account's start date
-
+        # The transactions are validated against the accounts by AccountTransactionValidator, as they are imported
         trx_dir_validator = ImportTransactionDirValidator(source_dir)
         err_msg = trx_dir_validator.is_valid()
         if err_msg:
             raise InvalidImportDirStructure(err_msg)
+        return trx_dir_validator.files
 
-    def _import(self, source_dir: Path) -> None:
-        acc_parser = AccountFileParserStandard(source_dir / "Accounts.csv")
-        accounts: Iterator[IAccountParsed] = acc_parser.iter_parsed()
+    def _import(
+        self,
+        source_dir: SourcePath,
+        trx_paths: list[SourcePath],
+        batch_size: int,
+        upsert: bool,
+        force: bool,
+        workers: int,
+        session: ImportSession,
+        stats: RunStats,
+        progress: ImportProgress,
+        strict_date_start: bool = False,
+    ) -> None:
         entity_service = EntityService()
-        created, updated = entity_service.bulk_create_or_update_accounts(accounts)
-        logger.info("Imported accounts [created: %s, updated: %s]", created, updated)
+        data_version_service = DataVersionService()
+        manifest_service = ImportManifestService()
+
+        acc_path = (source_dir / "Accounts.csv").resolve()
+        # The files touched but unchanged are recorded with their new modification time, and not imported
+        files_touched: list[tuple[FileFingerprint, int]] = []
+        with stats.stage("manifest") as stage:
+            files_changed = manifest_service.get_files_changed(
+                [acc_path, *trx_paths], force=force, files_touched=files_touched
+            )
+            stage.n_rows = len(trx_paths) + 1
+        logger.info(
+            "Files new or changed since the last import [changed: %s, unchanged: %s]",
+            *(len(files_changed), len(trx_paths) + 1 - len(files_changed)),
+        )
+        progress.n_files_total = len(files_changed)
+        n_rows_by_path: Counter[SourcePath] = Counter()
+        n_written = 0
+        # Invalid rows of all the files, all the files are read before failing on them
+        errors: list[RowError] = []
+
+        if acc_path in {file_changed.path for file_changed in files_changed}:
+            acc_parser = AccountFileParserStandard(acc_path, errors=errors)
+            accounts: list[IAccountParsed] | None = list(
+                stats.iter_stage(
+                    "parse_accounts",
+                    _iter_counted(acc_parser.iter_parsed(), n_rows_by_path, acc_path, progress),
+                )
+            )
+            date_start_by_account = {account.account_id: account.date_start for account in accounts}
+        else:
+            # Accounts.csv is unchanged since the last import, the accounts imported from it are checked against
+            accounts = None
+            date_start_by_account = entity_service.get_account_date_start_map()
+        trx_validator = AccountTransactionValidator(date_start_by_account)
+        trx_paths_changed = [
+            file_changed.path for file_changed in files_changed if file_changed.path != acc_path
+        ]
 
-        trx_parser = TransactionFilesParserStandard(source_dir / "Transactions")
-        transactions: Iterator[ITransactionParsed] = trx_parser.iter_parsed()
+        # Without --commit-every, the import is a single transaction: the rows are validated as they are
+        # written, and the session rolls back on the invalid ones. With it, the rows committed before an
+        # invalid one would stay, so every row is parsed, validated and checked against the accounts before
+        # any write
+        validate_first = session.commit_every is not None
+        if validate_first:
+            rows_by_file = iter_parsed_files(
+                [(TransactionFilesParserStandard, trx_path) for trx_path in trx_paths_changed],
+                workers=workers,
+                errors=errors,
+            )
+            deque(
+                stats.iter_stage(
+                    "validate_transactions",
+                    itertools.chain.from_iterable(
+                        trx_validator.iter_indexed(rows, trx_path)
+                        for trx_path, rows in zip(trx_paths_changed, rows_by_file)
+                    ),
+                ),
+                maxlen=0,
+            )
+            _raise_row_errors("invalid rows", errors)
+            _raise_reference_errors(trx_validator, strict_date_start, stats)
+            accounts_imported: Iterable[str] = trx_validator.date_min_by_account
+        else:
+            accounts_imported = {
+                get_account_id_from_file_name(trx_path.name) for trx_path in trx_paths_changed
+            }
+
+        if accounts is not None and not errors:
+            with stats.stage("write") as stage:
+                created, updated = entity_service.bulk_create_or_update_accounts(
+                    iter(accounts), batch_size=batch_size, upsert=upsert
+                )
+                stage.n_rows += len(accounts)
+            logger.info("Imported accounts [created: %s, updated: %s]", created, updated)
+            n_written += created + updated
+
+        # Read to be written, a second time with --commit-every: the files are expected unchanged since then
+        rows_by_file = iter_parsed_files(
+            [(TransactionFilesParserStandard, trx_path) for trx_path in trx_paths_changed],
+            workers=workers,
+            errors=errors,
+        )
+        transactions: Iterator[ITransactionParsed] = session.iter_checkpointed(
+            _iter_until_error(
+                stats.iter_stage(
+                    "parse_transactions",
+                    itertools.chain.from_iterable(
+                        (
+                            _iter_counted(rows, n_rows_by_path, trx_path, progress)
+                            if validate_first
+                            else trx_validator.iter_indexed(
+                                _iter_counted(rows, n_rows_by_path, trx_path, progress), trx_path
+                            )
+                        )
+                        for trx_path, rows in zip(trx_paths_changed, rows_by_file)
+                    ),
+                ),
+                errors,
+            )
+        )
         trx_service = TransactionWriteService(entity_service=entity_service)
-        created, updated = trx_service.bulk_create_or_update_transactions(transactions)
-        logger.info("Imported transactions [created: %s, updated: %s]", created, updated)
+        # Only the transaction IDs of the accounts in the files are loaded
+        trx_context = TransactionImportContext.load(entity_service, accounts=accounts_imported)
+
+        def refresh_committed() -> None:
+            # The transactions committed by a checkpoint get their balances, and the charts see them, even if the
+            # import fails after it: re-importing them would skip them as unchanged
+            if trx_service.refresh_balances(trx_context):
+                data_version = data_version_service.bump_data_version()
+                logger.info("Bumped data version at checkpoint [version: %s]", data_version)
 
-        config_service = ConfigWriteService(
-            entity_service=entity_service,
-            transaction_service=TransactionReadService(),
+        session.on_checkpoint(refresh_committed)
+        session.on_checkpoint(progress.checkpoint)
+        # The parsing of the transactions, consumed by the writes, is timed as its own stage
+        with stats.stage("write") as stage:
+            created, updated, unchanged = trx_service.bulk_create_or_update_transactions(
+                transactions,
+                batch_size=batch_size,
+                upsert=upsert,
+                context=trx_context,
+            )
+            stage.n_rows += created + updated + unchanged
+        logger.info(
+            "Imported transactions [created: %s, updated: %s, unchanged: %s]", created, updated, unchanged
         )
-        date_fr, date_to = config_service.get_earliest_latest_date()
-        if date_fr and date_to:
-            created = config_service.update_or_create_latest_config(date_fr=date_fr, date_to=date_to)
-            logger.info(
-                "%s config [date_fr=%s, date_to=%s]",
-                *("Created" if created else "Updated", date_fr, date_to),
+        n_written += created + updated
+        if validate_first:
+            _raise_row_errors("invalid rows in files changed since they were validated", errors)
+        else:
+            _raise_row_errors("invalid rows", errors)
+            _raise_reference_errors(trx_validator, strict_date_start, stats)
+
+        with stats.stage("update_config"):
+            if n_written:
+                data_version = data_version_service.bump_data_version()
+                logger.info("Bumped data version [version: %s]", data_version)
+
+            config_service = ConfigWriteService(
+                entity_service=entity_service,
+                transaction_service=TransactionReadService(),
+                data_version_service=data_version_service,
             )
+            date_fr, date_to = config_service.get_earliest_latest_date()
+            if date_fr and date_to:
+                created = config_service.update_or_create_latest_config(date_fr=date_fr, date_to=date_to)
+                logger.info(
+                    "%s config [date_fr=%s, date_to=%s]",
+                    *("Created" if created else "Updated", date_fr, date_to),
+                )
+
+        # Recorded last, with the stats of all the stages before
+        audit = manifest_service.create_import_audit(
+            source_dir,
+            [
+                *((file_changed, n_rows_by_path[file_changed.path]) for file_changed in files_changed),
+                *files_touched,
+            ],
+            stages=stats.stages.values(),
+        )
+        progress.audit_id = audit.id
+
+
+def _iter_counted(
+    rows: Iterator[T], n_rows_by_path: Counter[SourcePath], path: SourcePath, progress: ImportProgress
+) -> Iterator[T]:
+    for row in rows:
+        n_rows_by_path[path] += 1
+        progress.n_rows += 1
+        yield row
+    progress.n_files_done += 1
+
+
+def _raise_row_errors(description: str, errors: list[RowError]) -> None:
+    if errors:
+        for error in errors:
+            logger.error("Invalid row %s", error)
+        _raise_invalid_import_data(description, errors)
+
+
+def _raise_reference_errors(
+    trx_validator: AccountTransactionValidator, strict_date_start: bool, stats: RunStats
+) -> None:
+    # The accounts are only checked once all the rows are valid, an invalid account row would be reported again
+    # for each of its transactions
+    with stats.stage("validate"):
+        reference_errors = trx_validator.get_unknown_account_errors()
+        for error in trx_validator.get_before_start_errors():
+            if strict_date_start:
+                reference_errors.append(error)
+            else:
+                logger.warning("Transactions before the account start date %s", error)
+    if reference_errors:
+        for error in reference_errors:
+            logger.error("Transactions inconsistent with Accounts.csv %s", error)
+        _raise_invalid_import_data("transaction files inconsistent with Accounts.csv", reference_errors)
+
+
+def _raise_invalid_import_data(
+    description: str, errors: Sequence[RowError | AccountReferenceError]
+) -> NoReturn:
+    # Raised within the import session, which rolls back the rows written so far
+    raise InvalidImportData(
+        f"Found {len(errors)} {description}, aborting the import:\n"
+        + "\n".join(str(error) for error in errors[:N_ERRORS_REPORTED])
+        + (f"\n... and {len(errors) - N_ERRORS_REPORTED} more" if len(errors) > N_ERRORS_REPORTED else "")
+    )
+
+
+def _iter_until_error(rows: Iterator[T], errors: list[RowError]) -> Iterator[T]:
+    """Yield the rows until the first error, then only drain them, so that every error is still collected."""
+    for row in rows:
+        if not errors:
+            yield row
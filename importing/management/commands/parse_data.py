@@ -11,8 +11,10 @@ from django.core.management.base import BaseCommand
 import pydantic
 
 from householdentities.models import Account, Institution
-from importing.parsers import AccountCSVFileRowStandard, TransactionCSVRowStandard
-from importing.services import ParserService
+from importing.parsers import AccountRow, TransactionRow
+from importing.services import MAX_OPEN_FILES_DEFAULT, ParserService, PartitionedCSVWriter
+from importing.sources import SourcePath, open_source_dir
+from importing.stats import RunStats
 from importing.validators.parsing import ImportDirParserValidator
 
 logger = logging.getLogger(__name__)
@@ -52,88 +54,105 @@ class Command(BaseCommand):
             type=str,
             help="Path to the destination directory to copy parsed files to.",
         )
+        parser.add_argument(
+            "--max-open-files",
+            type=int,
+            default=MAX_OPEN_FILES_DEFAULT,
+            help="Maximum number of output files open at a time.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes parsing the transaction files, the output is the same for any number.",
+        )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="Print the wall time, rows, rows/s and peak RSS of each stage of the parsing.",
+        )
 
     def handle(self, *args, **options):
-        source_dir = Path(options["source_dir"])
-        logger.info("Validating import data directory: %s", source_dir)
-        self._validate(source_dir)
-
-        logger.info("Import data directory is valid, proceed with parsing")
-        dest_dir = Path(options["dest_dir"])
-        self._parse_and_save(source_dir, dest_dir)
-
-    def _validate(self, source_dir: Path) -> None:
+        stats = RunStats()
+        with open_source_dir(options["source_dir"]) as source_dir:
+            logger.info("Validating import data directory: %s", source_dir)
+            with stats.stage("validate"):
+                self._validate(source_dir)
+
+            logger.info("Import data directory is valid, proceed with parsing")
+            dest_dir = Path(options["dest_dir"])
+            self._parse_and_save(
+                source_dir,
+                dest_dir,
+                workers=options["workers"],
+                max_open_files=options["max_open_files"],
+                stats=stats,
+            )
+        if options["stats"]:
+            self.stdout.write(stats.format_table())
+
+    def _validate(self, source_dir: SourcePath) -> None:
         dir_validator = ImportDirParserValidator(source_dir)
         err_msg = dir_validator.is_valid()
         if err_msg:
             raise InvalidParseDirStructure(err_msg)
 
-    def _parse_and_save(self, source_dir: Path, dest_dir: Path) -> None:
+    def _parse_and_save(
+        self, source_dir: SourcePath, dest_dir: Path, workers: int, max_open_files: int, stats: RunStats
+    ) -> None:
         # TODO @imranariffin: Simplify this command, and move this parsing logic to a service class.
 
         parser_service = ParserService(source_dir)
         dest_dir.mkdir(parents=True, exist_ok=True)
 
-        trx_rows_map: dict[str, list[TransactionCSVRowStandard]] = defaultdict(list)
         account_ids_map: dict[str, set[str]] = defaultdict(set)
         acc_earliest_trx_date_map: dict[str, dt.date] = {}
-        acc_by_file_name_map: dict[str, str] = {}
-
-        for institution, account_id, parsed in parser_service.iter_parsed_transactions():
-            month: str = parsed.date.strftime("%Y-%m")
-            dest_file_name = f"{institution.value}__{account_id}__{month}.csv"
-            trx_rows_map[dest_file_name].append(parsed)
-            account_ids_map[institution].add(account_id)
-            acc_by_file_name_map[dest_file_name] = account_id
 
-        # Save parsed transactions to "Transactions/" folder:
+        # Save parsed transactions to "Transactions/" folder, as they are parsed:
 
         dest_dir_trx = dest_dir / "Transactions"
         dest_dir_trx.mkdir(exist_ok=True)
 
-        for dest_file_name, rows in trx_rows_map.items():
-            dest_file = dest_dir_trx / dest_file_name
-
-            # columns: list[str] = rows[0].columns
-            columns: list[str] = parser_service.to_standard_csv_columns(rows[0])
-            with dest_file.open("w", encoding="utf-8") as fo:
-                fo.write(",".join(columns) + "\n")
-                for row in rows:
-                    # values = []
-                    # for col in columns:
-                    #     value = str(getattr(row, col))
-                    #     if "," in value or '"' in value:
-                    #         value = '"' + value.replace("\"", "\"\"") + '"'
-                    #     values.append(value)
-
-                    # fo.write(",".join(values) + "\n")
-                    line_csv = parser_service.to_standard_csv(row)
-                    fo.write(line_csv + "\n")
-
-                    account_id = acc_by_file_name_map[dest_file_name]
-                    if (
-                        account_id not in acc_earliest_trx_date_map
-                        or row.date < acc_earliest_trx_date_map[account_id]
-                    ):
-                        acc_earliest_trx_date_map[account_id] = row.date
-
-            logger.info("Saved %s parsed transactions to file: %s", len(rows), dest_file)
+        # The parsing of the transactions, consumed by the writes, is timed as its own stage
+        with (
+            stats.stage("write_transactions") as stage,
+            PartitionedCSVWriter(
+                dest_dir_trx, header=",".join(TransactionRow.columns()), max_open_files=max_open_files
+            ) as writer,
+        ):
+            for institution, account_id, parsed in stats.iter_stage(
+                "parse_transactions", parser_service.iter_parsed_transactions(workers=workers)
+            ):
+                stage.n_rows += 1
+                month: str = parsed.date.strftime("%Y-%m")
+                dest_file_name = f"{institution.value}__{account_id}__{month}.csv"
+                writer.write(dest_file_name, parser_service.to_standard_csv(parsed))
+
+                account_ids_map[institution].add(account_id)
+                if (
+                    account_id not in acc_earliest_trx_date_map
+                    or parsed.date < acc_earliest_trx_date_map[account_id]
+                ):
+                    acc_earliest_trx_date_map[account_id] = parsed.date
+
+        for dest_file_name, n_rows in writer.n_lines_by_file_name.items():
+            logger.info("Saved %s parsed transactions to file: %s", n_rows, dest_dir_trx / dest_file_name)
 
         # Save parsed accounts to "Accounts.csv" file:
 
         dest_file_accounts = dest_dir / "Accounts.csv"
 
         # If available from source directory, collect accounts from there first
-        account_data_map: dict[str, dict[str, AccountCSVFileRowStandard]] = defaultdict(dict)
-        for parsed in parser_service.iter_parsed_accounts():
+        account_data_map: dict[str, dict[str, AccountRow]] = defaultdict(dict)
+        for parsed in stats.iter_stage("parse_accounts", parser_service.iter_parsed_accounts()):
             account_data_map[parsed.institution][parsed.account_id] = parsed
 
-        with dest_file_accounts.open("w", encoding="utf-8") as fo:
+        with stats.stage("write_accounts") as stage, dest_file_accounts.open("w", encoding="utf-8") as fo:
             fo.write("AccountID,Name,Institution,AmountInitial,DateStart\n")
             for institution, acc_ids in account_ids_map.items():
                 account_data_map_ = account_data_map.get(institution, {})
                 for acc_id in sorted(acc_ids):
-                    earliest_trx_date = acc_earliest_trx_date_map[account_id]
+                    earliest_trx_date = acc_earliest_trx_date_map[acc_id]
                     account_info = account_data_map_.get(acc_id)
                     account_name = account_info.name if account_info and account_info.name else '""'
                     amount_initial = (
@@ -145,7 +164,8 @@ class Command(BaseCommand):
                         f"{acc_id},{account_name},{institution},{amount_initial},{earliest_trx_date}\n"
                     )
                     fo.write(account_row)
-            logger.info("Saved %s parsed accounts to file: %s", len(account_ids_map), dest_file_accounts)
+                    stage.n_rows += 1
+            logger.info("Saved %s parsed accounts to file: %s", stage.n_rows, dest_file_accounts)
 
         # TODO @imranariffin: Extract AmountInitial from files if "Current Balance" is included
         #   Else, default to a special string .e.g "N/A"
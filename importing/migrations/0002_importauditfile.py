@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("importing", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="importaudit",
+            name="user",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.CreateModel(
+            name="ImportAuditFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "path",
+                    models.CharField(db_index=True, help_text="Absolute path of the file.", max_length=1024),
+                ),
+                ("size", models.PositiveBigIntegerField()),
+                (
+                    "mtime_ns",
+                    models.BigIntegerField(help_text="Modification time in nanoseconds since epoch."),
+                ),
+                ("sha256", models.CharField(max_length=64)),
+                ("n_rows", models.PositiveIntegerField(help_text="Number of rows parsed from the file.")),
+                (
+                    "audit",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="files",
+                        to="importing.importaudit",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("importing", "0002_importauditfile"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportAuditStage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("name", models.CharField(max_length=64)),
+                (
+                    "seconds",
+                    models.FloatField(help_text="Wall time, excluding the time of the nested stages."),
+                ),
+                ("n_rows", models.PositiveBigIntegerField()),
+                ("n_queries", models.PositiveIntegerField()),
+                (
+                    "peak_rss_kb",
+                    models.PositiveBigIntegerField(
+                        help_text="Peak resident set size of the import process at the end of the stage, in KiB."
+                    ),
+                ),
+                (
+                    "audit",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stages",
+                        to="importing.importaudit",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("importing", "0004_importjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportLock",
+            fields=[
+                ("name", models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ("acquired_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "job",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE, to="importing.importjob"
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("importing", "0005_importlock"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="hostname",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="pid",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,102 @@
+import enum
+
 from django.db import models
 from django.contrib.auth.models import User
 
 
 class ImportAudit(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Imports run from the command line have no user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     source_dir = models.CharField(max_length=255)
+
+    def __str__(self):
+        return f"{self.__class__.__name__} ({self.source_dir}@{self.timestamp})"
+
+
+class ImportAuditFile(models.Model):
+    """Fingerprint of a file imported by an import, unchanged files are skipped by the next imports."""
+
+    audit = models.ForeignKey(
+        ImportAudit,
+        on_delete=models.CASCADE,
+        related_name="files",
+        null=False,
+        blank=False,
+    )
+    path = models.CharField(max_length=1024, db_index=True, help_text="Absolute path of the file.")
+    size = models.PositiveBigIntegerField(null=False)
+    mtime_ns = models.BigIntegerField(null=False, help_text="Modification time in nanoseconds since epoch.")
+    sha256 = models.CharField(max_length=64, null=False)
+    n_rows = models.PositiveIntegerField(null=False, help_text="Number of rows parsed from the file.")
+
+    def __str__(self):
+        return f"{self.__class__.__name__} ({self.path}: {self.sha256[:12]})"
+
+
+class ImportAuditStage(models.Model):
+    """Wall time, rows, database queries and peak RSS of a stage of an import."""
+
+    audit = models.ForeignKey(
+        ImportAudit,
+        on_delete=models.CASCADE,
+        related_name="stages",
+        null=False,
+        blank=False,
+    )
+    name = models.CharField(max_length=64)
+    seconds = models.FloatField(null=False, help_text="Wall time, excluding the time of the nested stages.")
+    n_rows = models.PositiveBigIntegerField(null=False)
+    n_queries = models.PositiveIntegerField(null=False)
+    peak_rss_kb = models.PositiveBigIntegerField(
+        null=False, help_text="Peak resident set size of the import process at the end of the stage, in KiB."
+    )
+
+    def __str__(self):
+        return f"{self.__class__.__name__} ({self.name}: {self.seconds:.3f}s)"
+
+
+class ImportJobStatus(enum.StrEnum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class ImportJob(models.Model):
+    """An import of an uploaded archive, queued from the web and run in the background."""
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(
+        max_length=16,
+        choices=[(x.value, x.name) for x in ImportJobStatus],
+        default=ImportJobStatus.queued.value,
+        db_index=True,
+    )
+    source_path = models.CharField(max_length=1024, help_text="Path of the uploaded archive.")
+    audit = models.ForeignKey(ImportAudit, on_delete=models.SET_NULL, null=True, blank=True)
+    # Progress as of the end of the job, the progress of a running job is held by its worker
+    n_files_total = models.PositiveIntegerField(default=0)
+    n_files_done = models.PositiveIntegerField(default=0)
+    n_rows = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    # The process that runs the job, a job is only failed as interrupted once this process is gone
+    hostname = models.CharField(max_length=255, blank=True, default="")
+    pid = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.__class__.__name__} ({self.id}: {self.status})"
+
+
+class ImportLock(models.Model):
+    """Held by the import job that runs, for the imports to write one at a time, whichever process runs them."""
+
+    name = models.CharField(max_length=64, primary_key=True)
+    job = models.OneToOneField(ImportJob, on_delete=models.CASCADE)
+    acquired_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.__class__.__name__} ({self.name}: job {self.job_id})"
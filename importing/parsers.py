@@ -2,13 +2,17 @@ from ast import parse
 import csv
 import datetime as dt
 import decimal
+import functools
 import hashlib
 import logging
-from pathlib import Path
-from typing import Annotated, Generic, Iterator, TypeVar
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Annotated, Any, Generic, Iterator, NamedTuple, Sequence, TypeVar
 
-from pydantic import BaseModel, Field
-import smart_open
+from pydantic import BaseModel, Field, ValidationError
+
+from importing.sources import SourcePath, iter_csv_files, open_text
 
 
 logger = logging.getLogger(__name__)
@@ -18,6 +22,28 @@ class ParsingErrorRow(Exception):
     """Custom exception for errors during parsing of a row."""
 
 
+@dataclass
+class RowError:
+    """An invalid row, collected instead of raised when parsing with `errors`."""
+
+    path: str
+    row_num: int
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.path} [row {self.row_num}]: {self.message}"
+
+
+def _format_error(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        # One line per invalid field instead of pydantic's multi-line report
+        return "; ".join(
+            f"{'.'.join(str(loc) for loc in e['loc'])}: {e['msg']} (input: {e.get('input')!r})"
+            for e in error.errors()
+        )
+    return f"{error.__class__.__name__}: {error}"
+
+
 class RowInBase(BaseModel):
     @classmethod
     def columns(cls) -> list[str]:
@@ -32,55 +58,136 @@ class RowInBase(BaseModel):
 
 T = TypeVar("T", bound=RowInBase)
 V = TypeVar("V", bound=BaseModel)
+R = TypeVar("R", bound=tuple)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date_iso(value: str) -> dt.date:
+    """Parse a `YYYY-MM-DD` date, memoized as the same few dates repeat over the rows of a file."""
+    if len(value) != 10 or value[4] != "-" or value[7] != "-":
+        raise ValueError(f"Invalid date: {value}")
+    return dt.date.fromisoformat(value)
+
+
+def parse_decimal(value: str) -> decimal.Decimal:
+    """Parse a finite decimal."""
+    amount = decimal.Decimal(value)
+    if not amount.is_finite():
+        raise ValueError(f"Invalid decimal: {value}")
+    return amount
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_account_id_from_path(file_path: SourcePath) -> str:
+    return file_path.parent.name.split("__")[1]
 
 
-class FileParserCSVBase(Generic[T, V]):
+def _get_transaction_id(transaction_id_raw: str, date: str, row_num: int) -> str:
+    trx_id_ = transaction_id_raw.strip().replace(" ", "")
+    trx_id_hash = hashlib.md5(f"{trx_id_}-{date}-{row_num}".encode()).hexdigest()[:10]
+    return f"{trx_id_}-{trx_id_hash}"
+
+
+class FileParserCSVBase(Generic[T, V, R]):
+    """
+    Parse the rows of CSV files into `Row` tuples.
+
+    Rows are first parsed by `parse_values`, a fast path without pydantic. Rows it fails on fall back to
+    validating `RowIn`, then `parse_row`, which either parses the row or raises a descriptive validation error.
+
+    Given an `errors` list, invalid rows are appended to it and skipped instead, so that a single pass both
+    parses the valid rows and reports every invalid one.
+    """
+
     RowIn: type[T]
     RowOut: type[V]
+    Row: type[R]
+    # Whether the files must start with a header naming all the columns of RowIn
+    header_required: bool = False
 
-    def __init__(self, path: Path) -> None:
+    def __init__(self, path: SourcePath, errors: list[RowError] | None = None) -> None:
         self.path = path
+        self.errors = errors
 
-    def parse_row(self, row_in: T, file_path: Path, row_num: int) -> V:
+    def parse_row(self, row_in: T, file_path: SourcePath, row_num: int) -> V:
         """Parse a single row from RowIn to RowOut."""
         raise NotImplementedError("Subclasses must implement parse_row method.")
 
-    def iter_parsed(self) -> Iterator[V]:
+    def parse_values(self, values: list[str | None], file_path: SourcePath, row_num: int) -> R:
+        """
+        Parse a single row from its stripped values, in the order of `RowIn.columns()`, to a Row.
+
+        Raise any exception on unexpected values, the row is then parsed by `parse_row` instead.
+        """
+        raise NotImplementedError
+
+    def iter_parsed(self) -> Iterator[R]:
         if self.path.is_file():
             yield from self.iter_parsed_file(self.path)
         else:
-            for file_path in self.path.glob("*.csv"):
+            for file_path in iter_csv_files(self.path):
                 yield from self.iter_parsed_file(file_path)
 
-    def iter_parsed_file(self, file_path: Path) -> Iterator[V]:
+    def iter_parsed_file(self, file_path: SourcePath) -> Iterator[R]:
         logger.debug("Parsing file: %s", file_path)
-        with smart_open.open(file_path, "r") as file:
-            reader = csv.DictReader(file, fieldnames=self.RowIn.columns())
-            row: dict[str, str]
-            for i, row_ in enumerate(reader):
+        columns = self.RowIn.columns()
+        with open_text(file_path) as file:
+            positions: list[int] | None = None
+            # Blank lines are skipped and not numbered
+            for i, values in enumerate(filter(None, csv.reader(file))):
                 # Strip whitespace from all values in the row
-                try:
-                    row = {k: v.strip() if isinstance(v, str) else v for k, v in row_.items()}
-                except Exception as e:
-                    raise
-
-                # Skip header row if present
-                curr_values = set(row.values())
-                columns_expected = set(self.RowIn.columns())
-                if len(curr_values & columns_expected) == len(columns_expected):
+                values = [value.strip() for value in values]
+
+                # Skip header row if present, the columns are then read in its order
+                if i == 0 and set(columns) <= set(values):
                     logger.debug("[%s] First row is a header, skipping it", self.path)
+                    positions = [values.index(column) for column in columns]
+                    if positions == list(range(len(columns))):
+                        positions = None
                     continue
-
-                # Inject useful metadata into each row
-                row["row_num"] = str(i)
-                row["path"] = str(file_path)
+                if i == 0 and self.header_required:
+                    columns_missing = [column for column in columns if column not in values]
+                    self._on_error(
+                        ParsingErrorRow(f"Missing required columns: {columns_missing}"), file_path, i
+                    )
+                    return
+                if positions:
+                    # Missing values are left to the validation of the fallback
+                    values = [values[position] if position < len(values) else None for position in positions]
 
                 try:
-                    row_parsed = self.parse_row(self.RowIn.model_validate(row), file_path, i)
-                    yield row_parsed
-                except Exception as e:
-                    logger.error("Error parsing row %s in file %s [error: %s, row: %s]", i, file_path, e, row)
-                    raise e
+                    row = self.parse_values(values, file_path, i)
+                except Exception:
+                    try:
+                        row = self._parse_values_validated(values, file_path, i)
+                    except Exception as e:
+                        self._on_error(e, file_path, i)
+                        continue
+                yield row
+
+    def _on_error(self, error: Exception, file_path: SourcePath, row_num: int) -> None:
+        if self.errors is None:
+            logger.error("Error parsing row %s in file %s [error: %s]", row_num, file_path, error)
+            raise error
+        self.errors.append(RowError(path=str(file_path), row_num=row_num, message=_format_error(error)))
+
+    def _parse_values_validated(self, values: list[str | None], file_path: SourcePath, row_num: int) -> R:
+        columns = self.RowIn.columns()
+        row: dict[str, str | None] = {
+            column: values[j] if j < len(values) else None for j, column in enumerate(columns)
+        }
+        # Inject useful metadata into each row
+        row["row_num"] = str(row_num)
+        row["path"] = str(file_path)
+
+        row_out = self.parse_row(self.RowIn.model_validate(row), file_path, row_num)
+        return self.Row(**row_out.model_dump())
+
+
+def _get_serialization_aliases(model: type[BaseModel]) -> list[str]:
+    aliases = [field.serialization_alias or field.alias for field in model.model_fields.values()]
+    assert all(aliases), f"All fields must have aliases [model: {model.__name__}]"
+    return [str(alias) for alias in aliases]
 
 
 class AccountCSVFileRowStandard(BaseModel):
@@ -91,6 +198,20 @@ class AccountCSVFileRowStandard(BaseModel):
     date_start: Annotated[dt.date, Field(serialization_alias="DateStart")]
 
 
+class AccountRow(NamedTuple):
+    """Parsed account, with the fields of `AccountCSVFileRowStandard`."""
+
+    account_id: str
+    name: str
+    institution: str
+    amount_initial: decimal.Decimal
+    date_start: dt.date
+
+    @classmethod
+    def columns(cls) -> list[str]:
+        return _get_serialization_aliases(AccountCSVFileRowStandard)
+
+
 class AccountCSVFileRowInStandard(RowInBase):
     account_id: Annotated[str, Field(validation_alias="AccountID")]
     name: Annotated[str, Field(validation_alias="Name")]
@@ -99,12 +220,22 @@ class AccountCSVFileRowInStandard(RowInBase):
     date_start: Annotated[str, Field(validation_alias="DateStart")]
 
 
-class AccountFileParserStandard(FileParserCSVBase[AccountCSVFileRowInStandard, AccountCSVFileRowStandard]):
+class AccountFileParserStandard(
+    FileParserCSVBase[AccountCSVFileRowInStandard, AccountCSVFileRowStandard, AccountRow]
+):
     RowIn = AccountCSVFileRowInStandard
     RowOut = AccountCSVFileRowStandard
+    Row = AccountRow
+    header_required = True
+
+    def parse_values(self, values: list[str], file_path: SourcePath, row_num: int) -> AccountRow:
+        account_id, name, institution, amount_initial, date_start = values[:5]
+        return AccountRow(
+            account_id, name, institution, parse_decimal(amount_initial), parse_date_iso(date_start)
+        )
 
     def parse_row(
-        self, row_in: AccountCSVFileRowInStandard, file_path: Path, row_num: int
+        self, row_in: AccountCSVFileRowInStandard, file_path: SourcePath, row_num: int
     ) -> AccountCSVFileRowStandard:
         row_out = AccountCSVFileRowStandard(**row_in.model_dump())
         return AccountCSVFileRowStandard.model_validate(row_out)
@@ -118,6 +249,20 @@ class TransactionCSVRowStandard(BaseModel):
     amount: Annotated[decimal.Decimal, Field(serialization_alias="Amount")]
 
 
+class TransactionRow(NamedTuple):
+    """Parsed transaction, with the fields of `TransactionCSVRowStandard`."""
+
+    date: dt.date
+    account_id: str
+    transaction_id: str
+    transaction_id_raw: str
+    amount: decimal.Decimal
+
+    @classmethod
+    def columns(cls) -> list[str]:
+        return _get_serialization_aliases(TransactionCSVRowStandard)
+
+
 class TransactionCSVRowInTDCanada(RowInBase):
     Date: str
     TransactionID: str
@@ -127,28 +272,38 @@ class TransactionCSVRowInTDCanada(RowInBase):
     Balance: str
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_date_td_canada(value: str) -> dt.date:
+    try:
+        return dt.datetime.strptime(value, "%m/%d/%Y").date()
+    except ValueError:
+        return dt.datetime.strptime(value, "%Y-%m-%d").date()
+
+
 class TransactionCSVFileParserTDCanada(
-    FileParserCSVBase[TransactionCSVRowInTDCanada, TransactionCSVRowStandard]
+    FileParserCSVBase[TransactionCSVRowInTDCanada, TransactionCSVRowStandard, TransactionRow]
 ):
     RowIn = TransactionCSVRowInTDCanada
     RowOut = TransactionCSVRowStandard
+    Row = TransactionRow
+
+    def parse_values(self, values: list[str], file_path: SourcePath, row_num: int) -> TransactionRow:
+        date, transaction_id_raw, amount_out, amount_in = values[:4]
+        return TransactionRow(
+            date=_parse_date_td_canada(date),
+            account_id=_get_account_id_from_path(file_path),
+            transaction_id=_get_transaction_id(transaction_id_raw, date, row_num),
+            transaction_id_raw=transaction_id_raw,
+            amount=parse_decimal(amount_in or "0") - parse_decimal(amount_out or "0"),
+        )
 
     def parse_row(
-        self, row_in: TransactionCSVRowInTDCanada, file_path: Path, row_num: int
+        self, row_in: TransactionCSVRowInTDCanada, file_path: SourcePath, row_num: int
     ) -> TransactionCSVRowStandard:
-        try:
-            trx_date = dt.datetime.strptime(row_in.Date, "%m/%d/%Y").date()
-        except ValueError:
-            trx_date = dt.datetime.strptime(row_in.Date, "%Y-%m-%d").date()
-
-        trx_id_ = row_in.TransactionID.strip().replace(" ", "")
-        trx_id_hash = hashlib.md5(f"{trx_id_}-{row_in.Date}-{row_num}".encode()).hexdigest()[:10]
-        trx_id = f"{trx_id_}-{trx_id_hash}"
-
         row_out = self.RowOut(
-            date=trx_date,
-            account_id=Path(file_path).parent.name.split("__")[1],
-            transaction_id=trx_id,
+            date=_parse_date_td_canada(row_in.Date),
+            account_id=_get_account_id_from_path(file_path),
+            transaction_id=_get_transaction_id(row_in.TransactionID, row_in.Date, row_num),
             transaction_id_raw=row_in.TransactionID,
             amount=decimal.Decimal(row_in.AmountIn or 0) - decimal.Decimal(row_in.AmountOut or 0),
         )
@@ -164,19 +319,37 @@ class TransactionCSVRowInKOHO(RowInBase):
     Notes: str
 
 
-class TransactionCSVFileParserKOHO(FileParserCSVBase[TransactionCSVRowInKOHO, TransactionCSVRowStandard]):
+@functools.lru_cache(maxsize=4096)
+def _parse_date_koho(value: str) -> dt.date:
+    # Split date and time, only keep date part
+    return dt.datetime.strptime(value.split(" ", maxsplit=1)[0], "%Y-%m-%d").date()
+
+
+class TransactionCSVFileParserKOHO(
+    FileParserCSVBase[TransactionCSVRowInKOHO, TransactionCSVRowStandard, TransactionRow]
+):
     RowIn = TransactionCSVRowInKOHO
     RowOut = TransactionCSVRowStandard
+    Row = TransactionRow
+
+    def parse_values(self, values: list[str], file_path: SourcePath, row_num: int) -> TransactionRow:
+        date, transaction_id_raw, amount_in, amount_out = values[:4]
+        amount_in = amount_in.replace(",", "")
+        amount_out = amount_out.replace(",", "")
+        if not (amount_in or amount_out):
+            raise ValueError("Either Withdrawal or Loads must be present")
+        return TransactionRow(
+            date=_parse_date_koho(date),
+            account_id=_get_account_id_from_path(file_path),
+            transaction_id=_get_transaction_id(transaction_id_raw, date, row_num),
+            transaction_id_raw=transaction_id_raw,
+            amount=parse_decimal(amount_in or "0") - parse_decimal(amount_out or "0"),
+        )
 
     def parse_row(
-        self, row_in: TransactionCSVRowInKOHO, file_path: Path, row_num: int
+        self, row_in: TransactionCSVRowInKOHO, file_path: SourcePath, row_num: int
     ) -> TransactionCSVRowStandard:
-        # Split date and time, only keep date part
-        trx_date = dt.datetime.strptime(row_in.Date.split(" ", maxsplit=1)[0], "%Y-%m-%d").date()
-
-        trx_id_ = row_in.Transaction.strip().replace(" ", "")
-        trx_id_hash = hashlib.md5(f"{trx_id_}-{row_in.Date}-{row_num}".encode()).hexdigest()[:10]
-        trx_id = f"{trx_id_}-{trx_id_hash}"
+        trx_date = _parse_date_koho(row_in.Date)
 
         amount_out_str = row_in.Withdrawal.strip().replace(",", "")
         amount_in_str = row_in.Loads.strip().replace(",", "")
@@ -195,8 +368,8 @@ class TransactionCSVFileParserKOHO(FileParserCSVBase[TransactionCSVRowInKOHO, Tr
 
         row_out = self.RowOut(
             date=trx_date,
-            account_id=Path(file_path).parent.name.split("__")[1],
-            transaction_id=trx_id,
+            account_id=_get_account_id_from_path(file_path),
+            transaction_id=_get_transaction_id(row_in.Transaction, row_in.Date, row_num),
             transaction_id_raw=row_in.Transaction,
             amount=amount,
         )
@@ -212,13 +385,66 @@ class TransactionCSVRowInStandard(RowInBase):
 
 
 class TransactionFilesParserStandard(
-    FileParserCSVBase[TransactionCSVRowInStandard, TransactionCSVRowStandard]
+    FileParserCSVBase[TransactionCSVRowInStandard, TransactionCSVRowStandard, TransactionRow]
 ):
     RowIn = TransactionCSVRowInStandard
     RowOut = TransactionCSVRowStandard
+    Row = TransactionRow
+
+    def parse_values(self, values: list[str], file_path: SourcePath, row_num: int) -> TransactionRow:
+        date, account_id, transaction_id, transaction_id_raw, amount = values[:5]
+        return TransactionRow(
+            parse_date_iso(date), account_id, transaction_id, transaction_id_raw, parse_decimal(amount)
+        )
 
     def parse_row(
-        self, row_in: TransactionCSVRowInStandard, file_path: Path, row_num: int
+        self, row_in: TransactionCSVRowInStandard, file_path: SourcePath, row_num: int
     ) -> TransactionCSVRowStandard:
         row_out = self.RowOut(**row_in.model_dump())
         return self.RowOut.model_validate(row_out)
+
+
+def parse_file(
+    parser_class: type[FileParserCSVBase[Any, Any, R]], file_path: SourcePath, collect_errors: bool = False
+) -> tuple[list[R], list[RowError]]:
+    """Parse a whole file, this is the function run by the worker processes of `iter_parsed_files`."""
+    errors: list[RowError] | None = [] if collect_errors else None
+    return list(parser_class(file_path, errors=errors).iter_parsed()), errors or []
+
+
+def iter_parsed_files(
+    files: Sequence[tuple[type[FileParserCSVBase[Any, Any, R]], SourcePath]],
+    workers: int = 1,
+    errors: list[RowError] | None = None,
+) -> Iterator[Iterator[R]]:
+    """
+    Yield the rows parsed from each of the files, in the order of the files.
+
+    With more than one worker the files are parsed in a process pool, with at most two files per worker parsed
+    ahead of the one being consumed. The files are yielded in the same order either way, so the output does not
+    depend on the number of workers.
+
+    :param errors: Collect the invalid rows here instead of raising on the first one.
+    """
+    if workers <= 1:
+        for parser_class, file_path in files:
+            yield parser_class(file_path, errors=errors).iter_parsed()
+        return
+
+    collect_errors = errors is not None
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        files_pending = iter(files)
+        futures: deque[Future[tuple[list[R], list[RowError]]]] = deque()
+        for parser_class, file_path in files_pending:
+            futures.append(executor.submit(parse_file, parser_class, file_path, collect_errors))
+            if len(futures) == 2 * workers:
+                break
+        while futures:
+            rows, file_errors = futures.popleft().result()
+            for parser_class, file_path in files_pending:
+                futures.append(executor.submit(parse_file, parser_class, file_path, collect_errors))
+                break
+            if errors is not None:
+                errors.extend(file_errors)
+            yield iter(rows)
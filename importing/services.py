@@ -1,30 +1,58 @@
 import decimal
 import enum
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterator
-from venv import logger
+from typing import IO, Callable, Iterable, Iterator, TypeVar
 
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from importing.models import ImportAudit, ImportAuditFile, ImportAuditStage
+from importing.sources import SourcePath, iter_csv_files, sorted_for_reading
+from importing.stats import StageStats
 from importing.parsers import (
-    AccountCSVFileRowStandard,
     AccountFileParserStandard,
+    AccountRow,
+    FileParserCSVBase,
     TransactionCSVFileParserKOHO,
     TransactionCSVFileParserTDCanada,
     TransactionFilesParserStandard,
-    TransactionCSVRowStandard,
+    TransactionRow,
+    iter_parsed_files,
 )
 
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Negative SQLite cache sizes are in KiB, -200000 is ~200 MB instead of the default ~2 MB
+SQLITE_CACHE_SIZE_IMPORT = -200_000
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+MAX_OPEN_FILES_DEFAULT = 128
+
 
 class InstitutionName(enum.StrEnum):
     koho = "KOHO"
     td_canada = "TDCanada"
 
 
+PARSER_CLASS_BY_INSTITUTION: dict[InstitutionName, type[FileParserCSVBase]] = {
+    InstitutionName.td_canada: TransactionCSVFileParserTDCanada,
+    InstitutionName.koho: TransactionCSVFileParserKOHO,
+}
+
+
 class ParserService:
-    def __init__(self, dir_path: Path):
+    def __init__(self, dir_path: SourcePath):
         self.dir_path = dir_path
 
-    def iter_parsed_transactions(self) -> Iterator[tuple[InstitutionName, str, TransactionCSVRowStandard]]:
-        for dir_path in self.dir_path.glob("*"):
+    def iter_transaction_files(self) -> Iterator[tuple[InstitutionName, str, SourcePath]]:
+        """Yield the institution, account natural key and path of each transaction file, in reading order."""
+        for dir_path in sorted_for_reading(self.dir_path.glob("*")):
             if not dir_path.is_dir():
                 logger.debug("Skipping non-directory path: %s", dir_path)
                 continue
@@ -37,21 +65,27 @@ class ParserService:
             institution: InstitutionName = InstitutionName(dir_name.split("__")[0])
             acc_natural_key: str = dir_name.split("__")[1]
 
-            match institution:
-                case InstitutionName.td_canada:
-                    parser_class = TransactionCSVFileParserTDCanada
-                case InstitutionName.koho:
-                    parser_class = TransactionCSVFileParserKOHO
-                case _:
-                    logger.warning("Skipping unsupported institution: %s", institution)
-                    continue
-
-            for trx_file in dir_path.glob("*.csv"):
-                parser = parser_class(trx_file)
-                for parsed in parser.iter_parsed():
-                    yield institution, acc_natural_key, parsed
-
-    def iter_parsed_accounts(self) -> Iterator[AccountCSVFileRowStandard]:
+            for trx_file in iter_csv_files(dir_path):
+                yield institution, acc_natural_key, trx_file
+
+    def iter_parsed_transactions(
+        self, workers: int = 1
+    ) -> Iterator[tuple[InstitutionName, str, TransactionRow]]:
+        """
+        Yield the parsed transactions of all transaction files, file by file.
+
+        :param workers: Number of processes parsing the files, the rows are yielded in the same order anyway.
+        """
+        trx_files = list(self.iter_transaction_files())
+        rows_by_file = iter_parsed_files(
+            [(PARSER_CLASS_BY_INSTITUTION[institution], trx_file) for institution, _, trx_file in trx_files],
+            workers=workers,
+        )
+        for (institution, acc_natural_key, _), rows in zip(trx_files, rows_by_file):
+            for parsed in rows:
+                yield institution, acc_natural_key, parsed
+
+    def iter_parsed_accounts(self) -> Iterator[AccountRow]:
         acc_file = self.dir_path / "Accounts.csv"
         if not acc_file.is_file():
             logger.debug("Accounts.csv file not found in directory: %s, skipping", self.dir_path)
@@ -61,23 +95,280 @@ class ParserService:
         for parsed in parser.iter_parsed():
             yield parsed
 
-    def to_standard_csv(
-        self,
-        row: TransactionCSVRowStandard | AccountCSVFileRowStandard,
-    ) -> str:
+    def to_standard_csv(self, row: TransactionRow | AccountRow) -> str:
         # TODO @imranariffin: Replace with .model_dump_csv()
-        return ",".join(f'"{str(v)}"' if "," in str(v) else str(v) for v in row.model_dump().values())
-
-    def to_standard_csv_columns(
-        self, row: TransactionCSVRowStandard | AccountCSVFileRowStandard
-    ) -> list[str]:
-        aliases = [
-            field.serialization_alias or field.alias
-            for field in row.__class__.model_fields.values()
-            if field.alias or field.serialization_alias
-        ]
-        assert len(aliases) == len(row.__class__.model_fields), (
-            "All fields must have aliases "
-            f"[fields: {[field for field in row.__class__.model_fields.values() if not (field.alias or field.serialization_alias)]}]"
+        return ",".join(f'"{str(v)}"' if "," in str(v) else str(v) for v in row)
+
+    def to_standard_csv_columns(self, row: TransactionRow | AccountRow) -> list[str]:
+        return row.columns()
+
+
+class PartitionedCSVWriter:
+    """
+    Write lines to one CSV file per partition, with at most `max_open_files` files open at a time.
+
+    When the limit is reached the least recently written file is closed, and reopened in append mode if its
+    partition gets more lines. The files are written in the order of their lines either way.
+    """
+
+    def __init__(self, dir_path: Path, header: str, max_open_files: int = MAX_OPEN_FILES_DEFAULT) -> None:
+        assert max_open_files > 0, "max_open_files must be positive"
+        self.dir_path = dir_path
+        self.header = header
+        self.max_open_files = max_open_files
+        self.n_lines_by_file_name: dict[str, int] = {}
+        self._files_open: OrderedDict[str, IO[str]] = OrderedDict()
+
+    def __enter__(self) -> "PartitionedCSVWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def write(self, file_name: str, line: str) -> None:
+        file = self._files_open.get(file_name)
+        if file is None:
+            file = self._open(file_name)
+        else:
+            self._files_open.move_to_end(file_name)
+        file.write(line + "\n")
+        self.n_lines_by_file_name[file_name] += 1
+
+    def close(self) -> None:
+        while self._files_open:
+            _, file = self._files_open.popitem(last=False)
+            file.close()
+
+    def _open(self, file_name: str) -> IO[str]:
+        if len(self._files_open) == self.max_open_files:
+            _, file_lru = self._files_open.popitem(last=False)
+            file_lru.close()
+
+        if file_name in self.n_lines_by_file_name:
+            file = (self.dir_path / file_name).open("a", encoding="utf-8")
+        else:
+            # Files left over from a previous run are overwritten
+            file = (self.dir_path / file_name).open("w", encoding="utf-8")
+            file.write(self.header + "\n")
+            self.n_lines_by_file_name[file_name] = 0
+        self._files_open[file_name] = file
+        return file
+
+
+class ImportSession:
+    """
+    Run an import in one database transaction, with SQLite tuned for bulk loading.
+
+    On SQLite the database switches to WAL, and the connection to `synchronous=NORMAL` and a larger page
+    cache for the duration of the session. The connection settings are restored on exit, WAL is kept: it is a
+    setting of the database file, leaving it needs exclusive access, which fails while the dashboard reads,
+    and WAL is what lets it read during imports. The pragmas cannot be changed inside a transaction, so they are
+    left untouched when the session is opened in an atomic block.
+
+    With `commit_every`, rows read through `iter_checkpointed` are committed every `commit_every` rows instead
+    of once at the end, so a failed import keeps the rows written before the last checkpoint. The callbacks
+    registered with `on_checkpoint` run in the transaction of each checkpoint, before it commits, e.g. to
+    refresh what is derived from the rows written so far.
+    """
+
+    def __init__(self, commit_every: int | None = None, using: str = DEFAULT_DB_ALIAS):
+        assert commit_every is None or commit_every > 0, "commit_every must be positive"
+        self.commit_every = commit_every
+        self.using = using
+        self.n_checkpoints = 0
+        self._checkpoint_callbacks: list[Callable[[], None]] = []
+        self._pragmas_previous: dict[str, str | int] = {}
+        self._transaction_mode_previous: str | None = None
+        self._atomic: transaction.Atomic | None = None
+
+    def __enter__(self) -> "ImportSession":
+        connection = connections[self.using]
+        if connection.vendor == "sqlite" and not connection.in_atomic_block:
+            self._pragmas_previous = {
+                pragma: self._get_pragma(pragma) for pragma in ("synchronous", "cache_size")
+            }
+            self._set_pragma("journal_mode", "WAL")
+            self._set_pragma("synchronous", "NORMAL")
+            self._set_pragma("cache_size", SQLITE_CACHE_SIZE_IMPORT)
+            # The transactions of the import take the write lock as they begin. A transaction that only read
+            # so far fails at once on its first write, without waiting, if another connection committed since
+            self._transaction_mode_previous = connection.transaction_mode
+            connection.transaction_mode = "IMMEDIATE"
+        self._atomic = transaction.atomic(using=self.using)
+        self._atomic.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        assert self._atomic is not None
+        try:
+            self._atomic.__exit__(exc_type, exc_value, traceback)
+        finally:
+            self._atomic = None
+            if self._pragmas_previous:
+                connections[self.using].transaction_mode = self._transaction_mode_previous
+            for pragma, value in self._pragmas_previous.items():
+                self._set_pragma(pragma, value)
+            self._pragmas_previous = {}
+
+    def on_checkpoint(self, callback: Callable[[], None]) -> None:
+        """Register a callback to run before each checkpoint commits."""
+        self._checkpoint_callbacks.append(callback)
+
+    def checkpoint(self) -> None:
+        """Commit the rows written so far and start a new transaction."""
+        assert self._atomic is not None, "checkpoint() called outside of the session"
+        for callback in self._checkpoint_callbacks:
+            callback()
+        self._atomic.__exit__(None, None, None)
+        self._atomic = transaction.atomic(using=self.using)
+        self._atomic.__enter__()
+        self.n_checkpoints += 1
+        logger.debug("Import checkpoint [n_checkpoints: %s]", self.n_checkpoints)
+
+    def iter_checkpointed(self, rows: Iterator[T]) -> Iterator[T]:
+        """
+        Yield the rows, with a checkpoint every `commit_every` rows.
+
+        The checkpoint runs when the consumer asks for the next row, i.e. between two of its batches.
+        """
+        for i, row in enumerate(rows):
+            if self.commit_every and i and i % self.commit_every == 0:
+                self.checkpoint()
+            yield row
+
+    def _get_pragma(self, pragma: str) -> str | int:
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f"PRAGMA {pragma}")
+            return cursor.fetchone()[0]
+
+    def _set_pragma(self, pragma: str, value: str | int) -> None:
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+@dataclass
+class ImportProgress:
+    """
+    Progress of a running import, updated by `import_data` and read by other threads.
+
+    `n_rows` counts the rows parsed and handed to the database writes, which write them in batches.
+    """
+
+    n_files_total: int = 0
+    n_files_done: int = 0
+    n_rows: int = 0
+    # The audit recorded by the import, at its end
+    audit_id: int | None = None
+
+    def checkpoint(self) -> None:
+        """Called in the transaction of each checkpoint of the import, to be committed with its rows."""
+
+
+@dataclass
+class FileFingerprint:
+    path: SourcePath
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+class ImportManifestService:
+    """Track the fingerprints of the imported files, so that the next imports only parse the changed files."""
+
+    def get_files_changed(
+        self,
+        paths: Iterable[SourcePath],
+        force: bool = False,
+        files_touched: list[tuple[FileFingerprint, int]] | None = None,
+    ) -> list[FileFingerprint]:
+        """
+        Return the fingerprints of the files that are new or changed since they were last imported.
+
+        A file is only hashed when its size or modification time differ from the last import, a file that was
+        touched but has the same content is still unchanged.
+
+        :param force: Return all files, regardless of the previous imports.
+        :param files_touched: Collects the new fingerprints of the files touched but unchanged, with their row
+            counts of the last import. Once recorded by an audit, the next imports do not hash them again.
+        """
+        paths = [path.resolve() for path in paths]
+        files_imported: dict[str, ImportAuditFile] = {}
+        if not force:
+            # Ordered by ID, the latest import of a path wins
+            for file_imported in ImportAuditFile.objects.filter(
+                path__in=[str(path) for path in paths]
+            ).order_by("id"):
+                files_imported[file_imported.path] = file_imported
+
+        files_changed: list[FileFingerprint] = []
+        for path in paths:
+            stat = path.stat()
+            file_imported = files_imported.get(str(path))
+            if file_imported and (file_imported.size, file_imported.mtime_ns) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                continue
+
+            sha256 = self._get_sha256(path)
+            if file_imported and (file_imported.size, file_imported.sha256) == (stat.st_size, sha256):
+                logger.debug("File touched but unchanged since the last import: %s", path)
+                if files_touched is not None:
+                    files_touched.append(
+                        (
+                            FileFingerprint(
+                                path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256
+                            ),
+                            file_imported.n_rows,
+                        )
+                    )
+                continue
+
+            files_changed.append(
+                FileFingerprint(path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256)
+            )
+
+        return files_changed
+
+    def create_import_audit(
+        self,
+        source_dir: SourcePath,
+        files_imported: Iterable[tuple[FileFingerprint, int]],
+        stages: Iterable[StageStats] = (),
+    ) -> ImportAudit:
+        """
+        Record an import of `source_dir` and the fingerprints and row counts of the files it imported.
+
+        :param stages: The stats of the stages of the import.
+        """
+        audit = ImportAudit.objects.create(source_dir=str(source_dir))
+        ImportAuditStage.objects.bulk_create(
+            ImportAuditStage(
+                audit=audit,
+                name=stage.name,
+                seconds=stage.seconds,
+                n_rows=stage.n_rows,
+                n_queries=stage.n_queries,
+                peak_rss_kb=stage.peak_rss_kb,
+            )
+            for stage in stages
+        )
+        ImportAuditFile.objects.bulk_create(
+            ImportAuditFile(
+                audit=audit,
+                path=str(fingerprint.path),
+                size=fingerprint.size,
+                mtime_ns=fingerprint.mtime_ns,
+                sha256=fingerprint.sha256,
+                n_rows=n_rows,
+            )
+            for fingerprint, n_rows in files_imported
         )
-        return aliases
+        return audit
+
+    def _get_sha256(self, path: SourcePath) -> str:
+        sha256 = hashlib.sha256()
+        with path.open("rb") as file:
+            while chunk := file.read(HASH_CHUNK_SIZE):
+                sha256.update(chunk)
+        return sha256.hexdigest()
@@ -0,0 +1,228 @@
+import contextlib
+import dataclasses
+import datetime as dt
+import fnmatch
+import gzip
+import io
+import os
+import posixpath
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import IO, Iterable, Iterator, NamedTuple
+
+import smart_open
+
+ARCHIVE_SUFFIXES = (".zip", ".tar.gz", ".tgz")
+CSV_SUFFIXES = (".csv", ".csv.gz")
+
+
+class MemberStat(NamedTuple):
+    st_size: int
+    st_mtime_ns: int
+
+
+class _ArchiveIndex:
+    """The listing of a zip or tar archive, and its members opened without extracting them to disk."""
+
+    def __init__(self, archive: Path) -> None:
+        self.archive = archive
+        self.files: dict[str, zipfile.ZipInfo | tarfile.TarInfo] = {}
+        self.dirs: set[str] = {""}
+        # Position of each member in the archive, of its first member for a directory
+        self.positions: dict[str, int] = {"": 0}
+        self._file: zipfile.ZipFile | tarfile.TarFile
+        if archive.name.endswith(".zip"):
+            self._file = zipfile.ZipFile(archive)
+            members = [(info.filename, info.is_dir(), info) for info in self._file.infolist()]
+        else:
+            self._file = tarfile.open(archive, "r:*")
+            members = [
+                (info.name, info.isdir(), info)
+                for info in self._file.getmembers()
+                if info.isreg() or info.isdir()
+            ]
+
+        for position, (name, is_dir, info) in enumerate(members):
+            name = posixpath.normpath(name).lstrip("/")
+            if name == ".":
+                continue
+            if is_dir:
+                self.dirs.add(name)
+            else:
+                self.files[name] = info
+            self.positions.setdefault(name, position)
+            # Zip archives do not always list the directories
+            while name := posixpath.dirname(name):
+                self.dirs.add(name)
+                self.positions.setdefault(name, position)
+
+    @property
+    def is_sequential(self) -> bool:
+        """Whether the members are only read efficiently in archive order, a gzip stream is not seekable."""
+        return isinstance(self._file, tarfile.TarFile)
+
+    def open(self, member: str) -> IO[bytes]:
+        info = self.files[member]
+        if isinstance(info, zipfile.ZipInfo):
+            assert isinstance(self._file, zipfile.ZipFile)
+            return self._file.open(info)
+        assert isinstance(self._file, tarfile.TarFile)
+        file = self._file.extractfile(info)
+        assert file is not None
+        return file
+
+    def stat(self, member: str) -> MemberStat:
+        info = self.files[member]
+        if isinstance(info, zipfile.ZipInfo):
+            mtime = dt.datetime(*info.date_time).timestamp()
+            return MemberStat(st_size=info.file_size, st_mtime_ns=int(mtime * 1e9))
+        return MemberStat(st_size=info.size, st_mtime_ns=int(info.mtime * 1e9))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# The archives opened by each process, until closed by `close_archive`
+_archive_indexes: dict[tuple[Path, int], _ArchiveIndex] = {}
+
+
+def _get_archive_index(archive: Path, pid: int) -> _ArchiveIndex:
+    # Keyed by process, a forked worker must not share the file offset of its parent's open archive
+    key = (archive, pid)
+    index = _archive_indexes.get(key)
+    if index is None:
+        index = _archive_indexes[key] = _ArchiveIndex(archive)
+    return index
+
+
+def close_archive(archive: Path) -> None:
+    """Close the archive, if opened by this process, it is opened again if read after."""
+    archive = archive.resolve()
+    pid = os.getpid()
+    for key in [key for key in _archive_indexes if key[1] == pid and key[0].resolve() == archive]:
+        _archive_indexes.pop(key).close()
+
+
+@dataclasses.dataclass(frozen=True, order=True)
+class ArchivePath:
+    """
+    A file or directory inside a zip or tar archive, with the subset of the `Path` API used by the importers.
+
+    Members are streamed from the archive, `.gz` members are decompressed on the fly when opened as text.
+    """
+
+    archive: Path
+    member: str = ""
+
+    @classmethod
+    def root(cls, archive: Path) -> "ArchivePath":
+        """Return the root of the archive, or its only top-level directory, e.g. for `zip -r export.zip export/`."""
+        root = cls(archive)
+        children = list(root.iterdir())
+        if len(children) == 1 and children[0].is_dir():
+            return children[0]
+        return root
+
+    @property
+    def name(self) -> str:
+        return posixpath.basename(self.member) if self.member else self.archive.name
+
+    @property
+    def parent(self) -> "ArchivePath":
+        return ArchivePath(self.archive, posixpath.dirname(self.member))
+
+    def __truediv__(self, name: str) -> "ArchivePath":
+        return ArchivePath(self.archive, posixpath.join(self.member, name) if self.member else name)
+
+    def __str__(self) -> str:
+        return str(self.archive / self.member) if self.member else str(self.archive)
+
+    @property
+    def _index(self) -> _ArchiveIndex:
+        return _get_archive_index(self.archive, os.getpid())
+
+    def exists(self) -> bool:
+        return self.is_file() or self.is_dir()
+
+    def is_file(self) -> bool:
+        return self.member in self._index.files
+
+    def is_dir(self) -> bool:
+        return self.member in self._index.dirs
+
+    def iterdir(self) -> Iterator["ArchivePath"]:
+        index = self._index
+        for name in sorted(index.files.keys() | index.dirs):
+            if name and posixpath.dirname(name) == self.member:
+                yield ArchivePath(self.archive, name)
+
+    def glob(self, pattern: str) -> Iterator["ArchivePath"]:
+        """Yield the children matching `pattern`, only patterns without a path separator are supported."""
+        assert "/" not in pattern, f"Unsupported pattern: {pattern}"
+        for child in self.iterdir():
+            if fnmatch.fnmatchcase(child.name, pattern):
+                yield child
+
+    @property
+    def read_order(self) -> tuple[int, str]:
+        """The sort key of the member in its archive: its position in a tar archive, otherwise its name."""
+        index = self._index
+        return (index.positions[self.member] if index.is_sequential else 0, self.member)
+
+    def resolve(self) -> "ArchivePath":
+        return ArchivePath(self.archive.resolve(), self.member)
+
+    def stat(self) -> MemberStat:
+        return self._index.stat(self.member)
+
+    def open(self, mode: str = "r") -> IO:
+        file = self._index.open(self.member)
+        if mode == "rb":
+            return file
+        assert mode == "r", f"Unsupported mode: {mode}"
+        if self.member.endswith(".gz"):
+            file = gzip.GzipFile(fileobj=file)
+        return io.TextIOWrapper(file, encoding="utf-8")
+
+
+SourcePath = Path | ArchivePath
+
+
+@contextlib.contextmanager
+def open_source_dir(source: str) -> Iterator[SourcePath]:
+    """Yield the source directory, or the root of the source archive if `source` is an archive, closed on exit."""
+    path = Path(source)
+    if not (path.name.endswith(ARCHIVE_SUFFIXES) and path.is_file()):
+        yield path
+        return
+    try:
+        yield ArchivePath.root(path)
+    finally:
+        close_archive(path)
+
+
+def sorted_for_reading(paths: Iterable[SourcePath]) -> list[SourcePath]:
+    """
+    Sort paths by name, or in archive order for the members of a tar archive.
+
+    A member of a `.tar.gz` before the last one read is only reached by decompressing the archive again from its
+    start.
+    """
+    return sorted(
+        paths, key=lambda path: path.read_order if isinstance(path, ArchivePath) else (0, str(path))
+    )
+
+
+def open_text(path: SourcePath) -> IO[str]:
+    """Open a source file as text, `.gz` files are decompressed on the fly."""
+    if isinstance(path, ArchivePath):
+        return path.open("r")
+    return smart_open.open(path, "r")
+
+
+def iter_csv_files(dir_path: SourcePath) -> Iterator[SourcePath]:
+    """Yield the CSV files of a directory, gzipped or not, sorted by name, or in archive order for a tar archive."""
+    yield from sorted_for_reading(
+        path for path in dir_path.glob("*.csv*") if path.name.endswith(CSV_SUFFIXES)
+    )
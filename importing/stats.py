@@ -0,0 +1,129 @@
+import contextlib
+import dataclasses
+import resource
+import sys
+import time
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+T = TypeVar("T")
+
+
+def get_peak_rss_kb() -> int:
+    """Return the peak resident set size of this process and its finished worker processes, in KiB."""
+    rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Reported in bytes on macOS, in KiB elsewhere
+    rss_kb = max(rss_self, rss_children)
+    return rss_kb // 1024 if sys.platform == "darwin" else rss_kb
+
+
+@dataclasses.dataclass
+class StageStats:
+    name: str
+    seconds: float = 0.0
+    n_rows: int = 0
+    n_queries: int = 0
+    peak_rss_kb: int = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.n_rows / self.seconds if self.seconds else 0.0
+
+
+class RunStats:
+    """
+    Wall time, rows, database queries and peak RSS of each stage of an import or parse run.
+
+    Stages nest: while a stage runs within another, e.g. the parsing of the rows consumed by the database writes,
+    the time and the queries are only counted to the inner stage. The queries are counted while the stats are
+    entered as a context manager.
+    """
+
+    def __init__(self, using: str = DEFAULT_DB_ALIAS) -> None:
+        self.using = using
+        self.stages: dict[str, StageStats] = {}
+        # Running stages, innermost last, with the time the innermost one was last resumed
+        self._running: list[StageStats] = []
+        self._time_resumed = 0.0
+        self._execute_wrapper: contextlib.AbstractContextManager | None = None
+
+    def __enter__(self) -> "RunStats":
+        self._execute_wrapper = connections[self.using].execute_wrapper(self._count_query)
+        self._execute_wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        assert self._execute_wrapper is not None
+        self._execute_wrapper.__exit__(*exc_info)
+        self._execute_wrapper = None
+
+    def _count_query(self, execute: Callable, sql: str, params: Any, many: bool, context: dict) -> Any:
+        if self._running:
+            self._running[-1].n_queries += 1
+        return execute(sql, params, many, context)
+
+    def _push(self, name: str) -> StageStats:
+        time_now = time.perf_counter()
+        if self._running:
+            self._running[-1].seconds += time_now - self._time_resumed
+        stage = self.stages.setdefault(name, StageStats(name))
+        self._running.append(stage)
+        self._time_resumed = time_now
+        return stage
+
+    def _pop(self) -> StageStats:
+        time_now = time.perf_counter()
+        stage = self._running.pop()
+        stage.seconds += time_now - self._time_resumed
+        self._time_resumed = time_now
+        return stage
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        """Time the block as the stage `name`, the rows it processed are added to the yielded stats by the caller."""
+        stage = self._push(name)
+        try:
+            yield stage
+        finally:
+            self._pop().peak_rss_kb = get_peak_rss_kb()
+
+    def iter_stage(self, name: str, rows: Iterable[T]) -> Iterator[T]:
+        """Yield the rows, counting them and the time spent producing them to the stage `name`."""
+        rows = iter(rows)
+        while True:
+            stage = self._push(name)
+            try:
+                row = next(rows)
+            except StopIteration:
+                stage.peak_rss_kb = get_peak_rss_kb()
+                return
+            finally:
+                # The peak RSS is only read once the rows are exhausted, it is a system call
+                self._pop()
+            stage.n_rows += 1
+            yield row
+
+    def format_table(self) -> str:
+        """Return the stats of the stages, in the order they first ran, as a plain text table."""
+        header = ("Stage", "Seconds", "Rows", "Rows/s", "Queries", "Peak RSS (MiB)")
+        lines = [
+            (
+                stage.name,
+                f"{stage.seconds:.3f}",
+                str(stage.n_rows),
+                f"{stage.rows_per_second:.0f}",
+                str(stage.n_queries),
+                f"{stage.peak_rss_kb / 1024:.1f}",
+            )
+            for stage in self.stages.values()
+        ]
+        widths = [max(len(line[i]) for line in [header, *lines]) for i in range(len(header))]
+        return "\n".join(
+            "  ".join(
+                value.ljust(width) if i == 0 else value.rjust(width)
+                for i, (value, width) in enumerate(zip(line, widths))
+            )
+            for line in [header, *lines]
+        )
@@ -1,9 +1,11 @@
-import csv
+import dataclasses
 import datetime as dt
 import enum
-from pathlib import Path
+import functools
+from collections import Counter, defaultdict
+from typing import Iterable, Iterator, Protocol, TypeVar
 
-import smart_open
+from importing.sources import CSV_SUFFIXES, SourcePath, iter_csv_files
 
 
 class ImportDirValidator:
@@ -15,14 +17,14 @@ class ImportDirValidator:
     <Source-Dir>/
     ├── Accounts.csv
     └── Transactions/
-        ├── <Account-AccountID>_<YYYY>-<mm>.csv
+        ├── <InstitutionName>__<AccountID>__<YYYY>-<mm>.csv
         ├── ...
-        └── <Account-AccountID>_<YYYY>-<mm>.csv
+        └── <InstitutionName>__<AccountID>__<YYYY>-<mm>.csv
     ```
     """
 
-    def __init__(self, directory: Path):
-        self.directory: Path = directory
+    def __init__(self, directory: SourcePath):
+        self.directory: SourcePath = directory
 
     def is_valid(self) -> str:
         """Return non-empty error message if the directory structure is valid, else empty string."""
@@ -51,119 +53,144 @@ class AccountInstitution(enum.StrEnum):
     td_canada = "td_canada"
 
 
-class AccountFileValidator:
-    """
-    Validate the account files in the Transactions directory.
-
-    The expected account file name format is:
-    ```
-    <Account-AccountID>_<YYYY>-<mm>-<dd>.csv
-    ```
-    The expected columns in the file are:
-    ```
-    - AccountID: str
-    - Name: str
-    - Institution: str
-    - AmountInitial: float
-    - DateStart: YYYY-MM-DD
-    ```
-    """
-
-    # TODO @imranariffin: Use a schema validation library like pydantic or cerberus
-    # to validate the CSV file structure and data types.
-
-    COLUMNS_EXPECTED = {
-        "AccountID": str,
-        "Name": str,
-        "Institution": str,
-        "AmountInitial": float,
-        "DateStart": dt.date,
-    }
-
-    def __init__(self, source_dir: Path):
-        self.file_path: Path = source_dir / "Accounts.csv"
-
-    def is_valid(self) -> str:
-        """Return non-empty error message if the account file is invalid, else empty string."""
-
-        if not self.file_path.is_file():
-            return f"Account file {self.file_path} is not a file or does not exist."
-
-        with smart_open.open(self.file_path, "r") as fi:
-            reader = csv.DictReader(fi)
-
-            # Validate column names
-            column_names: set[str] = set(reader.fieldnames or [])
-            for column_name_expected in self.COLUMNS_EXPECTED.keys():
-                if column_name_expected not in column_names:
-                    return f"Missing required column in account file {self.file_path}: {column_name_expected}"
-
-            # Validate each row
-            for i, row in enumerate(reader):
-                for column_name, column_type in self.COLUMNS_EXPECTED.items():
-                    value = row[column_name]
-                    if column_type == float:
-                        try:
-                            float(value)
-                        except ValueError:
-                            return (
-                                f"Row {i}: Invalid float value for column {column_name} "
-                                f"in account file {self.file_path}: {value}"
-                            )
-                    elif column_type == dt.date:
-                        try:
-                            dt.datetime.strptime(value, "%Y-%m-%d").date()
-                        except ValueError:
-                            return (
-                                f"Row {i}: Invalid date value for column {column_name} "
-                                f"in account file {self.file_path}: {value}"
-                            )
-                    elif column_type == str:
-                        if not isinstance(value, str):
-                            return (
-                                f"Row {i}: Invalid string value for column {column_name} "
-                                f"in account file {self.file_path}: {value}"
-                            )
-                    else:
-                        return (
-                            f"Unsupported column type {column_type} for column {column_name} "
-                            f"in account file {self.file_path}"
-                        )
-
-        return ""
-
-
 class ImportTransactionDirValidator:
     """
     Validate the structure of the Transactions directory.
 
-    The expected file name format is:
+    The expected file name format is, optionally gzipped:
     ```
-    <Account-AccountID>_<YYYY>-<mm>.csv
+    <InstitutionName>__<AccountID>__<YYYY>-<mm>.csv
     ```
+    The account of the file name is checked against Accounts.csv, see `AccountTransactionValidator`.
     """
 
-    def __init__(self, source_dir: Path) -> None:
+    def __init__(self, source_dir: SourcePath) -> None:
         self.path = source_dir / "Transactions"
 
+    @functools.cached_property
+    def files(self) -> list[SourcePath]:
+        """The transaction files, listed once for both the validation and the import."""
+        return list(iter_csv_files(self.path))
+
     def is_valid(self) -> str:
         """Return non-empty error message if the directory structure is invalid, else empty string."""
 
         # Check for required files
-        for file in self.path.glob("*.csv"):
-            if not file.name.endswith(".csv"):
+        for file in self.files:
+            if not file.name.endswith(CSV_SUFFIXES):
                 return f"Non-CSV file found in directory {self.path}: {file.name}"
 
             if not self._is_valid_transaction_file_name(file.name):
-                return f"Invalid transaction file name in directory {self.path}: {file.name}"
+                return (
+                    f"Invalid transaction file name in directory {self.path}: {file.name}, "
+                    "expected <InstitutionName>__<AccountID>__<YYYY>-<mm>.csv"
+                )
 
         return ""
 
     def _is_valid_transaction_file_name(self, file_name: str) -> bool:
         """Check if the transaction file name matches the expected format."""
-        date_str = file_name.rsplit("_", maxsplit=1)[-1].removesuffix(".csv")
+        parts = file_name.removesuffix(".gz").removesuffix(".csv").split("__")
+        if len(parts) != 3 or not all(parts):
+            return False
+        date_str = parts[2]
         try:
             dt.datetime.strptime(date_str, "%Y-%m").date()
             return True
         except ValueError:
             return False
+
+
+class ITransactionRow(Protocol):
+    account_id: str
+    date: dt.date
+
+
+R = TypeVar("R", bound=ITransactionRow)
+
+
+@dataclasses.dataclass
+class AccountReferenceError:
+    """Transactions referring to an account missing from Accounts.csv, or dated before the account's start."""
+
+    path: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.path}: {self.message}"
+
+
+class AccountTransactionValidator:
+    """
+    Validate the transactions against the accounts of Accounts.csv:
+    1. Each transaction file's account natural ID, and each transaction's, exists in Accounts.csv
+    2. Each transaction date is not before the account's start date
+
+    The transactions are indexed by account as they stream through `iter_indexed`, then the indexes are checked in
+    a single sweep, so that the validation stays linear in the number of rows without reading a file twice or
+    querying the database per row.
+    """
+
+    def __init__(self, date_start_by_account: dict[str, dt.date]) -> None:
+        self.date_start_by_account = date_start_by_account
+        # Earliest transaction of each account and the file it is in
+        self.date_min_by_account: dict[str, tuple[dt.date, SourcePath]] = {}
+        self.n_before_start_by_account: Counter[str] = Counter()
+        self.paths_by_account: dict[str, list[SourcePath]] = defaultdict(list)
+
+    def iter_indexed(self, rows: Iterable[R], path: SourcePath) -> Iterator[R]:
+        """Index the transactions of a file, and yield those of the accounts in Accounts.csv."""
+        self.paths_by_account[get_account_id_from_file_name(path.name)].append(path)
+        date_start_by_account = self.date_start_by_account
+        date_min_by_account = self.date_min_by_account
+        for row in rows:
+            date_min = date_min_by_account.get(row.account_id)
+            if date_min is None or row.date < date_min[0]:
+                date_min_by_account[row.account_id] = (row.date, path)
+            date_start = date_start_by_account.get(row.account_id)
+            # Transactions of unknown accounts cannot be written, they are reported by get_unknown_account_errors
+            if date_start is None:
+                continue
+            if row.date < date_start:
+                self.n_before_start_by_account[row.account_id] += 1
+            yield row
+
+    def get_unknown_account_errors(self) -> list[AccountReferenceError]:
+        """Return an error per transaction file, or file with transactions, of an account missing from Accounts.csv."""
+        errors: list[AccountReferenceError] = []
+        for account_id, paths in self.paths_by_account.items():
+            if account_id not in self.date_start_by_account:
+                errors.extend(
+                    AccountReferenceError(
+                        str(path), f"Account {account_id!r} of the file name is not in Accounts.csv"
+                    )
+                    for path in paths
+                )
+        for account_id, (_, path) in self.date_min_by_account.items():
+            if account_id not in self.date_start_by_account:
+                errors.append(
+                    AccountReferenceError(
+                        str(path), f"Account {account_id!r} of transactions is not in Accounts.csv"
+                    )
+                )
+        return errors
+
+    def get_before_start_errors(self) -> list[AccountReferenceError]:
+        """Return an error per account with transactions dated before its start date."""
+        errors: list[AccountReferenceError] = []
+        for account_id, n_before_start in self.n_before_start_by_account.items():
+            date_min, path = self.date_min_by_account[account_id]
+            errors.append(
+                AccountReferenceError(
+                    str(path),
+                    f"{n_before_start} transactions of account {account_id!r} are dated before its start date "
+                    f"{self.date_start_by_account[account_id]}, the earliest on {date_min}",
+                )
+            )
+        return errors
+
+
+def get_account_id_from_file_name(file_name: str) -> str:
+    """Return the account natural ID of a transaction file name validated by `ImportTransactionDirValidator`."""
+    # <InstitutionName>__<AccountID>__<YYYY>-<mm>.csv
+    return file_name.split("__")[1]
@@ -1,8 +1,8 @@
-from pathlib import Path
+from importing.sources import CSV_SUFFIXES, SourcePath
 
 
 class ImportDirParserValidator:
-    def __init__(self, source_dir: Path) -> None:
+    def __init__(self, source_dir: SourcePath) -> None:
         self.source_dir = source_dir
 
     def is_valid(self) -> str:
@@ -15,7 +15,7 @@ class ImportDirParserValidator:
             if file.is_dir():
                 continue
 
-            if not file.name.endswith(".csv"):
+            if not file.name.endswith(CSV_SUFFIXES):
                 return f"Non-CSV file found in source directory: {file.name}"
 
         return ""
@@ -1,3 +1,48 @@
-from django.shortcuts import render
+from typing import TYPE_CHECKING, Any
 
-# Create your views here.
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.generic import View
+
+from importing.jobs import ImportJobService, InvalidImportUpload
+from importing.models import ImportJob
+
+if TYPE_CHECKING:  # pragma: no cover
+    from django.http import HttpRequest, HttpResponse
+
+
+class StaffRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """Only let staff users in, the others get a 403 rather than a redirect to a login page."""
+
+    raise_exception = True
+
+    def test_func(self) -> bool:
+        return self.request.user.is_staff
+
+
+class ImportJobCreateView(StaffRequiredMixin, View):
+    """Queue the import of an uploaded archive of an import directory, and return where to poll its status."""
+
+    def post(self, request: "HttpRequest", *args: Any, **kwargs: Any) -> "HttpResponse":
+        upload = request.FILES.get("file")
+        if upload is None:
+            return HttpResponseBadRequest("Missing file: upload the archive of an import directory as 'file'")
+        try:
+            job = ImportJobService().queue_import(upload, upload.name or "", user=request.user)
+        except InvalidImportUpload as e:
+            return HttpResponseBadRequest(str(e))
+
+        status_url = reverse("api-import-status", kwargs={"job_id": job.id})
+        response = JsonResponse({"id": job.id, "status": job.status, "status_url": status_url}, status=202)
+        response["Location"] = status_url
+        return response
+
+
+class ImportJobStatusView(StaffRequiredMixin, View):
+    """Return the status and the progress of an import job, to be polled until it succeeds or fails."""
+
+    def get(self, request: "HttpRequest", *args: Any, **kwargs: Any) -> "HttpResponse":
+        job = get_object_or_404(ImportJob, id=kwargs["job_id"])
+        return JsonResponse(ImportJobService().get_status(job))
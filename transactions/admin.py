@@ -1,11 +1,58 @@
+import datetime as dt
+
 from django.contrib import admin
+from django.db.models import Min, QuerySet
+from django.db.transaction import atomic
+
+from config.admin import DataVersionAdminMixin
+
+from .models import DailyBalance, MonthlyBalance, Transaction
+from .services import DailyBalanceWriteService, _touch
 
-from .models import Transaction
+
+def _get_date_touched_by_account(transactions: QuerySet[Transaction]) -> dict[int, dt.date]:
+    return dict(
+        transactions.values("account_id").annotate(date_min=Min("date")).values_list("account_id", "date_min")
+    )
 
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(DataVersionAdminMixin, admin.ModelAdmin):
     list_display = ("transaction_id", "account__natural_id", "account__name", "amount", "date", "created_at")
     list_display_links = ("transaction_id", "account__natural_id")
     search_fields = ("transaction_id", "date")
     list_filter = ("account__natural_id", "account__name")
+    date_hierarchy = "date"
+
+    # The daily balances of the accounts are rebuilt from the earliest date an edit touched, before and after it
+
+    def save_model(self, request, obj, form, change):
+        date_touched_by_account = _get_date_touched_by_account(Transaction.objects.filter(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+        if not change or {"account", "amount", "date"} & set(form.changed_data):
+            _touch(date_touched_by_account, obj.account_id, obj.date)
+            DailyBalanceWriteService().refresh_daily_balances(date_touched_by_account)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        DailyBalanceWriteService().refresh_daily_balances({obj.account_id: obj.date})
+
+    @atomic
+    def delete_queryset(self, request, queryset):
+        date_touched_by_account = _get_date_touched_by_account(queryset)
+        super().delete_queryset(request, queryset)
+        DailyBalanceWriteService().refresh_daily_balances(date_touched_by_account)
+
+
+@admin.register(DailyBalance)
+class DailyBalanceAdmin(admin.ModelAdmin):
+    list_display = ("account__natural_id", "date", "net_flow", "closing_balance")
+    search_fields = ("date",)
+    list_filter = ("account__natural_id",)
+
+
+@admin.register(MonthlyBalance)
+class MonthlyBalanceAdmin(admin.ModelAdmin):
+    list_display = ("account__natural_id", "month", "closing_balance")
+    search_fields = ("month",)
+    list_filter = ("account__natural_id",)
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:54
+
+import decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_daily_balances(apps, schema_editor):
+    # Same as `transactions.services.DailyBalanceWriteService._refresh_account` from the earliest transaction,
+    # copied as migrations must not depend on app code. Re-imports skip unchanged rows, so the balances of the
+    # transactions imported before this migration would otherwise never be computed
+    Account = apps.get_model("householdentities", "Account")
+    DailyBalance = apps.get_model("transactions", "DailyBalance")
+    Transaction = apps.get_model("transactions", "Transaction")
+    for account_id, date_start, balance_initial in Account.objects.values_list(
+        "id", "date_start", "balance_initial"
+    ):
+        net_flow_by_date = {
+            date: total
+            for date, total in Transaction.objects.filter(account_id=account_id)
+            .values("date")
+            .annotate(total=Sum("amount"))
+            .order_by()
+            .values_list("date", "total")
+        }
+        net_flow_by_date.setdefault(date_start, decimal.Decimal())
+
+        closing_balance = decimal.Decimal()
+        daily_balances = []
+        for date in sorted(net_flow_by_date):
+            closing_balance += net_flow_by_date[date]
+            if date == date_start:
+                closing_balance += balance_initial
+            daily_balances.append(
+                DailyBalance(
+                    account_id=account_id,
+                    date=date,
+                    net_flow=net_flow_by_date[date],
+                    closing_balance=closing_balance,
+                )
+            )
+        DailyBalance.objects.bulk_create(daily_balances, batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("householdentities", "0001_initial"),
+        ("transactions", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyBalance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("net_flow", models.DecimalField(decimal_places=4, max_digits=12)),
+                ("closing_balance", models.DecimalField(decimal_places=4, max_digits=16)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_balances",
+                        to="householdentities.account",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("account", "date"), name="unique_daily_balance_account_date"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_daily_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("householdentities", "0001_initial"),
+        ("transactions", "0002_dailybalance"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(fields=["account", "date", "amount"], name="trx_account_date_amount_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(fields=["date"], name="trx_date_idx"),
+        ),
+    ]
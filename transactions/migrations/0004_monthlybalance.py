@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("householdentities", "0001_initial"),
+        ("transactions", "0003_transaction_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyBalance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("month", models.DateField(help_text="First day of the month.")),
+                ("closing_balance", models.DecimalField(decimal_places=4, max_digits=16)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="monthly_balances",
+                        to="householdentities.account",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("account", "month"), name="unique_monthly_balance_account_month"
+                    )
+                ],
+            },
+        ),
+    ]
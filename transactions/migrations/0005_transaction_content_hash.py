@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:20
+
+import decimal
+import hashlib
+
+from django.db import migrations, models
+
+AMOUNT_QUANTUM = decimal.Decimal("0.0001")
+
+
+def backfill_content_hash(apps, schema_editor):
+    # Same as `transactions.services.get_content_hash`, copied as migrations must not depend on app code
+    Transaction = apps.get_model("transactions", "Transaction")
+    qs = Transaction.objects.select_related("account").only("id", "date", "amount", "account__natural_id")
+    transactions = []
+    for trx in qs.iterator(chunk_size=1000):
+        content = f"{trx.account.natural_id}|{trx.date.isoformat()}|{trx.amount.quantize(AMOUNT_QUANTUM)}"
+        trx.content_hash = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        transactions.append(trx)
+        if len(transactions) == 1000:
+            Transaction.objects.bulk_update(transactions, fields=["content_hash"])
+            transactions = []
+    Transaction.objects.bulk_update(transactions, fields=["content_hash"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("transactions", "0004_monthlybalance"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Hash of the imported account, date and amount, unchanged rows are not rewritten on re-import.",
+                max_length=32,
+            ),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:56
+
+from django.db import migrations
+
+
+def backfill_monthly_balances(apps, schema_editor):
+    # Same as `transactions.services.DailyBalanceWriteService._refresh_monthly_balances` from the first month,
+    # copied as migrations must not depend on app code. Re-imports skip unchanged rows, so the checkpoints of the
+    # transactions imported before them would otherwise never be computed
+    DailyBalance = apps.get_model("transactions", "DailyBalance")
+    MonthlyBalance = apps.get_model("transactions", "MonthlyBalance")
+    MonthlyBalance.objects.all().delete()
+
+    monthly_balances = []
+    closing_by_month = {}
+    account_id_last = None
+    for account_id, date, closing_balance in (
+        DailyBalance.objects.order_by("account_id", "date")
+        .values_list("account_id", "date", "closing_balance")
+        .iterator(chunk_size=1000)
+    ):
+        if account_id != account_id_last:
+            monthly_balances += _to_monthly_balances(MonthlyBalance, account_id_last, closing_by_month)
+            closing_by_month = {}
+            account_id_last = account_id
+        closing_by_month[date.replace(day=1)] = closing_balance
+    monthly_balances += _to_monthly_balances(MonthlyBalance, account_id_last, closing_by_month)
+    MonthlyBalance.objects.bulk_create(monthly_balances, batch_size=500)
+
+
+def _to_monthly_balances(MonthlyBalance, account_id, closing_by_month):
+    return [
+        MonthlyBalance(account_id=account_id, month=month, closing_balance=closing_balance)
+        for month, closing_balance in closing_by_month.items()
+    ]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("transactions", "0005_transaction_content_hash"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_monthly_balances, migrations.RunPython.noop),
+    ]
@@ -17,8 +17,82 @@ class Transaction(models.Model):
         max_digits=12,
     )
     date = models.DateField(null=False)
+    content_hash = models.CharField(
+        max_length=32,
+        blank=True,
+        default="",
+        help_text="Hash of the imported account, date and amount, unchanged rows are not rewritten on re-import.",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Covers the per-account date range aggregations of the charts without touching the table
+            models.Index(fields=["account", "date", "amount"], name="trx_account_date_amount_idx"),
+            models.Index(fields=["date"], name="trx_date_idx"),
+        ]
+
     def __str__(self):
         return f"{self.__class__.__name__} ({self.transaction_id}: {self.amount})"
+
+
+class DailyBalance(models.Model):
+    """Pre-computed end-of-day balance per account, maintained incrementally on import."""
+
+    account = models.ForeignKey(
+        "householdentities.Account",
+        on_delete=models.CASCADE,
+        related_name="daily_balances",
+        null=False,
+        blank=False,
+    )
+    date = models.DateField(null=False)
+    net_flow = models.DecimalField(
+        null=False,
+        decimal_places=4,
+        max_digits=12,
+    )
+    closing_balance = models.DecimalField(
+        null=False,
+        decimal_places=4,
+        max_digits=16,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["account", "date"], name="unique_daily_balance_account_date"),
+        ]
+
+    def __str__(self):
+        return f"{self.__class__.__name__} ({self.account_id}@{self.date}: {self.closing_balance})"
+
+
+class MonthlyBalance(models.Model):
+    """
+    Month-end balance checkpoint per account, maintained incrementally on import.
+
+    Only months with activity get a checkpoint, the balance is unchanged in between.
+    """
+
+    account = models.ForeignKey(
+        "householdentities.Account",
+        on_delete=models.CASCADE,
+        related_name="monthly_balances",
+        null=False,
+        blank=False,
+    )
+    month = models.DateField(null=False, help_text="First day of the month.")
+    closing_balance = models.DecimalField(
+        null=False,
+        decimal_places=4,
+        max_digits=16,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["account", "month"], name="unique_monthly_balance_account_month"),
+        ]
+
+    def __str__(self):
+        return f"{self.__class__.__name__} ({self.account_id}@{self.month:%Y-%m}: {self.closing_balance})"
@@ -1,10 +1,18 @@
 import datetime as dt
 import decimal
-from dataclasses import dataclass
-from typing import Iterator, Protocol
+import hashlib
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Protocol
 
+from django.db import IntegrityError
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Trunc
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from householdentities.models import Account
 from householdentities.services import EntityService
-from transactions.models import Transaction
+from transactions.models import DailyBalance, MonthlyBalance, Transaction
 from utils import it
 
 
@@ -22,58 +30,361 @@ class TransactionForAccount:
     date: dt.date
 
 
+@dataclass
+class TransactionImportContext:
+    """
+    Lookups loaded once per import and shared by all of its batches.
+
+    The account map is small and fixed for the run. The set of existing transaction IDs lets a batch skip the
+    existence query when none of its IDs exist yet, which is the case for most batches of an incremental
+    import, and for all of them on a first import. The earliest date touched per account since the balances
+    were last refreshed is kept here too, so that they can be refreshed at each commit of the import.
+    """
+
+    account_id_map: dict[str, int]
+    transaction_ids_existing: set[str] = field(default_factory=set)
+    date_touched_by_account: dict[int, dt.date] = field(default_factory=dict)
+
+    @classmethod
+    def load(
+        cls, entity_service: EntityService, accounts: Iterable[str] | None = None
+    ) -> "TransactionImportContext":
+        """
+        Load the lookups of an import.
+
+        :param accounts: The natural IDs of the imported accounts, only their transaction IDs are loaded. All
+            transaction IDs are loaded if not given. A transaction that moved from another account is found when
+            its insert fails, see `TransactionWriteService._create_new_transactions`.
+        """
+        account_id_map = entity_service.get_all_account_id_map()
+        transactions = Transaction.objects.all()
+        if accounts is not None:
+            transactions = transactions.filter(
+                account_id__in=[account_id_map[account] for account in accounts if account in account_id_map]
+            )
+        return cls(
+            account_id_map=account_id_map,
+            transaction_ids_existing=set(transactions.values_list("transaction_id", flat=True)),
+        )
+
+
+AMOUNT_QUANTUM = decimal.Decimal("0.0001")
+
+
+def get_content_hash(account_id: str, date: dt.date, amount: decimal.Decimal) -> str:
+    """Return the hash of the imported content of a transaction, its account natural ID, date and amount."""
+    # The amount is quantized as stored, "100.00" and "100.0000" are the same content
+    content = f"{account_id}|{date.isoformat()}|{amount.quantize(AMOUNT_QUANTUM)}"
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def _touch(date_touched_by_account: dict[int, dt.date], account_id: int, date: dt.date) -> None:
+    if account_id not in date_touched_by_account or date < date_touched_by_account[account_id]:
+        date_touched_by_account[account_id] = date
+
+
 class TransactionWriteService:
     _entity_service: EntityService
+    _daily_balance_service: "DailyBalanceWriteService"
 
-    def __init__(self, entity_service: EntityService) -> None:
+    def __init__(
+        self,
+        entity_service: EntityService,
+        daily_balance_service: "DailyBalanceWriteService | None" = None,
+    ) -> None:
         self._entity_service = entity_service
+        self._daily_balance_service = daily_balance_service or DailyBalanceWriteService()
 
     def bulk_create_or_update_transactions(
-        self, transactions: Iterator[ITransactionInput]
-    ) -> tuple[int, int]:
+        self,
+        transactions: Iterator[ITransactionInput],
+        batch_size: int = 100,
+        upsert: bool = False,
+        context: TransactionImportContext | None = None,
+    ) -> tuple[int, int, int]:
+        """
+        Create or update transactions by transaction ID, `batch_size` transactions at a time.
+
+        Existing transactions whose content hash is unchanged are not written at all.
+
+        :param upsert: Write each batch with a single `INSERT ... ON CONFLICT DO UPDATE` instead of a bulk
+            create plus a bulk update of the fetched existing rows.
+        :param context: The lookups shared by the batches, loaded from the database if not given.
+        :return: The number of transactions created, updated and unchanged.
+        """
+        context = context or TransactionImportContext.load(self._entity_service)
         n_created = 0
         n_updated = 0
+        n_unchanged = 0
+        # Earliest date touched per account, the daily balances are only rebuilt from there on
+        date_touched_by_account: dict[int, dt.date] = context.date_touched_by_account
+
+        write_batch = self._upsert_transactions if upsert else self._create_or_update_transactions
+        for transactions_chunked in it.iter_chunked(transactions, size=batch_size):
+            created, updated, unchanged = write_batch(transactions_chunked, date_touched_by_account, context)
+            n_created += created
+            n_updated += updated
+            n_unchanged += unchanged
+
+        self.refresh_balances(context)
+
+        return n_created, n_updated, n_unchanged
+
+    def refresh_balances(self, context: TransactionImportContext) -> bool:
+        """
+        Refresh the balances of the accounts touched since the last refresh of `context`.
+
+        Called between batches, e.g. before an import commits, so that committed transactions always have their
+        balances.
+
+        :return: Whether any account was touched.
+        """
+        if not context.date_touched_by_account:
+            return False
+        self._daily_balance_service.refresh_daily_balances(context.date_touched_by_account)
+        context.date_touched_by_account.clear()
+        return True
 
-        for transactions_chunked in it.iter_chunked(transactions, size=100):
-            transaction_ids: set[str] = {trx.transaction_id for trx in transactions_chunked}
-            transactions_existing: dict[str, Transaction] = {
+    def _create_or_update_transactions(
+        self,
+        transactions: tuple[ITransactionInput, ...],
+        date_touched_by_account: dict[int, dt.date],
+        context: TransactionImportContext,
+    ) -> tuple[int, int, int]:
+        transaction_ids_existing: set[str] = context.transaction_ids_existing.intersection(
+            trx.transaction_id for trx in transactions
+        )
+        transactions_existing: dict[str, Transaction] = (
+            {
                 trx.transaction_id: trx
-                for trx in Transaction.objects.filter(transaction_id__in=transaction_ids)
+                for trx in Transaction.objects.filter(transaction_id__in=transaction_ids_existing)
             }
-            account_natural_ids: set[str] = {trx.account_id for trx in transactions_chunked}
-            account_id_map: dict[str, int] = self._entity_service.get_account_id_map(
-                account_ids=account_natural_ids
-            )
+            if transaction_ids_existing
+            else {}
+        )
+        account_id_map: dict[str, int] = context.account_id_map
+
+        transactions_create: list[Transaction] = []
+        transactions_update: list[Transaction] = []
+        n_unchanged = 0
+        updated_at = timezone.now()
+
+        for trx in transactions:
+            content_hash = get_content_hash(trx.account_id, trx.date, trx.amount)
+            if trx.transaction_id in transactions_existing:
+                trx_existing = transactions_existing[trx.transaction_id]
+                if trx_existing.content_hash == content_hash:
+                    n_unchanged += 1
+                    continue
+
+                # Update existing transaction
+                _touch(date_touched_by_account, trx_existing.account_id, trx_existing.date)
+                trx_existing.amount = trx.amount
+                trx_existing.date = trx.date
+                trx_existing.account_id = account_id_map[trx.account_id]
+                trx_existing.content_hash = content_hash
+                trx_existing.updated_at = updated_at
+                transactions_update.append(trx_existing)
+                _touch(date_touched_by_account, trx_existing.account_id, trx_existing.date)
 
-            transactions_create: list[Transaction] = []
-            transactions_update: list[Transaction] = []
-
-            for trx in transactions_chunked:
-                if trx.transaction_id in transactions_existing:
-                    # Update existing transaction
-                    trx_existing = transactions_existing[trx.transaction_id]
-                    trx_existing.amount = trx.amount
-                    trx_existing.date = trx.date
-                    trx_existing.account_id = account_id_map[trx.account_id]
-                    transactions_update.append(trx_existing)
-
-                else:
-                    # Create new transaction
-                    transactions_create.append(
-                        Transaction(
-                            transaction_id=trx.transaction_id,
-                            amount=trx.amount,
-                            date=trx.date,
-                            account_id=account_id_map[trx.account_id],
-                        )
+            else:
+                # Create new transaction
+                transactions_create.append(
+                    Transaction(
+                        transaction_id=trx.transaction_id,
+                        amount=trx.amount,
+                        date=trx.date,
+                        account_id=account_id_map[trx.account_id],
+                        content_hash=content_hash,
                     )
+                )
+                _touch(date_touched_by_account, account_id_map[trx.account_id], trx.date)
 
-            n_created += len(Transaction.objects.bulk_create(transactions_create))
-            n_updated += Transaction.objects.bulk_update(
-                transactions_update, fields=["amount", "date", "account_id"]
+        if not self._create_new_transactions(transactions_create, context):
+            return self._create_or_update_transactions(transactions, date_touched_by_account, context)
+        n_updated = Transaction.objects.bulk_update(
+            transactions_update, fields=["amount", "date", "account_id", "content_hash", "updated_at"]
+        )
+        return len(transactions_create), n_updated, n_unchanged
+
+    def _create_new_transactions(
+        self, transactions: list[Transaction], context: TransactionImportContext
+    ) -> bool:
+        """
+        Create transactions whose IDs are not in `context`, and return whether none of them existed.
+
+        The context may only know the transaction IDs of the imported accounts, a transaction that moved from
+        another account fails the insert. Its ID is then added to the context, for the batch to be written again
+        as an update.
+        """
+        if not transactions:
+            return True
+        try:
+            with atomic():
+                Transaction.objects.bulk_create(transactions)
+        except IntegrityError:
+            transaction_ids_existing = set(
+                Transaction.objects.filter(
+                    transaction_id__in=[trx.transaction_id for trx in transactions]
+                ).values_list("transaction_id", flat=True)
             )
+            if not transaction_ids_existing:
+                raise
+            context.transaction_ids_existing.update(transaction_ids_existing)
+            return False
+        context.transaction_ids_existing.update(trx.transaction_id for trx in transactions)
+        return True
+
+    def _upsert_transactions(
+        self,
+        transactions: tuple[ITransactionInput, ...],
+        date_touched_by_account: dict[int, dt.date],
+        context: TransactionImportContext,
+    ) -> tuple[int, int, int]:
+        # The last occurrence wins if a transaction ID is repeated within the batch
+        transactions_by_id: dict[str, ITransactionInput] = {trx.transaction_id: trx for trx in transactions}
 
-        return n_created, n_updated
+        # Only the old dates and hashes of the existing rows are read, for the balance refresh and to skip
+        # the unchanged rows
+        transaction_ids_existing: set[str] = context.transaction_ids_existing.intersection(transactions_by_id)
+        existing_by_id: dict[str, tuple[int, dt.date, str]] = {}
+        if transaction_ids_existing:
+            for transaction_id, account_id, date, content_hash in Transaction.objects.filter(
+                transaction_id__in=transaction_ids_existing
+            ).values_list("transaction_id", "account_id", "date", "content_hash"):
+                existing_by_id[transaction_id] = (account_id, date, content_hash)
+
+        account_id_map: dict[str, int] = context.account_id_map
+        transactions_upsert: list[Transaction] = []
+        n_unchanged = 0
+        for trx in transactions_by_id.values():
+            content_hash = get_content_hash(trx.account_id, trx.date, trx.amount)
+            if trx.transaction_id in existing_by_id:
+                account_id_existing, date_existing, content_hash_existing = existing_by_id[trx.transaction_id]
+                if content_hash_existing == content_hash:
+                    n_unchanged += 1
+                    continue
+                _touch(date_touched_by_account, account_id_existing, date_existing)
+
+            transactions_upsert.append(
+                Transaction(
+                    transaction_id=trx.transaction_id,
+                    amount=trx.amount,
+                    date=trx.date,
+                    account_id=account_id_map[trx.account_id],
+                    content_hash=content_hash,
+                )
+            )
+            _touch(date_touched_by_account, account_id_map[trx.account_id], trx.date)
+
+        # The rows not known to exist are inserted on their own, to find those that moved from another account
+        if not self._create_new_transactions(
+            [trx for trx in transactions_upsert if trx.transaction_id not in existing_by_id], context
+        ):
+            return self._upsert_transactions(transactions, date_touched_by_account, context)
+        transactions_upsert = [trx for trx in transactions_upsert if trx.transaction_id in existing_by_id]
+        if transactions_upsert:
+            Transaction.objects.bulk_create(
+                transactions_upsert,
+                update_conflicts=True,
+                unique_fields=["transaction_id"],
+                update_fields=["amount", "date", "account", "content_hash", "updated_at"],
+            )
+        context.transaction_ids_existing.update(transactions_by_id)
+        n_updated = len(existing_by_id) - n_unchanged
+        return len(transactions_by_id) - len(existing_by_id), n_updated, n_unchanged
+
+
+class DailyBalanceWriteService:
+    def refresh_daily_balances(self, date_fr_by_account: dict[int, dt.date]) -> int:
+        """
+        Rebuild the daily balances and monthly checkpoints of each account from the given date onwards.
+
+        Rows before the given date are kept as is and their latest closing balance is carried in.
+
+        :param date_fr_by_account: The earliest date touched per account (by primary key).
+        :return: The number of daily balance rows written.
+        """
+        n_written = 0
+        for account_id, date_fr in date_fr_by_account.items():
+            n_written += self._refresh_account(account_id, date_fr)
+        return n_written
+
+    @atomic
+    def _refresh_account(self, account_id: int, date_fr: dt.date) -> int:
+        account = Account.objects.filter(id=account_id).values_list("date_start", "balance_initial").first()
+        if account is None:
+            return 0
+        date_start, balance_initial = account
+
+        closing_balance: decimal.Decimal | None = (
+            DailyBalance.objects.filter(account_id=account_id, date__lt=date_fr)
+            .order_by("-date")
+            .values_list("closing_balance", flat=True)
+            .first()
+        )
+        if closing_balance is None:
+            # Nothing to carry in, the transactions before `date_fr` may never have been counted, e.g. on a
+            # database imported before the read model existed, so it is rebuilt from the earliest transaction
+            date_earliest: dt.date | None = (
+                Transaction.objects.filter(account_id=account_id)
+                .order_by("date")
+                .values_list("date", flat=True)
+                .first()
+            )
+            date_fr = min(date_fr, date_start, date_earliest or date_fr)
+            closing_balance = decimal.Decimal()
+        DailyBalance.objects.filter(account_id=account_id, date__gte=date_fr).delete()
+
+        net_flow_by_date: dict[dt.date, decimal.Decimal] = {
+            date: total
+            for date, total in Transaction.objects.filter(account_id=account_id, date__gte=date_fr)
+            .values("date")
+            .annotate(total=Sum("amount"))
+            .order_by()
+            .values_list("date", "total")
+        }
+        if date_start >= date_fr:
+            net_flow_by_date.setdefault(date_start, decimal.Decimal())
+
+        daily_balances: list[DailyBalance] = []
+        for date in sorted(net_flow_by_date):
+            net_flow = net_flow_by_date[date]
+            closing_balance += net_flow
+            if date == date_start:
+                closing_balance += balance_initial
+            daily_balances.append(
+                DailyBalance(
+                    account_id=account_id,
+                    date=date,
+                    net_flow=net_flow,
+                    closing_balance=closing_balance,
+                )
+            )
+
+        n_written = len(DailyBalance.objects.bulk_create(daily_balances, batch_size=500))
+        self._refresh_monthly_balances(account_id, date_fr.replace(day=1))
+        return n_written
+
+    def _refresh_monthly_balances(self, account_id: int, month_fr: dt.date) -> None:
+        """Rebuild the month-end checkpoints from `month_fr` onwards, from the last daily balance of each month."""
+        MonthlyBalance.objects.filter(account_id=account_id, month__gte=month_fr).delete()
+
+        closing_by_month: dict[dt.date, decimal.Decimal] = {}
+        for date, closing_balance in (
+            DailyBalance.objects.filter(account_id=account_id, date__gte=month_fr)
+            .order_by("date")
+            .values_list("date", "closing_balance")
+        ):
+            closing_by_month[date.replace(day=1)] = closing_balance
+
+        MonthlyBalance.objects.bulk_create(
+            (
+                MonthlyBalance(account_id=account_id, month=month, closing_balance=closing_balance)
+                for month, closing_balance in closing_by_month.items()
+            ),
+            batch_size=500,
+        )
 
 
 class TransactionReadService:
@@ -85,6 +396,116 @@ class TransactionReadService:
                 date=trx.date,
             )
 
+    def get_amount_total_before(self, accounts: list[int], date: dt.date) -> decimal.Decimal:
+        """Return the sum of all transaction amounts of the given accounts strictly before `date`."""
+        qs = Transaction.objects.filter(account_id__in=accounts, date__lt=date)
+        return qs.aggregate(total=Sum("amount"))["total"] or decimal.Decimal()
+
+    def get_amount_by_date(
+        self, accounts: list[int], date_fr: dt.date, date_to: dt.date
+    ) -> dict[dt.date, decimal.Decimal]:
+        """Return the sum of transaction amounts per date of the given accounts within [date_fr, date_to]."""
+        qs = (
+            Transaction.objects.filter(account_id__in=accounts, date__gte=date_fr, date__lte=date_to)
+            .values("date")
+            .annotate(total=Sum("amount"))
+            .order_by()
+            .values_list("date", "total")
+        )
+        return {date: total for date, total in qs}
+
+    def get_amount_by_account_date(
+        self, accounts: list[int], date_fr: dt.date, date_to: dt.date
+    ) -> Iterator[tuple[int, dt.date, decimal.Decimal]]:
+        """Yield the sum of transaction amounts per (account, date) within [date_fr, date_to]."""
+        qs = (
+            Transaction.objects.filter(account_id__in=accounts, date__gte=date_fr, date__lte=date_to)
+            .values("account_id", "date")
+            .annotate(total=Sum("amount"))
+            .order_by()
+            .values_list("account_id", "date", "total")
+        )
+        yield from qs.iterator()
+
+    def get_balance_as_of(self, accounts: list[int], date: dt.date) -> dict[int, decimal.Decimal]:
+        """
+        Return the balance at the end of `date` per account, initial balance included.
+
+        Reads the latest monthly checkpoint before the month of `date`, plus at most a month of transactions.
+        """
+        month_start = date.replace(day=1)
+        checkpoint_latest = (
+            MonthlyBalance.objects.filter(account_id=OuterRef("id"), month__lt=month_start)
+            .order_by("-month")
+            .values("closing_balance")[:1]
+        )
+        amount_month = (
+            Transaction.objects.filter(account_id=OuterRef("id"), date__gte=month_start, date__lte=date)
+            .values("account_id")
+            .annotate(total=Sum("amount"))
+            .order_by()
+            .values("total")
+        )
+        qs = (
+            Account.objects.filter(id__in=accounts)
+            .annotate(checkpoint=Subquery(checkpoint_latest), amount_month=Subquery(amount_month))
+            .values_list("id", "date_start", "balance_initial", "checkpoint", "amount_month")
+        )
+
+        balance_by_account: dict[int, decimal.Decimal] = {}
+        for account_id, date_start, balance_initial, checkpoint, amount_month in qs:
+            balance = (checkpoint or decimal.Decimal()) + (amount_month or decimal.Decimal())
+            if month_start <= date_start <= date:
+                balance += balance_initial
+            balance_by_account[account_id] = balance
+        return balance_by_account
+
+    def get_closing_balance_before(self, accounts: list[int], date: dt.date) -> dict[int, decimal.Decimal]:
+        """Return the latest pre-computed closing balance strictly before `date` per account."""
+        closing_balance_latest = (
+            DailyBalance.objects.filter(account_id=OuterRef("id"), date__lt=date)
+            .order_by("-date")
+            .values("closing_balance")[:1]
+        )
+        qs = (
+            Account.objects.filter(id__in=accounts)
+            .annotate(closing_balance=Subquery(closing_balance_latest))
+            .values_list("id", "closing_balance")
+        )
+        return {
+            account_id: closing_balance for account_id, closing_balance in qs if closing_balance is not None
+        }
+
+    def get_closing_balances(
+        self, accounts: list[int], date_fr: dt.date, date_to: dt.date
+    ) -> Iterator[tuple[int, dt.date, decimal.Decimal]]:
+        """Yield pre-computed (account, date, closing balance) rows within [date_fr, date_to] by date."""
+        qs = (
+            DailyBalance.objects.filter(account_id__in=accounts, date__gte=date_fr, date__lte=date_to)
+            .order_by("date")
+            .values_list("account_id", "date", "closing_balance")
+        )
+        yield from qs.iterator()
+
+    def get_net_flow_by_account_period(
+        self, accounts: list[int], date_fr: dt.date, date_to: dt.date, kind: str
+    ) -> Iterator[tuple[int, dt.date, decimal.Decimal]]:
+        """
+        Yield the pre-computed net flows within [date_fr, date_to] summed per (account, period).
+
+        :param kind: The period to group by, one of "day", "week" or "month". Periods are keyed by their
+            first day (Monday for weeks).
+        """
+        qs = (
+            DailyBalance.objects.filter(account_id__in=accounts, date__gte=date_fr, date__lte=date_to)
+            .annotate(period=Trunc("date", kind))
+            .values("account_id", "period")
+            .annotate(total=Sum("net_flow"))
+            .order_by()
+            .values_list("account_id", "period", "total")
+        )
+        yield from qs.iterator()
+
     def get_earliest_latest_date(self) -> tuple[dt.date, dt.date] | tuple[None, None]:
         qs = Transaction.objects.values_list("date", flat=True)
         earliest = qs.order_by("date").first()